@@ -0,0 +1,245 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_
+
+from app import db
+from calculator import analyze_screenshot
+from image_hash import perceptual_hash, hash_chunks, hamming_distance, \
+    HASH_CHUNKS, MAX_HASH_DISTANCE
+from jobs import RUNNING, DONE, FAILED
+from models import Screenshot, ScreenshotAnalysis
+from storage import screenshot_path
+
+PHASH_COLUMNS = tuple('phash_{}'.format(i) for i in range(HASH_CHUNKS))
+# Analyses still running after this many seconds, and not queued in this
+# process, are assumed lost (e.g. their worker restarted) and are requeued.
+ANALYSIS_TIMEOUT = 120
+DEFAULT_OCR_WORKERS = 1
+
+
+class AnalysisQueue:
+    """
+    Runs screenshot OCR in a pool of worker processes.
+
+    OCR takes from a few hundred milliseconds to several seconds per
+    screenshot, so requests only queue it and return; results are stored
+    in the ScreenshotAnalysis table keyed by screenshot id, where pages
+    poll for them and confirm_update reuses them.
+    """
+
+    def __init__(self, max_workers=DEFAULT_OCR_WORKERS):
+        self.max_workers = max_workers
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def init_app(self, app):
+        """Read the pool size from the app config."""
+        self.max_workers = app.config.get('OCR_WORKERS') or self.max_workers
+        app.extensions['analysis_queue'] = self
+
+    def _get_executor(self):
+        """Start the worker pool on first use."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self.executor
+
+    def submit(self, screenshot, reuse=True):
+        """
+        Queues a screenshot for analysis.
+
+        The screenshot is hashed first; if the same user already has an
+        analyzed near-duplicate, its result is reused and OCR is skipped.
+        Runs inline instead when OCR_EAGER is set.
+
+        Args:
+            screenshot (Screenshot): The screenshot to analyze.
+            reuse (bool): Whether a near-duplicate's result may be reused.
+
+        Returns:
+            ScreenshotAnalysis: The analysis, marked as running.
+        """
+        analysis = screenshot.analysis or \
+            ScreenshotAnalysis(screenshot=screenshot)
+        analysis.status = RUNNING
+        analysis.result = None
+        analysis.error = None
+        analysis.reused_from = None
+        analysis.updated_at = datetime.now()
+        db.session.add(analysis)
+        db.session.commit()
+
+        screenshot_id = screenshot.id
+        try:
+            filepath = os.path.abspath(screenshot_path(screenshot))
+        except OSError as e:
+            self._store(screenshot_id, error=str(e) or type(e).__name__)
+            return analysis
+        if screenshot.phash is not None:
+            self._hashed(screenshot_id, filepath, int(screenshot.phash, 16),
+                         reuse)
+        else:
+            self._run(
+                screenshot_id, perceptual_hash, filepath,
+                lambda phash: self._hashed(screenshot_id, filepath, phash,
+                                           reuse)
+            )
+        return analysis
+
+    def _run(self, screenshot_id, function, filepath, on_result):
+        """
+        Runs one stage of an analysis in the worker pool.
+
+        Args:
+            screenshot_id (int): The screenshot being analyzed.
+            function (callable): A picklable function of the file path.
+            filepath (str): The path to the screenshot's image.
+            on_result (callable): Called with the function's result, within
+                                  an app context.
+        """
+        if current_app.config.get('OCR_EAGER'):
+            try:
+                result = function(filepath)
+            except Exception as e:
+                self._store(screenshot_id, error=str(e) or type(e).__name__)
+            else:
+                on_result(result)
+            return
+
+        app = current_app._get_current_object()
+        with self.lock:
+            future = self._get_executor().submit(function, filepath)
+            self.pending[screenshot_id] = future
+        future.add_done_callback(
+            lambda future: self._stage_done(app, screenshot_id, future,
+                                            on_result)
+        )
+
+    def _stage_done(self, app, screenshot_id, future, on_result):
+        """Hand a finished stage's result on, or record its failure."""
+        try:
+            try:
+                result, error = future.result(), None
+            except CancelledError:
+                return
+            except Exception as e:
+                result, error = None, str(e) or type(e).__name__
+            with app.app_context():
+                try:
+                    if error:
+                        self._store(screenshot_id, error=error)
+                    else:
+                        on_result(result)
+                finally:
+                    db.session.remove()
+        finally:
+            # A next stage replaces the entry, so the screenshot stays
+            # pending until its last stage is done.
+            with self.lock:
+                if self.pending.get(screenshot_id) is future:
+                    del self.pending[screenshot_id]
+
+    def _hashed(self, screenshot_id, filepath, phash, reuse=True):
+        """Reuse a near-duplicate's result, or queue OCR."""
+        screenshot = db.session.get(Screenshot, screenshot_id)
+        if screenshot is None:
+            return
+        if screenshot.phash is None:
+            screenshot.phash = '{:016x}'.format(phash)
+            for column, chunk in zip(PHASH_COLUMNS, hash_chunks(phash)):
+                setattr(screenshot, column, chunk)
+            db.session.commit()
+        duplicate = find_near_duplicate(screenshot) if reuse else None
+        if duplicate is not None:
+            self._store(screenshot_id, duplicate.analysis.data,
+                        reused_from=duplicate.id)
+            return
+        self._run(screenshot_id, analyze_screenshot, filepath,
+                  lambda data: self._store(screenshot_id, data))
+
+    def _store(self, screenshot_id, data=None, error=None, reused_from=None):
+        """Record an analysis as done or failed."""
+        analysis = db.session.get(ScreenshotAnalysis, screenshot_id)
+        if analysis is None:
+            return
+        analysis.status = FAILED if error else DONE
+        analysis.result = None if error else json.dumps(data)
+        analysis.error = error
+        analysis.reused_from = reused_from
+        db.session.commit()
+
+    def _is_lost(self, analysis):
+        """Check if a running analysis is no longer being worked on."""
+        with self.lock:
+            if analysis.screenshot_id in self.pending:
+                return False
+        deadline = datetime.now() - timedelta(seconds=ANALYSIS_TIMEOUT)
+        return analysis.status == RUNNING and analysis.updated_at < deadline
+
+    def ensure(self, screenshot, retry=False):
+        """
+        Returns a screenshot's analysis, queueing it if needed.
+
+        Args:
+            screenshot (Screenshot): The screenshot.
+            retry (bool): Whether to analyze the screenshot again if its
+                          analysis failed or reused a near-duplicate's.
+
+        Returns:
+            ScreenshotAnalysis: The stored or newly queued analysis.
+        """
+        analysis = screenshot.analysis
+        if analysis is None or self._is_lost(analysis):
+            return self.submit(screenshot)
+        if retry and (analysis.status == FAILED or analysis.reused_from):
+            return self.submit(screenshot, reuse=False)
+        return analysis
+
+    def shutdown(self):
+        """Stop the worker pool, dropping analyses that have not started."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+def find_near_duplicate(screenshot):
+    """
+    Finds an analyzed screenshot that shows the same screen.
+
+    Candidates share at least one exact hash chunk with the screenshot,
+    which the chunk indexes answer directly; they are then checked against
+    MAX_HASH_DISTANCE. Only the same user's screenshots are considered.
+
+    Args:
+        screenshot (Screenshot): A screenshot with its perceptual hash set.
+
+    Returns:
+        Screenshot: The closest analyzed near-duplicate, or None.
+    """
+    phash = int(screenshot.phash, 16)
+    candidates = Screenshot.query.join(ScreenshotAnalysis).filter(
+        Screenshot.user_id == screenshot.user_id,
+        Screenshot.id != screenshot.id,
+        ScreenshotAnalysis.status == DONE,
+        ScreenshotAnalysis.reused_from.is_(None),
+        or_(*(getattr(Screenshot, column) == chunk
+              for column, chunk in zip(PHASH_COLUMNS, hash_chunks(phash))))
+    )
+    best, best_distance = None, MAX_HASH_DISTANCE + 1
+    for candidate in candidates:
+        distance = hamming_distance(phash, int(candidate.phash, 16))
+        if distance < best_distance:
+            best, best_distance = candidate, distance
+    return best
+
+
+analysis_queue = AnalysisQueue()
@@ -18,11 +18,58 @@ def create_app():
         'DATABASE_URL', 'sqlite:///users.db'
     )
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 0)) or None
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ['DB_MAX_OVERFLOW']) \
+        if os.environ.get('DB_MAX_OVERFLOW') else None
+    app.config['DB_POOL_TIMEOUT'] = float(
+        os.environ.get('DB_POOL_TIMEOUT', 30)
+    )
+    app.config['DB_POOL_RECYCLE'] = int(
+        os.environ.get('DB_POOL_RECYCLE', 30 * 60)
+    )
+    app.config['DB_POOL_PRE_PING'] = os.environ.get(
+        'DB_POOL_PRE_PING', '1'
+    ).lower() in ('1', 'true', 'yes')
+    app.config['SQLITE_BUSY_TIMEOUT'] = float(
+        os.environ.get('SQLITE_BUSY_TIMEOUT', 5)
+    )
+    app.config['SQLITE_WAL'] = os.environ.get(
+        'SQLITE_WAL', '1'
+    ).lower() in ('1', 'true', 'yes')
     app.config['UPLOAD_FOLDER'] = 'uploads'
     app.config['AVATAR_FOLDER'] = 'avatars'
+    app.config['THUMBNAIL_FOLDER'] = 'thumbnails'
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 0)) or None
+    app.config['SIMULATION_CACHE_BYTES'] = int(
+        os.environ.get('SIMULATION_CACHE_BYTES', 32 * 1024 * 1024)
+    )
+    app.config['CACHE_URL'] = os.environ.get('CACHE_URL', 'memory://')
+    app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 24 * 60 * 60))
+    app.config['OCR_WORKERS'] = int(os.environ.get('OCR_WORKERS', 0)) or None
+    app.config['THUMBNAIL_WORKERS'] = int(
+        os.environ.get('THUMBNAIL_WORKERS', 0)
+    ) or None
+    app.config['METRICS_ENABLED'] = os.environ.get(
+        'METRICS_ENABLED', ''
+    ).lower() in ('1', 'true', 'yes')
+    app.config['PROFILE_FOLDER'] = 'profiles'
+    app.config['PROFILE_SLOW_THRESHOLD'] = float(
+        os.environ.get('PROFILE_SLOW_THRESHOLD', 0)
+    ) or None
+    app.config['SUGGESTION_REFRESH_INTERVAL'] = int(
+        os.environ.get('SUGGESTION_REFRESH_INTERVAL', 0)
+    ) or None
 
+    import database
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(
+        app.config
+    )
     db.init_app(app)
+    database.init_app(app)
     login_manager.init_app(app)
+
+    import metrics
+    metrics.init_app(app)
     login_manager.login_view = 'auth.login'
 
     from models import User
@@ -36,9 +83,31 @@ def create_app():
     from auth import auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
 
+    from cache import simulation_cache
+    simulation_cache.init_app(app)
+
+    from jobs import job_runner
+    job_runner.init_app(app)
+
+    from analysis import analysis_queue
+    analysis_queue.init_app(app)
+
+    from thumbnails import thumbnail_generator
+    thumbnail_generator.init_app(app)
+
+    from suggestions import suggestion_refresher
+    suggestion_refresher.init_app(app)
+
+    from game_data import get_game_data
+    # Load and validate the game data up front, so bad data fails startup.
+    get_game_data()
+
     from main import main_bp
     app.register_blueprint(main_bp)
 
+    import profiling
+    profiling.init_app(app)
+
     return app
 
 
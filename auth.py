@@ -1,5 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for, flash
-from flask_login import login_user, logout_user, current_user
+from functools import wraps
+
+from flask import Blueprint, render_template, redirect, url_for, flash, \
+    abort
+from flask_login import login_user, logout_user, current_user, \
+    login_required
 from app import db
 from models import User
 from forms import LoginForm, RegistrationForm
@@ -7,6 +11,17 @@ from forms import LoginForm, RegistrationForm
 auth_bp = Blueprint('auth', __name__)
 
 
+def admin_required(view):
+    """Restrict a view to logged in admins."""
+    @wraps(view)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if not current_user.is_admin:
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapped
+
+
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
     """Handle user registration."""
@@ -0,0 +1,699 @@
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import cached_property
+
+import numpy as np
+from PIL import Image, ImageDraw
+from werkzeug.security import generate_password_hash
+
+# Data set sizes. 'full' is what baselines are recorded at; 'small' is a
+# quick smoke run.
+SCALES = {
+    'small': {'users': 300, 'follows': 5, 'battalions': 20,
+              'screenshot': (390, 844), 'duration': 0.2},
+    'full': {'users': 5000, 'follows': 10, 'battalions': 200,
+             'screenshot': (1290, 2796), 'duration': 2.0},
+}
+DEFAULT_SCALE = 'full'
+# Every benchmark runs at least this many times, however slow, and at most
+# this many times, however fast.
+MIN_ITERATIONS = 5
+MAX_ITERATIONS = 100000
+WARMUP_ITERATIONS = 2
+PERCENTILES = (50, 90, 99)
+# A latency this much higher than the baseline's counts as a regression.
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_METRIC = 'p50_ms'
+PASSWORD = 'benchmark'
+USERNAME_ALPHABET = string.ascii_lowercase + string.digits + '_'
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Registers a benchmark.
+
+    The decorated function is given the Workload and returns the operation
+    to time, a callable taking no arguments. Setup done before returning is
+    not timed.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def generate_usernames(count, rng):
+    """
+    Generates distinct usernames of varied length and shape.
+
+    Args:
+        count (int): The number of usernames.
+        rng (random.Random): The random source.
+
+    Returns:
+        list: The usernames.
+    """
+    usernames = set()
+    while len(usernames) < count:
+        length = rng.randint(4, 16)
+        usernames.add(''.join(rng.choice(USERNAME_ALPHABET)
+                              for _ in range(length)))
+    return sorted(usernames, key=lambda _: rng.random())
+
+
+def generate_users(count, rng):
+    """
+    Inserts users with one shared password.
+
+    Passwords are hashed once rather than per user, which would take
+    minutes for thousands of users. The caller commits.
+
+    Args:
+        count (int): The number of users.
+        rng (random.Random): The random source.
+
+    Returns:
+        list: The new users' ids.
+    """
+    from app import db
+    from models import User
+    password_hash = generate_password_hash(PASSWORD)
+    db.session.execute(db.insert(User), [
+        {'username': username, 'password_hash': password_hash}
+        for username in generate_usernames(count, rng)
+    ])
+    return db.session.execute(
+        db.select(User.id).order_by(User.id)
+    ).scalars().all()
+
+
+def generate_follow_graph(user_ids, per_user, rng):
+    """
+    Inserts follows where a few users are followed by many.
+
+    Each user follows per_user others, picked with Zipf-like weights so
+    that follower counts are skewed as in a real community. Counters,
+    mutual connections and suggestions are brought up to date. The caller
+    commits.
+
+    Args:
+        user_ids (list): The users.
+        per_user (int): Follows per user.
+        rng (random.Random): The random source.
+
+    Returns:
+        int: The number of follows.
+    """
+    from app import db
+    from models import User, followers
+    from suggestions import rebuild_mutual_connections, \
+        refresh_stale_suggestions
+    weights = [1 / rank for rank in range(1, len(user_ids) + 1)]
+    edges = set()
+    for follower_id in user_ids:
+        wanted = min(per_user, len(user_ids) - 1)
+        followed = set()
+        while len(followed) < wanted:
+            followed_id = rng.choices(user_ids, weights)[0]
+            if followed_id != follower_id:
+                followed.add(followed_id)
+        edges.update((follower_id, followed_id) for followed_id in followed)
+    db.session.execute(followers.insert(), [
+        {'follower_id': follower_id, 'followed_id': followed_id}
+        for follower_id, followed_id in sorted(edges)
+    ])
+    User.recount_follows()
+    rebuild_mutual_connections()
+    db.session.commit()
+    refresh_stale_suggestions()
+    return len(edges)
+
+
+def generate_battalion(rng, game_data, groups=None):
+    """
+    Generates a random battalion.
+
+    Args:
+        rng (random.Random): The random source.
+        game_data (dict): The loaded game data.
+        groups (int): The number of troop groups. Defaults to every type
+                      and tier.
+
+    Returns:
+        dict: {'troops': [...], 'enforcers': [...], 'misc_buffs': {...}},
+              as parse_battalion reads it.
+    """
+    from optimizer import TEAM_SIZE
+    pairs = [(troop_type, tier)
+             for troop_type, tiers in game_data['troop_stats'].items()
+             for tier in tiers]
+    if groups is not None:
+        pairs = rng.sample(pairs, min(groups, len(pairs)))
+    names = rng.sample(sorted(game_data['enforcer_buffs']),
+                       min(TEAM_SIZE, len(game_data['enforcer_buffs'])))
+    levels = sorted(game_data['misc_buffs'].get(
+        'training_center_def_bonus', {}
+    ))
+    return {
+        'troops': [{'type': troop_type, 'tier': tier,
+                    'quantity': rng.randint(1000, 200000)}
+                   for troop_type, tier in pairs],
+        'enforcers': [{'name': name,
+                       'tier': rng.choice(sorted(
+                           game_data['enforcer_tier_multipliers'])),
+                       'has_signature_weapon':
+                           name in game_data['signature_weapon_buffs'] and
+                           rng.random() < 0.5}
+                      for name in names],
+        'misc_buffs': ({'training_center_level':
+                        int(rng.choice(levels).split('_')[-1])}
+                       if levels else {}),
+    }
+
+
+def generate_screenshot(size, rng, image_format='PNG'):
+    """
+    Draws a synthetic phone screenshot.
+
+    Panels, text-like bars and noise give it the size and compressibility
+    of a real game screenshot rather than of a flat image.
+
+    Args:
+        size (tuple): (width, height) in pixels.
+        rng (random.Random): The random source.
+        image_format (str): The format to encode it in.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    width, height = size
+    noise = np.random.default_rng(rng.getrandbits(32)).integers(
+        0, 24, (height, width, 3), dtype=np.uint8
+    )
+    image = Image.fromarray(noise + np.uint8(40))
+    draw = ImageDraw.Draw(image)
+    for _ in range(24):
+        left, top = rng.randrange(width), rng.randrange(height)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle((left, top, left + rng.randint(40, width // 2),
+                        top + rng.randint(20, height // 8)), fill=color)
+    for top in range(0, height, max(height // 60, 12)):
+        left = rng.randrange(width // 4)
+        draw.rectangle((left, top, left + rng.randint(20, width // 2),
+                        top + 8), fill=(230, 230, 230))
+    output = io.BytesIO()
+    image.save(output, image_format)
+    return output.getvalue()
+
+
+def measure(operation, duration, min_iterations=MIN_ITERATIONS,
+            max_iterations=MAX_ITERATIONS, warmup=WARMUP_ITERATIONS):
+    """
+    Times repeated calls of an operation.
+
+    Args:
+        operation (callable): The operation, taking no arguments.
+        duration (float): Seconds to keep calling it for, once
+                          min_iterations have run.
+        min_iterations (int): The fewest timed calls.
+        max_iterations (int): The most timed calls.
+        warmup (int): Untimed calls made first, to fill caches.
+
+    Returns:
+        dict: The iteration count, throughput in operations per second and
+              latency mean, min, max and percentiles in milliseconds.
+    """
+    for _ in range(warmup):
+        operation()
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < max_iterations and (
+            len(latencies) < min_iterations or
+            time.perf_counter() - started < duration):
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    milliseconds = np.array(latencies) * 1000
+    result = {
+        'iterations': len(latencies),
+        'ops_per_second': len(latencies) / elapsed,
+        'mean_ms': float(milliseconds.mean()),
+        'min_ms': float(milliseconds.min()),
+        'max_ms': float(milliseconds.max()),
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(milliseconds,
+                                                            PERCENTILES)):
+        result['p{}_ms'.format(percentile)] = float(value)
+    return result
+
+
+def create_app_with_database(url):
+    """
+    Creates the app against a given database.
+
+    The engine is created as the app is, from DATABASE_URL, so the URL has
+    to be in place before then rather than set in the config afterwards.
+
+    Args:
+        url (str): The SQLAlchemy database URL.
+
+    Returns:
+        Flask: The app.
+    """
+    from app import create_app
+    previous = os.environ.get('DATABASE_URL')
+    os.environ['DATABASE_URL'] = url
+    try:
+        return create_app()
+    finally:
+        if previous is None:
+            del os.environ['DATABASE_URL']
+        else:
+            os.environ['DATABASE_URL'] = previous
+
+
+class Workload:
+    """
+    An app with synthetic data for the benchmarks to run against.
+
+    The app uses its own SQLite database and folders in a temporary
+    directory, so a run never touches real data. Users and the follow
+    graph are only generated once a benchmark needs them.
+    """
+
+    def __init__(self, scale=DEFAULT_SCALE, seed=0):
+        self.scale = SCALES[scale]
+        self.rng = random.Random(seed)
+        self.folder = tempfile.mkdtemp(prefix='tgm-benchmark-')
+        self.app = create_app_with_database(
+            'sqlite:///' + os.path.join(self.folder, 'benchmark.db')
+        )
+        self.app.config.update(
+            TESTING=True, WTF_CSRF_ENABLED=False, SUGGESTIONS_EAGER=True,
+            THUMBNAIL_EAGER=True,
+            UPLOAD_FOLDER=os.path.join(self.folder, 'uploads'),
+            AVATAR_FOLDER=os.path.join(self.folder, 'avatars'),
+            THUMBNAIL_FOLDER=os.path.join(self.folder, 'thumbnails'),
+            PROFILE_FOLDER=os.path.join(self.folder, 'profiles'),
+        )
+        self.context = self.app.app_context()
+
+    def __enter__(self):
+        from app import db
+        self.context.push()
+        db.create_all()
+        return self
+
+    def __exit__(self, *exc_info):
+        from app import db
+        db.session.remove()
+        self.context.pop()
+        with self.app.app_context():
+            db.engine.dispose()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    @cached_property
+    def game_data(self):
+        """The loaded game data."""
+        from game_data import get_game_data
+        return get_game_data()
+
+    @cached_property
+    def usernames(self):
+        """Every generated username, after generating users and follows."""
+        from app import db
+        from models import User
+        user_ids = generate_users(self.scale['users'], self.rng)
+        db.session.commit()
+        generate_follow_graph(user_ids, self.scale['follows'], self.rng)
+        return db.session.execute(
+            db.select(User.username).order_by(User.id)
+        ).scalars().all()
+
+    @cached_property
+    def client(self):
+        """A test client logged in as the most followed user."""
+        username = self.usernames[0]
+        client = self.app.test_client()
+        client.post('/auth/login', data={'username': username,
+                                         'password': PASSWORD})
+        return client
+
+    def battalions(self, count):
+        """Generate battalions and their stats, for the simulation."""
+        from simulation import calculate_battalion_stats
+        battalions = [generate_battalion(self.rng, self.game_data)
+                      for _ in range(count)]
+        return battalions, [
+            calculate_battalion_stats(battalion['troops'],
+                                      battalion['enforcers'],
+                                      battalion['misc_buffs'])
+            for battalion in battalions
+        ]
+
+    def search_terms(self, count=200):
+        """Pick substrings of generated usernames, short and long."""
+        terms = []
+        for _ in range(count):
+            username = self.rng.choice(self.usernames)
+            length = self.rng.randint(2, min(6, len(username)))
+            start = self.rng.randint(0, len(username) - length)
+            terms.append(username[start:start + length])
+        return terms
+
+
+@benchmark('calculator.optimal_troops')
+def bench_optimal_troops(workload):
+    """Counter random opponents with the basic troop calculator."""
+    from calculator import calculate_optimal_troops
+    opponents = itertools.cycle([
+        {'bruisers': workload.rng.randint(0, 10 ** 6),
+         'hitmen': workload.rng.randint(0, 10 ** 6),
+         'bikers': workload.rng.randint(0, 10 ** 6)}
+        for _ in range(100)
+    ])
+    return lambda: calculate_optimal_troops(next(opponents))
+
+
+@benchmark('optimizer.enforcer_team')
+def bench_enforcer_team(workload):
+    """Search enforcer teams for a four-group battalion."""
+    from optimizer import optimize_enforcer_team
+    battalion = generate_battalion(workload.rng, workload.game_data, 4)
+    _, (opponent,) = workload.battalions(1)
+    return lambda: list(optimize_enforcer_team(
+        battalion['troops'], battalion['misc_buffs'], opponent
+    ))
+
+
+@benchmark('optimizer.troop_mix')
+def bench_troop_mix(workload):
+    """Search the best troop mix for a march against a battalion."""
+    from optimizer import prepare_troop_mix_search, search_troop_mix
+    _, (opponent,) = workload.battalions(1)
+    return lambda: search_troop_mix(prepare_troop_mix_search(opponent,
+                                                             500000))
+
+
+@benchmark('simulation.battalion_stats')
+def bench_battalion_stats(workload):
+    """Buff battalions with every troop type and tier."""
+    from simulation import calculate_battalion_stats
+    battalions = itertools.cycle(workload.battalions(20)[0])
+
+    def operation():
+        battalion = next(battalions)
+        calculate_battalion_stats(battalion['troops'], battalion['enforcers'],
+                                  battalion['misc_buffs'])
+    return operation
+
+
+@benchmark('simulation.battle')
+def bench_battle(workload):
+    """Simulate one battle between two large battalions."""
+    from simulation import simulate_battle
+    _, stats = workload.battalions(20)
+    pairs = itertools.cycle(zip(stats, reversed(stats)))
+    return lambda: simulate_battle(*next(pairs))
+
+
+@benchmark('simulation.batch')
+def bench_batch(workload):
+    """Simulate every attacker against every defender at once."""
+    from simulation import simulate_batch
+    count = workload.scale['battalions']
+    _, attackers = workload.battalions(count)
+    _, defenders = workload.battalions(count)
+    return lambda: simulate_batch(attackers, defenders)
+
+
+@benchmark('search.users')
+def bench_search_users(workload):
+    """Search usernames for short and long substrings."""
+    from search import search_users
+    terms = itertools.cycle(workload.search_terms())
+    return lambda: search_users(next(terms))
+
+
+@benchmark('search.find_friends')
+def bench_find_friends(workload):
+    """Render the find friends page for a search."""
+    terms = itertools.cycle(workload.search_terms())
+    client = workload.client
+
+    def operation():
+        response = client.get('/find_friends', query_string={
+            'q': next(terms)
+        })
+        assert response.status_code == 200, response.status
+    return operation
+
+
+@benchmark('suggestions.find_friends')
+def bench_suggestions(workload):
+    """Render the find friends page with its suggestions."""
+    client = workload.client
+
+    def operation():
+        response = client.get('/find_friends')
+        assert response.status_code == 200, response.status
+    return operation
+
+
+@benchmark('upload.store_file')
+def bench_store_file(workload):
+    """Store new screenshots in the content store."""
+    from app import db
+    from storage import store_file
+    image = generate_screenshot(workload.scale['screenshot'], workload.rng)
+    counter = itertools.count()
+
+    def operation():
+        # Trailing bytes make every upload new to the content store.
+        stream = io.BytesIO(image + next(counter).to_bytes(8, 'big'))
+        store_file(stream, 'screenshot.png')
+        db.session.commit()
+    return operation
+
+
+@benchmark('upload.thumbnails')
+def bench_thumbnails(workload):
+    """Hash a screenshot and render its thumbnails."""
+    from thumbnails import file_digest, render_derivatives
+    path = os.path.join(workload.folder, 'screenshot.png')
+    with open(path, 'wb') as f:
+        f.write(generate_screenshot(workload.scale['screenshot'],
+                                    workload.rng))
+    folder = workload.app.config['THUMBNAIL_FOLDER']
+    return lambda: render_derivatives(path, folder, file_digest(path))
+
+
+def select_benchmarks(names=None):
+    """
+    Looks up benchmarks by name or name prefix, e.g. 'simulation'.
+
+    Args:
+        names (list): The names. Defaults to every benchmark.
+
+    Returns:
+        list: The matching benchmark names, sorted.
+
+    Raises:
+        ValueError: If a name matches no benchmark.
+    """
+    selected = sorted(BENCHMARKS)
+    if not names:
+        return selected
+    for name in names:
+        if not any(_matches(candidate, name) for candidate in selected):
+            raise ValueError('Unknown benchmark: {}'.format(name))
+    return [candidate for candidate in selected
+            if any(_matches(candidate, name) for name in names)]
+
+
+def _matches(candidate, name):
+    """Check if a benchmark is named by a name or a prefix of it."""
+    return candidate == name or candidate.startswith(name + '.')
+
+
+def run_benchmarks(names=None, scale=DEFAULT_SCALE, seed=0, duration=None,
+                   report=None):
+    """
+    Runs benchmarks against a fresh synthetic workload.
+
+    Args:
+        names (list): Benchmark names or name prefixes to run, e.g.
+                      'simulation'. Defaults to every benchmark.
+        scale (str): A key of SCALES.
+        seed (int): Seeds the data generators, so runs are comparable.
+        duration (float): Seconds to time each benchmark for. Defaults to
+                          the scale's.
+        report (callable): Called with each name and result as it
+                           finishes.
+
+    Returns:
+        dict: The run's settings, environment and per-benchmark results.
+
+    Raises:
+        ValueError: If a name matches no benchmark.
+    """
+    selected = select_benchmarks(names)
+    duration = SCALES[scale]['duration'] if duration is None else duration
+    results = {}
+    with Workload(scale, seed) as workload:
+        for name in selected:
+            operation = BENCHMARKS[name](workload)
+            results[name] = measure(operation, duration)
+            if report is not None:
+                report(name, results[name])
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'scale': scale,
+        'seed': seed,
+        'duration': duration,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD,
+            metric=DEFAULT_METRIC):
+    """
+    Compares two runs benchmark by benchmark.
+
+    Args:
+        baseline (dict): An earlier output of run_benchmarks.
+        current (dict): A later output of run_benchmarks.
+        threshold (float): The relative slowdown that counts as a
+                           regression, e.g. 0.1 for 10%.
+        metric (str): The latency to compare, e.g. 'p50_ms'.
+
+    Returns:
+        list: Dicts with each benchmark's 'name', 'baseline' and 'current'
+              values, relative 'change' and whether it is a 'regression',
+              for benchmarks in both runs.
+    """
+    rows = []
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        before = baseline['results'][name][metric]
+        after = current['results'][name][metric]
+        change = after / before - 1 if before else 0.0
+        rows.append({'name': name, 'baseline': before, 'current': after,
+                     'change': change, 'regression': change > threshold})
+    return rows
+
+
+def _print_result(name, result):
+    """Print one benchmark's result as a table row."""
+    print('{:<28} {:>8} {:>12.1f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+        name, result['iterations'], result['ops_per_second'],
+        result['p50_ms'], result['p90_ms'], result['p99_ms']
+    ))
+
+
+def _run(args):
+    """Run the benchmarks chosen on the command line, printing results."""
+    select_benchmarks(args.only)
+    print('{:<28} {:>8} {:>12} {:>10} {:>10} {:>10}'.format(
+        'benchmark', 'runs', 'ops/s', 'p50 ms', 'p90 ms', 'p99 ms'
+    ))
+    return run_benchmarks(args.only, args.scale, args.seed, args.duration,
+                          _print_result)
+
+
+def main(argv=None):
+    """Run the benchmark command line; see --help."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the calculators, simulation, search and '
+                    'uploads against synthetic data.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    compare_parser = commands.add_parser(
+        'compare', help='compare a run against a baseline, exiting with '
+                        'status 1 if anything regressed'
+    )
+    compare_parser.add_argument('baseline', help='baseline JSON file')
+    compare_parser.add_argument(
+        'current', nargs='?',
+        help='JSON file of the run to check; runs the benchmarks if omitted'
+    )
+    compare_parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='relative slowdown counted as a regression (default: '
+             '%(default)s)'
+    )
+    compare_parser.add_argument(
+        '--metric', default=DEFAULT_METRIC,
+        choices=['mean_ms'] + ['p{}_ms'.format(p) for p in PERCENTILES],
+        help='latency compared (default: %(default)s)'
+    )
+    for command in (run_parser, compare_parser):
+        command.add_argument('--scale', choices=sorted(SCALES),
+                             default=DEFAULT_SCALE)
+        command.add_argument('--seed', type=int, default=0)
+        command.add_argument('--duration', type=float,
+                             help='seconds to time each benchmark for')
+        command.add_argument('--only', nargs='+', metavar='NAME',
+                             help='benchmarks or prefixes to run')
+        command.add_argument('--output', help='write the run as JSON here')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.command == 'compare' and args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        try:
+            current = _run(args)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.command == 'run':
+        return 0
+
+    if baseline.get('scale') != current.get('scale'):
+        print('Warning: comparing a {} run against a {} baseline.'.format(
+            current.get('scale'), baseline.get('scale')))
+    rows = compare(baseline, current, args.threshold, args.metric)
+    print()
+    print('{:<28} {:>12} {:>12} {:>9}'.format(
+        'benchmark', 'baseline', 'current', 'change'
+    ))
+    for row in rows:
+        print('{:<28} {:>12.3f} {:>12.3f} {:>+8.1%}{}'.format(
+            row['name'], row['baseline'], row['current'], row['change'],
+            '  REGRESSION' if row['regression'] else ''
+        ))
+    for name in sorted(set(baseline['results']) - set(current['results'])):
+        print('{:<28} not in this run'.format(name))
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print('{} of {} benchmarks regressed by more than {:.0%} ({}).'
+              .format(len(regressions), len(rows), args.threshold,
+                      args.metric))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
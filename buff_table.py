@@ -0,0 +1,180 @@
+import numpy as np
+
+from game_data import get_game_data
+
+STATS = ('atk', 'def', 'hp')
+CREW = 'Crew'
+
+_cached_game_data = None
+_cached_table = None
+
+
+def normalize_troop_type(troop_type, troop_types):
+    """
+    Maps a troop type name onto a key of troop_stats.json.
+
+    Args:
+        troop_type (str): The troop type, singular or plural (e.g. 'Bikers').
+        troop_types (list): The known troop type names.
+
+    Returns:
+        str: The matching troop type, or None if it is not recognised.
+    """
+    if troop_type in troop_types:
+        return troop_type
+    if troop_type.endswith('s') and troop_type[:-1] in troop_types:
+        return troop_type[:-1]
+    return None
+
+
+def parse_buff_name(buff_name, troop_types):
+    """
+    Parses a buff name such as 'Biker ATK Up' or 'Crew HP Up'.
+
+    Unlike parseBuffDetails in combat_logic.js, multi-word troop types such
+    as 'Mortar Car' are recognised.
+
+    Args:
+        buff_name (str): The buff name.
+        troop_types (list): The known troop type names.
+
+    Returns:
+        tuple: (squad type, stat) where squad type is a troop type or 'Crew'
+               and stat is one of STATS, or None if the buff does not
+               modify troop stats.
+    """
+    parts = buff_name.split(' ')
+    if len(parts) < 3 or parts[-1].upper() not in ('UP', 'DOWN'):
+        return None
+    stat = parts[-2].lower()
+    if stat not in STATS:
+        return None
+    squad_type = ' '.join(parts[:-2])
+    if squad_type.upper() == CREW.upper():
+        return CREW, stat
+    squad_type = normalize_troop_type(squad_type, troop_types)
+    if squad_type is None:
+        return None
+    return squad_type, stat
+
+
+def _add_buff(coefficients, buff_name, value, troop_types):
+    """Add a buff to a (troop type, stat) coefficient matrix."""
+    parsed = parse_buff_name(buff_name, troop_types)
+    if parsed is None:
+        return
+    squad_type, stat = parsed
+    if squad_type == CREW:
+        coefficients[:, STATS.index(stat)] += value
+    else:
+        coefficients[troop_types.index(squad_type), STATS.index(stat)] += value
+
+
+def compile_buff_table(game_data):
+    """
+    Compiles the enforcer and signature weapon buffs into lookup arrays.
+
+    Every combat buff is parsed once and spread over the troop types it
+    applies to, so the buffs of a team are the sum of a few rows.
+
+    Args:
+        game_data (dict): The loaded game data.
+
+    Returns:
+        dict: 'enforcers', 'tiers', 'troop_types' and 'stats' name lists,
+              'enforcer_coefficients' indexed [enforcer, tier, troop type,
+              stat] and 'weapon_coefficients' indexed [enforcer, troop
+              type, stat].
+    """
+    troop_types = list(game_data['troop_stats'])
+    enforcers = sorted(game_data['enforcer_buffs'])
+    tiers = list(game_data['enforcer_tier_multipliers'])
+    shape = (len(enforcers), len(troop_types), len(STATS))
+    base = np.zeros(shape)
+    weapons = np.zeros(shape)
+
+    for i, name in enumerate(enforcers):
+        for buff in game_data['enforcer_buffs'][name]['buffs']:
+            if buff['type'] == 'Combat':
+                _add_buff(base[i], buff['name'], buff['max_value'],
+                          troop_types)
+        weapon = game_data['signature_weapon_buffs'].get(name, {})
+        for skill_key in ('basic_skill', 'exclusive_skill'):
+            skill = weapon.get(skill_key)
+            if skill and isinstance(skill.get('buff_value'), (int, float)):
+                _add_buff(weapons[i], skill['name'], skill['buff_value'],
+                          troop_types)
+
+    multipliers = np.array([
+        game_data['enforcer_tier_multipliers'][tier]['percentage_benefit']
+        for tier in tiers
+    ])
+    return {
+        'enforcers': enforcers,
+        'tiers': tiers,
+        'troop_types': troop_types,
+        'stats': list(STATS),
+        'enforcer_index': {name: i for i, name in enumerate(enforcers)},
+        'tier_index': {tier: i for i, tier in enumerate(tiers)},
+        'enforcer_coefficients':
+            base[:, None, :, :] * multipliers[None, :, None, None],
+        'weapon_coefficients': weapons,
+    }
+
+
+def get_buff_table(game_data=None):
+    """
+    Returns the compiled buff table, compiling it once per game data.
+
+    Args:
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        dict: The output of compile_buff_table.
+    """
+    global _cached_game_data, _cached_table
+    game_data = game_data or get_game_data()
+    if game_data is not _cached_game_data:
+        _cached_table = compile_buff_table(game_data)
+        _cached_game_data = game_data
+    return _cached_table
+
+
+def team_coefficients(enforcers, table):
+    """
+    Sums the buffs of an enforcer team.
+
+    Enforcers that are not in the table are ignored, and an unknown tier
+    contributes nothing, as in applyEnforcerBuffs.
+
+    Args:
+        enforcers (list): Enforcer dicts with 'name', 'tier' and
+                          'has_signature_weapon'.
+        table (dict): The output of compile_buff_table.
+
+    Returns:
+        numpy.ndarray: Bonus fractions indexed [troop type, stat].
+    """
+    coefficients = np.zeros(table['weapon_coefficients'].shape[1:])
+    for enforcer in enforcers:
+        i = table['enforcer_index'].get(enforcer['name'])
+        if i is None:
+            continue
+        tier = table['tier_index'].get(enforcer['tier'])
+        if tier is not None:
+            coefficients += table['enforcer_coefficients'][i, tier]
+        if enforcer.get('has_signature_weapon'):
+            coefficients += table['weapon_coefficients'][i]
+    return coefficients
+
+
+def buff_table_payload(table):
+    """Return the JSON-serialisable form of a buff table."""
+    return {
+        'enforcers': table['enforcers'],
+        'tiers': table['tiers'],
+        'troop_types': table['troop_types'],
+        'stats': table['stats'],
+        'enforcer_coefficients': table['enforcer_coefficients'].tolist(),
+        'weapon_coefficients': table['weapon_coefficients'].tolist(),
+    }
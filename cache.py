@@ -0,0 +1,378 @@
+import hashlib
+import json
+import logging
+import socket
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from buff_table import normalize_troop_type
+from game_data import get_game_data, game_data_version
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Shared entries expire after this many seconds, so results keyed by an old
+# game data version do not linger in Redis.
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_TIMEOUT = 0.5
+KEY_PREFIX = 'tgm-calc:'
+
+logger = logging.getLogger(__name__)
+
+
+def battalion_fingerprint(troops, enforcers=(), misc_buffs=None,
+                          game_data=None):
+    """
+    Builds the canonical form of a battalion.
+
+    Battalions that are bound to produce the same results get the same
+    form: troop types are normalised ('Bikers' -> 'Biker'), groups of the
+    same type and tier are merged, empty groups are dropped and troops and
+    enforcers are sorted.
+
+    Args:
+        troops (list): Troop dicts with 'type', 'tier' and 'quantity'.
+        enforcers (list): Enforcer dicts with 'name', 'tier' and
+                          'has_signature_weapon'.
+        misc_buffs (dict): Misc buffs, e.g. {'training_center_level': 12}.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        list: A JSON-serialisable canonical form.
+    """
+    troop_types = list((game_data or get_game_data())['troop_stats'])
+    quantities = {}
+    for troop in troops:
+        troop_type = normalize_troop_type(troop['type'], troop_types) or \
+            troop['type']
+        group = (troop_type, troop['tier'])
+        quantities[group] = quantities.get(group, 0) + troop['quantity']
+    return [
+        sorted([troop_type, tier, quantity]
+               for (troop_type, tier), quantity in quantities.items()
+               if quantity),
+        sorted([enforcer['name'], enforcer['tier'],
+                bool(enforcer.get('has_signature_weapon'))]
+               for enforcer in enforcers),
+        misc_buffs or {},
+    ]
+
+
+def cache_key(kind, *parts, game_data=None):
+    """
+    Hashes a calculation and its inputs into a cache key.
+
+    Args:
+        kind (str): The kind of calculation, e.g. 'simulate'.
+        *parts: JSON-serialisable inputs, e.g. battalion fingerprints.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        str: A key that changes with the inputs and the game data version.
+    """
+    payload = json.dumps(
+        [kind, game_data_version(game_data), parts],
+        sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryBackend:
+    """
+    Stores results in process memory with LRU eviction.
+
+    Entries are charged at the size of their JSON encoding; the least
+    recently used ones are evicted once the total goes over the budget.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return a stored result, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        """Store a result; results larger than the budget are dropped."""
+        size = len(key) + len(json.dumps(value))
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.evictions = 0
+
+    def stats(self):
+        """Return the number and size of the stored entries."""
+        with self.lock:
+            return {
+                'backend': 'memory',
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'size_bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class RedisBackend:
+    """
+    Stores results in a Redis server shared by every worker.
+
+    Speaks the Redis protocol (RESP) over a single socket. Results are
+    stored as JSON under KEY_PREFIX with a TTL. Connection errors are
+    logged and treated as misses, so a cache outage never fails a request.
+    """
+
+    def __init__(self, url, ttl=DEFAULT_TTL, timeout=DEFAULT_TIMEOUT):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.ttl = ttl
+        self.timeout = timeout
+        self.errors = 0
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        """Open the connection and select the database."""
+        self.sock = socket.create_connection(
+            (self.host, self.port), timeout=self.timeout
+        )
+        self.reader = self.sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', self.db)
+
+    def _disconnect(self):
+        """Close the connection after an error."""
+        if self.sock is not None:
+            try:
+                self.reader.close()
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+
+    def _call(self, *args):
+        """Send one command and read its reply."""
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        """Parse one RESP reply."""
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection closed by the cache server.')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RuntimeError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ConnectionError('Unexpected reply from the cache server.')
+
+    def command(self, *args):
+        """
+        Runs a command, reconnecting first if needed.
+
+        Args:
+            *args: The command and its arguments, e.g. ('GET', key).
+
+        Returns:
+            The decoded reply, or None if the server could not be reached.
+        """
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self._connect()
+                return self._call(*args)
+            except (OSError, ConnectionError, RuntimeError) as e:
+                self.errors += 1
+                logger.warning('Cache server error: %s', e)
+                self._disconnect()
+                return None
+
+    def get(self, key):
+        """Return a stored result, or None."""
+        data = self.command('GET', KEY_PREFIX + key)
+        return json.loads(data) if data is not None else None
+
+    def set(self, key, value):
+        """Store a result with the backend's TTL."""
+        self.command('SET', KEY_PREFIX + key, json.dumps(value),
+                     'EX', self.ttl)
+
+    def clear(self):
+        """Delete every entry under KEY_PREFIX."""
+        cursor = b'0'
+        while True:
+            reply = self.command('SCAN', cursor, 'MATCH', KEY_PREFIX + '*',
+                                 'COUNT', 1000)
+            if reply is None:
+                return
+            cursor, keys = reply
+            if keys:
+                self.command('DEL', *keys)
+            if cursor in (b'0', '0'):
+                return
+
+    def stats(self):
+        """Return the connection details and error count."""
+        return {
+            'backend': 'redis',
+            'host': self.host,
+            'port': self.port,
+            'db': self.db,
+            'errors': self.errors,
+        }
+
+
+def create_backend(url=None, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+    """
+    Creates the cache backend for a URL.
+
+    Args:
+        url (str): 'redis://[:password@]host[:port][/db]' for a shared
+                   Redis server; anything else keeps results in memory.
+        max_bytes (int): The memory backend's size budget.
+        ttl (int): The Redis backend's entry lifetime in seconds.
+
+    Returns:
+        MemoryBackend or RedisBackend: The backend.
+    """
+    if url and urlparse(url).scheme == 'redis':
+        return RedisBackend(url, ttl)
+    return MemoryBackend(max_bytes)
+
+
+class SimulationCache:
+    """
+    A cache for calculation results in front of a pluggable backend.
+
+    Results live in process memory by default, or in a Redis server shared
+    by every worker when CACHE_URL points at one. Keys embed the game data
+    version, so editing any game data file invalidates every entry.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        """Create the backend from the app config."""
+        self.backend = create_backend(
+            app.config.get('CACHE_URL'),
+            app.config.get('SIMULATION_CACHE_BYTES', DEFAULT_MAX_BYTES),
+            app.config.get('CACHE_TTL', DEFAULT_TTL),
+        )
+        app.extensions['simulation_cache'] = self
+
+    def get(self, key):
+        """
+        Looks up a result.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            The cached result, or None if it is not cached.
+        """
+        value = self.backend.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Stores a result.
+
+        Args:
+            key (str): The cache key.
+            value: A JSON-serialisable result.
+        """
+        self.backend.set(key, value)
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns a cached result, computing and storing it on a miss.
+
+        Args:
+            key (str): The cache key.
+            compute (callable): Produces the result when it is not cached.
+
+        Returns:
+            The result.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        self.backend.clear()
+        with self.lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return the hit/miss counters and the backend's state."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+        stats.update(self.backend.stats())
+        return stats
+
+
+simulation_cache = SimulationCache()
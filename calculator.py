@@ -1,3 +1,37 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, ImageStat
+
+from game_data import get_game_data
+from metrics import timed
+from screen_layouts import get_screen_layouts, pixel_box, classify_screen
+
+try:
+    import pytesseract
+except ImportError:  # pragma: no cover - depends on the environment
+    pytesseract = None
+
+# Screenshots narrower than this are upscaled before OCR; Tesseract reads
+# small UI text far more reliably at a larger size.
+OCR_MIN_WIDTH = 1600
+OCR_CONFIG = '--psm 6'
+# Each region is a single line of text; number regions only hold digits.
+OCR_LINE_CONFIG = '--psm 7'
+OCR_NUMBER_CONFIG = '--psm 7 -c tessedit_char_whitelist=0123456789'
+# Regions shorter than this are upscaled before OCR.
+OCR_REGION_HEIGHT = 64
+# Tesseract runs as a subprocess per region, so threads read regions in
+# parallel.
+OCR_REGION_WORKERS = 4
+
+TRAINING_CENTER_PATTERN = re.compile(
+    r'training\s+cent(?:er|re)\D{0,20}?(\d{1,2})\b', re.IGNORECASE
+)
+LEVEL_PATTERN = r'{}s?\W{{0,5}}(?:lv\.?|lvl\.?|level|t)\s*(\d{{1,2}})\b'
+
+
+@timed('calculator.calculate_optimal_troops')
 def calculate_optimal_troops(opponent_troops):
     """
     Calculates the optimal troop composition to counter the opponent's troops.
@@ -26,6 +60,7 @@ def calculate_optimal_troops(opponent_troops):
     return optimal_troops
 
 
+@timed('calculator.calculate_optimal_enforcers')
 def calculate_optimal_enforcers(user_enforcers, opponent_enforcers):
     """
     Calculates the optimal enforcer setup to counter the opponent's enforcers.
@@ -42,6 +77,7 @@ def calculate_optimal_enforcers(user_enforcers, opponent_enforcers):
     return {'optimal_enforcers': 'Placeholder'}
 
 
+@timed('calculator.calculate_resources')
 def calculate_resources(resources):
     """
     Calculates the total value of the user's resources.
@@ -57,20 +93,190 @@ def calculate_resources(resources):
     return {'total_value': 'Placeholder'}
 
 
-def analyze_screenshot(filepath):
+def preprocess_screenshot(image):
+    """
+    Prepares a screenshot for OCR.
+
+    Args:
+        image (PIL.Image.Image): The screenshot.
+
+    Returns:
+        PIL.Image.Image: A high-contrast greyscale copy, upscaled if small.
+    """
+    image = ImageOps.grayscale(image)
+    if image.width < OCR_MIN_WIDTH:
+        scale = OCR_MIN_WIDTH / image.width
+        image = image.resize(
+            (OCR_MIN_WIDTH, round(image.height * scale)), Image.LANCZOS
+        )
+    return ImageOps.autocontrast(image)
+
+
+def parse_screenshot_text(text, troop_types=None):
+    """
+    Extracts game data from the text read off a screenshot.
+
+    Args:
+        text (str): The OCR output.
+        troop_types (list): The troop type names to look for. Defaults to
+                            the types in the game data.
+
+    Returns:
+        dict: The screen type and whichever of 'training_center_level' and
+              'troop_levels' were found.
+    """
+    if troop_types is None:
+        troop_types = list(get_game_data()['troop_stats'])
+    data = {}
+    match = TRAINING_CENTER_PATTERN.search(text)
+    if match:
+        data['training_center_level'] = int(match.group(1))
+    troop_levels = {}
+    for troop_type in troop_types:
+        pattern = LEVEL_PATTERN.format(
+            r'\s+'.join(map(re.escape, troop_type.split()))
+        )
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            troop_levels[troop_type] = int(match.group(1))
+    if troop_levels:
+        data['troop_levels'] = troop_levels
+    return dict(type='troops' if data else 'unknown', **data)
+
+
+def preprocess_region(image, box):
+    """
+    Crops a region of a screenshot and prepares it for OCR.
+
+    Args:
+        image (PIL.Image.Image): The greyscale screenshot.
+        box (tuple): The region in pixels.
+
+    Returns:
+        PIL.Image.Image: The region, upscaled if small, with dark text on a
+                         light background.
+    """
+    region = image.crop(box)
+    if 0 < region.height < OCR_REGION_HEIGHT:
+        scale = OCR_REGION_HEIGHT / region.height
+        region = region.resize(
+            (round(region.width * scale), OCR_REGION_HEIGHT), Image.LANCZOS
+        )
+    region = ImageOps.autocontrast(region)
+    # The game draws light text on dark panels; Tesseract expects the
+    # opposite.
+    if ImageStat.Stat(region).mean[0] < 128:
+        region = ImageOps.invert(region)
+    return region
+
+
+def parse_regions(screen_type, regions, texts):
+    """
+    Converts the text read from a screen's regions into game data.
+
+    Args:
+        screen_type (str): The classified screen type.
+        regions (dict): The layout's regions.
+        texts (dict): The text read from each region.
+
+    Returns:
+        dict: The screen type and the fields that were read.
+    """
+    data = {}
+    for name, region in regions.items():
+        text = texts.get(name, '')
+        if region['kind'] == 'number':
+            match = re.search(r'\d+', text)
+            if not match:
+                continue
+            value = int(match.group())
+        else:
+            value = ' '.join(text.split())
+            if not value:
+                continue
+        field = region['field']
+        if field == 'troop_levels':
+            data.setdefault(field, {})[name] = value
+        elif field == 'enforcers':
+            data.setdefault(field, []).append(value)
+        else:
+            data[field] = value
+    return dict(type=screen_type, **data)
+
+
+def read_screen(image, layouts, read_text):
+    """
+    Classifies a screenshot and reads the regions of its layout.
+
+    The title boxes are read first to pick the layout; its regions are
+    then cropped, preprocessed and read in parallel.
+
+    Args:
+        image (PIL.Image.Image): The loaded greyscale screenshot.
+        layouts (dict): The layout templates by screen type.
+        read_text (callable): OCRs an image with a Tesseract config.
+
+    Returns:
+        dict: The extracted data, or None if no layout matches.
+    """
+    def read(box, config):
+        region = preprocess_region(image, pixel_box(tuple(box), image.size))
+        return read_text(region, config)
+
+    title_boxes = list({tuple(layout['title']['box'])
+                        for layout in layouts.values()})
+    with ThreadPoolExecutor(OCR_REGION_WORKERS) as pool:
+        titles = dict(zip(title_boxes, pool.map(
+            lambda box: read(box, OCR_LINE_CONFIG), title_boxes
+        )))
+        screen_type = classify_screen(titles, layouts)
+        if screen_type is None:
+            return None
+        regions = layouts[screen_type]['regions']
+        texts = pool.map(
+            lambda region: read(region['box'], OCR_NUMBER_CONFIG
+                                if region['kind'] == 'number'
+                                else OCR_LINE_CONFIG),
+            regions.values()
+        )
+        return parse_regions(screen_type, regions, dict(zip(regions, texts)))
+
+
+def _tesseract(image, config):
+    """OCR an image with Tesseract."""
+    return pytesseract.image_to_string(image, config=config)
+
+
+@timed('calculator.analyze_screenshot')
+def analyze_screenshot(filepath, read_text=None):
     """
     Analyzes a screenshot to extract game data.
 
+    The screen type is classified from its title, and only the regions its
+    layout template marks are read. Screenshots that match no template are
+    read as a whole page, which is several times slower.
+
     Args:
         filepath (str): The path to the screenshot file.
+        read_text (callable): OCRs an image with a Tesseract config.
+                              Defaults to pytesseract.
 
     Returns:
         dict: A dictionary containing the extracted data.
+
+    Raises:
+        RuntimeError: If no OCR engine is available.
     """
-    # This is a placeholder implementation. A more advanced implementation would
-    # use OCR to extract data from the image.
-    return {
-        'type': 'troops',
-        'training_center_level': 25,
-        'troop_levels': {'Bruiser': 10}
-    }
+    if read_text is None:
+        if pytesseract is None:
+            raise RuntimeError('OCR is not available: pytesseract is not '
+                               'installed.')
+        read_text = _tesseract
+    with Image.open(filepath) as image:
+        image = ImageOps.grayscale(ImageOps.exif_transpose(image))
+    data = read_screen(image, get_screen_layouts(), read_text)
+    if data is None:
+        data = parse_screenshot_text(
+            read_text(preprocess_screenshot(image), OCR_CONFIG)
+        )
+    return data
@@ -1,11 +1,13 @@
 // Global or namespaced object to store loaded game data
 const gameData = {
+    version: null,
     troopStats: null,
     enforcerBuffs: null,
     enforcerTierMultipliers: null,
     signatureWeaponBuffs: null,
     counterInfo: null,
-    miscBuffs: null
+    miscBuffs: null,
+    buffTable: null
 };
 
 /**
@@ -35,36 +37,24 @@ async function loadJSONData(filePath) {
  */
 async function initializeData() {
     console.log("Initializing game data...");
-    const troopStatsPromise = loadJSONData('/static/troop_stats.json');
-    const enforcerBuffsPromise = loadJSONData('/static/enforcer_buffs.json');
-    const enforcerTierMultipliersPromise = loadJSONData('/static/enforcer_tier_multipliers.json');
-    const signatureWeaponBuffsPromise = loadJSONData('/static/signature_weapon_buffs.json');
-    const counterInfoPromise = loadJSONData('/static/counter_info.json');
-    const miscBuffsPromise = loadJSONData('/static/misc_buffs.json');
+    // The page names the current data version's bundle URL, which the browser
+    // caches for good; the unversioned URL redirects to it.
+    const meta = typeof document !== 'undefined' ? document.querySelector('meta[name="game-data"]') : null;
+    const bundlePromise = loadJSONData(meta && meta.content ? meta.content : '/api/game_data');
+    const buffTablePromise = loadJSONData('/api/buff_table');
 
     try {
-        const [
-            troopStats,
-            enforcerBuffs,
-            enforcerTierMultipliers,
-            signatureWeaponBuffs,
-            counterInfo,
-            miscBuffs
-        ] = await Promise.all([
-            troopStatsPromise,
-            enforcerBuffsPromise,
-            enforcerTierMultipliersPromise,
-            signatureWeaponBuffsPromise,
-            counterInfoPromise,
-            miscBuffsPromise
-        ]);
-
-        gameData.troopStats = troopStats;
-        gameData.enforcerBuffs = enforcerBuffs;
-        gameData.enforcerTierMultipliers = enforcerTierMultipliers;
-        gameData.signatureWeaponBuffs = signatureWeaponBuffs;
-        gameData.counterInfo = counterInfo;
-        gameData.miscBuffs = miscBuffs;
+        const [bundle, buffTable] = await Promise.all([bundlePromise, buffTablePromise]);
+        const data = bundle ? bundle.data : {};
+
+        gameData.version = bundle ? bundle.version : null;
+        gameData.troopStats = data.troop_stats || null;
+        gameData.enforcerBuffs = data.enforcer_buffs || null;
+        gameData.enforcerTierMultipliers = data.enforcer_tier_multipliers || null;
+        gameData.signatureWeaponBuffs = data.signature_weapon_buffs || null;
+        gameData.counterInfo = data.counter_info || null;
+        gameData.miscBuffs = data.misc_buffs || null;
+        gameData.buffTable = indexBuffTable(buffTable);
 
         if (Object.values(gameData).every(data => data !== null)) {
             console.log("All game data initialized successfully.");
@@ -76,6 +66,22 @@ async function initializeData() {
     }
 }
 
+/**
+ * Adds name-to-index lookups to the compiled buff table served by /api/buff_table.
+ * @param {object|null} buffTable - The compiled buff table.
+ * @returns {object|null} The buff table with enforcerIndex and tierIndex maps, or null.
+ */
+function indexBuffTable(buffTable) {
+    if (!buffTable) {
+        return null;
+    }
+    buffTable.enforcerIndex = {};
+    buffTable.enforcers.forEach((name, i) => { buffTable.enforcerIndex[name] = i; });
+    buffTable.tierIndex = {};
+    buffTable.tiers.forEach((tier, i) => { buffTable.tierIndex[tier] = i; });
+    return buffTable;
+}
+
 /**
  * Placeholder function to get base stats for a troop type and tier.
  * @param {string} troopType - The type of the troop (e.g., "Bruiser").
@@ -360,6 +366,82 @@ function applySignatureWeaponBuffs(battalionDetails, enforcers) {
     return modifiedBattalionDetails;
 }
 
+/**
+ * Sums the compiled buff coefficients of an enforcer team.
+ * @param {Array<object>} enforcers - Array of enforcer objects.
+ * @returns {object} Map of troop type to {atk, def, hp} bonus fractions.
+ */
+function getTeamBuffCoefficients(enforcers) {
+    const table = gameData.buffTable;
+    const totals = {};
+    table.troop_types.forEach(troopType => {
+        totals[troopType] = { atk: 0, def: 0, hp: 0 };
+    });
+
+    for (const enforcer of enforcers) {
+        const enforcerIndex = table.enforcerIndex[enforcer.name];
+        if (enforcerIndex === undefined) {
+            console.warn(`Enforcer "${enforcer.name}" not found in the buff table. Skipping.`);
+            continue;
+        }
+        const tierIndex = table.tierIndex[enforcer.tier];
+        const rows = [];
+        if (tierIndex !== undefined) {
+            rows.push(table.enforcer_coefficients[enforcerIndex][tierIndex]);
+        }
+        if (enforcer.has_signature_weapon) {
+            rows.push(table.weapon_coefficients[enforcerIndex]);
+        }
+        for (const row of rows) {
+            table.troop_types.forEach((troopType, t) => {
+                table.stats.forEach((stat, s) => {
+                    totals[troopType][stat] += row[t][s];
+                });
+            });
+        }
+    }
+    return totals;
+}
+
+/**
+ * Applies enforcer and signature weapon buffs using the compiled buff table.
+ * Equivalent to applyEnforcerBuffs followed by applySignatureWeaponBuffs, but
+ * without parsing any buff names.
+ * @param {Array<object>} battalionDetails - Array of troop group stats.
+ * @param {Array<object>} enforcers - Array of enforcer objects.
+ * @returns {Array<object>} Modified battalionDetails with team buffs applied.
+ */
+function applyCompiledEnforcerBuffs(battalionDetails, enforcers) {
+    const coefficients = getTeamBuffCoefficients(enforcers);
+
+    return battalionDetails.map(group => {
+        if (group.error) return group;
+        const modifiedGroup = { ...group, buffs_applied: [...(group.buffs_applied || [])] };
+        const groupCoefficients = coefficients[group.type];
+        if (!groupCoefficients) return modifiedGroup;
+
+        for (const stat of gameData.buffTable.stats) {
+            const percentage = groupCoefficients[stat];
+            if (percentage === 0) continue;
+            const baseValueForBuffCalc = group[`base_${stat}_total`];
+            const increase = baseValueForBuffCalc * percentage;
+            const statValueBefore = modifiedGroup[stat];
+            modifiedGroup[stat] += increase;
+            modifiedGroup.buffs_applied.push({
+                buff_name: `${group.type} ${stat.toUpperCase()} Up`,
+                source: "Enforcer team and signature weapons",
+                value_percentage: percentage,
+                applied_to_stat: stat,
+                base_value_for_calc: baseValueForBuffCalc,
+                increase_amount: increase,
+                stat_value_before_this_buff: statValueBefore,
+                stat_value_after_this_buff: modifiedGroup[stat]
+            });
+        }
+        return modifiedGroup;
+    });
+}
+
 /**
  * Applies miscellaneous passive buffs to a troop group.
  * @param {object} currentGroupStats - Stats object for a specific troop group (e.g., {"type": "Bruiser", ... "atk": X, "def": Y, "hp": Z}).
@@ -491,8 +573,15 @@ function calculateBattalionStats(troops, enforcers, playerMiscBuffs) {
     // After all troop groups are processed and had misc buffs applied,
     // apply enforcer buffs which might affect multiple groups.
     // applyEnforcerBuffs will use base_xxx_total for its percentage calculations.
-    let processedBattalionDetails = applyEnforcerBuffs(battalionDetails, enforcers);
-    processedBattalionDetails = applySignatureWeaponBuffs(processedBattalionDetails, enforcers);
+    // The compiled buff table turns the whole team into a few lookups; fall back
+    // to parsing the buff names if it could not be loaded.
+    let processedBattalionDetails;
+    if (gameData.buffTable) {
+        processedBattalionDetails = applyCompiledEnforcerBuffs(battalionDetails, enforcers);
+    } else {
+        processedBattalionDetails = applyEnforcerBuffs(battalionDetails, enforcers);
+        processedBattalionDetails = applySignatureWeaponBuffs(processedBattalionDetails, enforcers);
+    }
 
 
     // Recalculate totalBattalionStats from the final, buffed details
@@ -636,13 +725,106 @@ function getCounterModifier(attackerType, defenderType) {
 }
 
 
+// Closed-form results this close (relative) to a tie, or to a side dying exactly on a
+// round boundary, could come out differently when stepping, so those battles are stepped.
+const CLOSED_FORM_TOLERANCE = 1e-9;
+
+/**
+ * Sums the damage one side deals per round, spread over the other side's HP shares.
+ * @param {Array<object>} groups - The dealing side's groups.
+ * @param {Array<object>} enemyGroups - The receiving side's groups.
+ * @param {number} enemyTotalHp - The receiving side's total HP.
+ * @returns {number} The damage dealt per round.
+ */
+function getDamagePerRound(groups, enemyGroups, enemyTotalHp) {
+    let damage = 0;
+    groups.forEach(group => {
+        if (group.hp <= 0) return;
+        enemyGroups.forEach(enemy => {
+            if (enemy.hp <= 0) return;
+            damage += group.atk * (1 + getCounterModifier(group.type, enemy.type)) * (enemy.hp / enemyTotalHp);
+        });
+    });
+    return damage;
+}
+
+/**
+ * Resolves a battle in closed form, without stepping round by round.
+ * Every group of a side takes the same fraction of its HP each round, so the damage each
+ * side deals per round stays constant and a side with total HP H facing damage D per round
+ * dies in round ceil(H / D).
+ * @param {object} attackerBattalionOutput - The full result from calculateBattalionStats for the attacker.
+ * @param {object} defenderBattalionOutput - The full result from calculateBattalionStats for the defender.
+ * @returns {object|null} Battle result like simulateBattle's, or null when rounding could
+ *     change the outcome and the battle should be stepped instead.
+ */
+function resolveBattleClosedForm(attackerBattalionOutput, defenderBattalionOutput) {
+    const attackerGroups = attackerBattalionOutput.details.filter(g => !g.error);
+    const defenderGroups = defenderBattalionOutput.details.filter(g => !g.error);
+    const attackerHp = attackerGroups.reduce((sum, group) => sum + Math.max(0, group.hp), 0);
+    const defenderHp = defenderGroups.reduce((sum, group) => sum + Math.max(0, group.hp), 0);
+    const initialAttackerTotalHp = Math.max(1, attackerGroups.reduce((sum, group) => sum + group.hp, 0));
+    const initialDefenderTotalHp = Math.max(1, defenderGroups.reduce((sum, group) => sum + group.hp, 0));
+
+    let roundsFought = 0;
+    let attackerLeft = attackerHp;
+    let defenderLeft = defenderHp;
+    if (attackerHp > 0 && defenderHp > 0) {
+        const damageToDefender = getDamagePerRound(attackerGroups, defenderGroups, defenderHp);
+        const damageToAttacker = getDamagePerRound(defenderGroups, attackerGroups, attackerHp);
+        const attackerRounds = damageToAttacker > 0 ? attackerHp / damageToAttacker : Infinity;
+        const defenderRounds = damageToDefender > 0 ? defenderHp / damageToDefender : Infinity;
+        const nearInteger = x => isFinite(x) && x <= MAX_BATTLE_ROUNDS + 1 &&
+            Math.abs(x - Math.round(x)) <= CLOSED_FORM_TOLERANCE * Math.max(1, x);
+        if (nearInteger(attackerRounds) || nearInteger(defenderRounds)) {
+            return null;
+        }
+        roundsFought = Math.min(Math.ceil(attackerRounds), Math.ceil(defenderRounds), MAX_BATTLE_ROUNDS);
+        attackerLeft = roundsFought >= Math.ceil(attackerRounds) ? 0 : Math.max(0, attackerHp - roundsFought * damageToAttacker);
+        defenderLeft = roundsFought >= Math.ceil(defenderRounds) ? 0 : Math.max(0, defenderHp - roundsFought * damageToDefender);
+    }
+
+    const attacker_hp_remaining_percentage = (attackerLeft / initialAttackerTotalHp) * 100;
+    const defender_hp_remaining_percentage = (defenderLeft / initialDefenderTotalHp) * 100;
+    if (attackerLeft > 0 && Math.abs(attacker_hp_remaining_percentage - defender_hp_remaining_percentage) <= CLOSED_FORM_TOLERANCE * 100) {
+        return null;
+    }
+    let winner = "draw";
+    if (attacker_hp_remaining_percentage > defender_hp_remaining_percentage) {
+        winner = "attacker";
+    } else if (defender_hp_remaining_percentage > attacker_hp_remaining_percentage) {
+        winner = "defender";
+    }
+    return {
+        winner: winner,
+        rounds_fought: roundsFought,
+        attacker_hp_remaining_percentage: attacker_hp_remaining_percentage,
+        defender_hp_remaining_percentage: defender_hp_remaining_percentage,
+        log: [
+            "Resolved in closed form.",
+            `Rounds Fought: ${roundsFought}`,
+            `Final Attacker HP: ${attackerLeft.toFixed(0)} / ${initialAttackerTotalHp.toFixed(0)}`,
+            `Final Defender HP: ${defenderLeft.toFixed(0)} / ${initialDefenderTotalHp.toFixed(0)}`,
+            `Winner: ${winner}`
+        ]
+    };
+}
+
 /**
  * Simulates a battle between two battalions.
  * @param {object} attackerBattalionOutput - The full result from calculateBattalionStats for the attacker.
  * @param {object} defenderBattalionOutput - The full result from calculateBattalionStats for the defender.
+ * @param {object} [options] - Set options.fast to resolve the battle in closed form when that
+ *     is exact, skipping the round-by-round log.
  * @returns {object} Battle result including winner, rounds, HP remaining, and log.
  */
-function simulateBattle(attackerBattalionOutput, defenderBattalionOutput) {
+function simulateBattle(attackerBattalionOutput, defenderBattalionOutput, options = {}) {
+    if (options.fast) {
+        const resolved = resolveBattleClosedForm(attackerBattalionOutput, defenderBattalionOutput);
+        if (resolved) {
+            return resolved;
+        }
+    }
     console.log("\n--- Starting Battle Simulation ---");
     console.log("Attacker Totals:",
         "ATK:", attackerBattalionOutput.total_atk.toFixed(0),
@@ -817,132 +999,68 @@ const DEFAULT_RECOMMENDATION_MISC_BUFFS = { "training_center_level": 25 }; // Ex
 
 /**
  * Recommends a troop mix to counter an opponent's battalion.
+ * The search runs on the server (/api/optimize/troops), which simulates
+ * type and tier allocations under the march size and keeps the best one.
  * @param {Array<object>} opponentTroopList - Opponent's troops (e.g., [{"type": "Bruiser", "tier": "T1", "quantity": 1000}]).
  * @param {Array<object>} opponentEnforcers - Opponent's enforcers.
  * @param {object} opponentMiscBuffs - Opponent's miscellaneous buffs.
+ * @param {object} [options] - Optional user details: userTroops (caps what can be sent), userEnforcers,
+ *     userMiscBuffs, marchSize and objective ("hp" to keep the most HP, "smallest" for the smallest winning mix).
  * @returns {object} Recommendation object or error object.
  */
-async function recommendTroopMix(opponentTroopList, opponentEnforcers, opponentMiscBuffs) {
+async function recommendTroopMix(opponentTroopList, opponentEnforcers, opponentMiscBuffs, options = {}) {
     console.log("\n--- Starting Troop Mix Recommendation ---");
     console.log("Opponent Troops:", JSON.stringify(opponentTroopList));
-    console.log("Opponent Enforcers:", JSON.stringify(opponentEnforcers));
-    console.log("Opponent Misc Buffs:", JSON.stringify(opponentMiscBuffs));
-
-    if (!gameData.troopStats || !gameData.counterInfo) {
-        console.error("recommendTroopMix: Essential game data (troopStats or counterInfo) not loaded.");
-        return { error: "Essential game data not loaded.", recommended_mix: [], simulation_result: null };
-    }
 
-    // Step A: Calculate Opponent's Stats
-    const actualOpponentStats = calculateBattalionStats(opponentTroopList, opponentEnforcers, opponentMiscBuffs);
-    if (!actualOpponentStats || actualOpponentStats.error || actualOpponentStats.total_hp <= 0) {
-        console.error("recommendTroopMix: Failed to calculate opponent stats or opponent has no HP.", actualOpponentStats?.error);
-        return { error: `Failed to calculate valid opponent stats or opponent has no HP. Details: ${actualOpponentStats?.error || 'N/A'}`, recommended_mix: [], simulation_result: null };
-    }
-    console.log(`Opponent Total HP calculated: ${actualOpponentStats.total_hp.toFixed(0)}`);
-
-    // Step B: Identify Opponent's Dominant Combat Troop Type (Bruiser, Biker, Hitmen)
-    const opponentTypeHpMap = { "Bruiser": 0, "Hitman": 0, "Biker": 0 }; // Use singular form for consistency
-    let totalCombatHp = 0;
-    actualOpponentStats.details.forEach(group => {
-        if (group.error) return;
-        // Normalize group type from plural (e.g., "Bruisers") to singular ("Bruiser") for map keys
-        const singularType = group.type.endsWith('s') ? group.type.slice(0, -1) : group.type;
-        if (opponentTypeHpMap.hasOwnProperty(singularType)) {
-            opponentTypeHpMap[singularType] += group.hp;
-            totalCombatHp += group.hp;
-        }
-    });
-
-    if (totalCombatHp === 0) {
-        console.error("recommendTroopMix: Opponent has no Bruisers, Hitmen, or Bikers, or their HP is zero.");
-        return { error: "Opponent has no discernible combat troop presence (Bruisers, Hitmen, Bikers with HP > 0).", recommended_mix: [], simulation_result: null };
+    const userEnforcers = (options.userEnforcers && options.userEnforcers.length > 0)
+        ? options.userEnforcers : DEFAULT_RECOMMENDATION_ENFORCERS;
+    const userMiscBuffs = options.userMiscBuffs || DEFAULT_RECOMMENDATION_MISC_BUFFS;
+    const body = {
+        opponent: { troops: opponentTroopList, enforcers: opponentEnforcers, misc_buffs: opponentMiscBuffs },
+        user: { troops: options.userTroops || [], enforcers: userEnforcers, misc_buffs: userMiscBuffs },
+        objective: options.objective || "hp"
+    };
+    if (options.marchSize) {
+        body.march_size = options.marchSize;
     }
 
-    let dominantOpponentType = "";
-    let maxHp = 0;
-    for (const type in opponentTypeHpMap) {
-        if (opponentTypeHpMap[type] > maxHp) {
-            maxHp = opponentTypeHpMap[type];
-            dominantOpponentType = type;
+    let recommendation;
+    try {
+        const response = await fetch('/api/optimize/troops', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        recommendation = await response.json();
+        if (!response.ok) {
+            console.error("recommendTroopMix: Optimizer request failed.", recommendation.error);
+            return { error: recommendation.error || `HTTP error ${response.status}`, recommended_mix: [], simulation_result: null };
         }
+    } catch (error) {
+        console.error("recommendTroopMix: Optimizer request failed.", error);
+        return { error: `Failed to reach the optimizer: ${error.message}`, recommended_mix: [], simulation_result: null };
     }
-    console.log(`Opponent Dominant Combat Type: ${dominantOpponentType} (Total HP: ${maxHp.toFixed(0)})`);
-    console.log("Opponent HP Map:", JSON.stringify(opponentTypeHpMap));
-
-
-    // Step C: Determine Basic Counter Strategy
-    let recommendedPrimaryType = "";
-    let sacrificialType1 = "";
-    let sacrificialType2 = "";
-
-    // Ensuring types are singular for consistency with troopStats keys
-    if (dominantOpponentType === "Bruiser") {
-        recommendedPrimaryType = "Biker"; sacrificialType1 = "Hitman"; sacrificialType2 = "Bruiser";
-    } else if (dominantOpponentType === "Biker") {
-        recommendedPrimaryType = "Hitman"; sacrificialType1 = "Bruiser"; sacrificialType2 = "Biker";
-    } else if (dominantOpponentType === "Hitman") {
-        recommendedPrimaryType = "Bruiser"; sacrificialType1 = "Biker"; sacrificialType2 = "Hitman";
-    } else {
-        console.error(`recommendTroopMix: Could not determine a counter for dominant type: ${dominantOpponentType}`);
-        return { error: `No counter strategy for dominant opponent type: ${dominantOpponentType}. This shouldn't happen if dominant type was identified.`, recommended_mix: [], simulation_result: null };
-    }
-    console.log(`Counter strategy: Primary: ${recommendedPrimaryType}, Sacrificial1: ${sacrificialType1}, Sacrificial2: ${sacrificialType2}`);
-
-    // Step D: Generate One Candidate Mix
-    const opponentTotalHp = actualOpponentStats.total_hp;
-    const primaryUnitBaseStats_T4 = gameData.troopStats?.[recommendedPrimaryType]?.['T4'];
-
-    if (!primaryUnitBaseStats_T4 || !primaryUnitBaseStats_T4.hp || primaryUnitBaseStats_T4.hp === 0) {
-        console.warn(`recommendTroopMix: Base HP for T4 ${recommendedPrimaryType} not found or is zero. Using default HP of 50 for calculation.`);
-        primaryUnitBaseStats_T4.hp = 50; // Default HP if not found, T4s usually have more, this is a fallback
-    }
-
-    // Aim for slightly more HP with the primary counter type than the opponent's total HP
-    const estimatedPrimaryQty = Math.ceil((opponentTotalHp * 1.2) / primaryUnitBaseStats_T4.hp);
-    const sacrificialQty = Math.ceil(estimatedPrimaryQty * 0.1); // 10% of primary for each sacrificial type
-
-    const generatedMix = [
-        { type: recommendedPrimaryType, tier: "T4", quantity: Math.max(100, estimatedPrimaryQty) },
-        { type: sacrificialType1, tier: "T1", quantity: Math.max(100, sacrificialQty) }, // Using T1 for sacrificial
-        { type: sacrificialType2, tier: "T1", quantity: Math.max(100, sacrificialQty) }  // Using T1 for sacrificial
-    ];
-    console.log("Generated User Mix:", JSON.stringify(generatedMix));
-
-
-    // Step E: Evaluate Candidate Mix
-    const userCandidateStats = calculateBattalionStats(generatedMix, DEFAULT_RECOMMENDATION_ENFORCERS, DEFAULT_RECOMMENDATION_MISC_BUFFS);
-    if (!userCandidateStats || userCandidateStats.error || userCandidateStats.total_hp <= 0) {
-        console.error("recommendTroopMix: Failed to calculate stats for the recommended user mix.", userCandidateStats?.error);
-        return {
-            error: `Failed to calculate stats for recommended mix. Details: ${userCandidateStats?.error || 'N/A'}`,
-            recommended_mix: generatedMix,
-            opponent_dominant_type: dominantOpponentType,
-            simulation_result: null,
-            assumed_user_enforcers: DEFAULT_RECOMMENDATION_ENFORCERS,
-            assumed_user_misc_buffs: DEFAULT_RECOMMENDATION_MISC_BUFFS
-        };
-    }
-    console.log(`User Candidate Mix Total HP: ${userCandidateStats.total_hp.toFixed(0)}`);
 
-    const simulationResult = simulateBattle(userCandidateStats, actualOpponentStats);
+    // Replay the recommended mix locally for the round-by-round battle log.
+    const actualOpponentStats = calculateBattalionStats(opponentTroopList, opponentEnforcers, opponentMiscBuffs);
+    const userCandidateStats = calculateBattalionStats(recommendation.recommended_mix, userEnforcers, userMiscBuffs);
+    const simulationResult = (actualOpponentStats && !actualOpponentStats.error && userCandidateStats && !userCandidateStats.error)
+        ? simulateBattle(userCandidateStats, actualOpponentStats)
+        : { ...recommendation.simulation, log: [] };
 
     return {
-        recommended_mix: generatedMix,
-        opponent_dominant_type: dominantOpponentType,
+        recommended_mix: recommendation.recommended_mix,
+        total_troops: recommendation.total_troops,
+        objective: recommendation.objective,
         simulation_result: simulationResult,
-        assumed_user_enforcers: DEFAULT_RECOMMENDATION_ENFORCERS,
-        assumed_user_misc_buffs: DEFAULT_RECOMMENDATION_MISC_BUFFS,
-        user_candidate_stats_summary: {
-            total_atk: userCandidateStats.total_atk,
-            total_def: userCandidateStats.total_def,
-            total_hp: userCandidateStats.total_hp,
-        },
-        opponent_stats_summary: {
+        assumed_user_enforcers: userEnforcers,
+        assumed_user_misc_buffs: userMiscBuffs,
+        user_candidate_stats_summary: recommendation.user_stats_summary,
+        opponent_stats_summary: actualOpponentStats && !actualOpponentStats.error ? {
             total_atk: actualOpponentStats.total_atk,
             total_def: actualOpponentStats.total_def,
             total_hp: actualOpponentStats.total_hp,
-        }
+        } : null
     };
 }
 
@@ -1154,7 +1272,7 @@ async function recommendEnforcerSetup(
             continue;
         }
 
-        const simulationResult = simulateBattle(currentUserBattalionWithThisTeam, actualOpponentStats);
+        const simulationResult = simulateBattle(currentUserBattalionWithThisTeam, actualOpponentStats, { fast: true });
         evaluatedSetups.push({
             enforcer_team: enforcerTeam,
             user_stats_summary: {
@@ -1179,6 +1297,11 @@ async function recommendEnforcerSetup(
     });
 
     const bestSetup = evaluatedSetups.length > 0 ? evaluatedSetups[0] : null;
+    if (bestSetup) {
+        // Replay the winning team round by round for the detailed battle log.
+        const bestUserBattalion = calculateBattalionStats(userTroopList, bestSetup.enforcer_team, userMiscBuffs);
+        bestSetup.simulation = simulateBattle(bestUserBattalion, actualOpponentStats);
+    }
 
     console.log("Best setup identified:", bestSetup ? bestSetup.enforcer_team.map(e=>e.name).join(', ') : "None", "Sim winner:", bestSetup?.simulation.winner);
 
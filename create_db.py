@@ -1,5 +1,8 @@
 from app import create_app, db
+from user_details import migrate_legacy_details
 
 app = create_app()
 with app.app_context():
     db.create_all()
+    migrate_legacy_details()
+    db.session.commit()
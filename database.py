@@ -0,0 +1,148 @@
+import sys
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from app import db
+import metrics
+
+try:
+    import psycopg2
+    from psycopg2 import extensions as psycopg2_extensions
+except ImportError:  # pragma: no cover - depends on the environment
+    psycopg2 = None
+
+
+class TimedQueuePool(QueuePool):
+    """
+    A QueuePool that reports how long checkouts wait.
+
+    The time covers waiting for a free connection, opening a new one and
+    the pre-ping, as db_pool_checkout_wait_seconds. Checkouts that give up
+    after pool_timeout are counted in db_pool_timeouts_total.
+    """
+
+    def connect(self):
+        if not metrics.enabled:
+            return super().connect()
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            metrics.POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            metrics.POOL_WAIT.observe(time.perf_counter() - start)
+
+
+def _in_memory(url):
+    """Check if a SQLite URL names an in-memory database."""
+    return url.database in (None, '', ':memory:') or \
+        url.query.get('mode') == 'memory'
+
+
+def engine_options(config):
+    """
+    Builds the engine options from the app's database settings.
+
+    SQLite waits SQLITE_BUSY_TIMEOUT seconds for a lock instead of failing
+    at once. Other databases get a TimedQueuePool sized by DB_POOL_SIZE
+    and DB_MAX_OVERFLOW, with DB_POOL_TIMEOUT, DB_POOL_RECYCLE and
+    DB_POOL_PRE_PING. SQLite files get the pool too, without recycling or
+    pre-pings; in-memory SQLite keeps its single shared connection.
+    Settings left as None keep SQLAlchemy's defaults, and options already
+    in SQLALCHEMY_ENGINE_OPTIONS win.
+
+    Under gevent every greenlet in a worker shares one pool, so a checkout
+    waits for a free connection once pool size plus overflow greenlets
+    hold one; size the pool for the queries a worker should run at once,
+    not for its greenlets.
+
+    Args:
+        config (dict): The app config.
+
+    Returns:
+        dict: Options for SQLALCHEMY_ENGINE_OPTIONS.
+    """
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    settings = [('pool_size', 'DB_POOL_SIZE'),
+                ('max_overflow', 'DB_MAX_OVERFLOW'),
+                ('pool_timeout', 'DB_POOL_TIMEOUT')]
+    if url.get_backend_name() == 'sqlite':
+        connect_args = dict(options.get('connect_args') or {})
+        if config.get('SQLITE_BUSY_TIMEOUT') is not None:
+            connect_args.setdefault('timeout', config['SQLITE_BUSY_TIMEOUT'])
+        options['connect_args'] = connect_args
+        if _in_memory(url):
+            return options
+    else:
+        settings += [('pool_recycle', 'DB_POOL_RECYCLE'),
+                     ('pool_pre_ping', 'DB_POOL_PRE_PING')]
+    options.setdefault('poolclass', TimedQueuePool)
+    for option, key in settings:
+        if config.get(key) is not None:
+            options.setdefault(option, config[key])
+    return options
+
+
+def gevent_patched():
+    """Check if gevent has patched the socket module, as its workers do."""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """
+    Waits for psycopg2 I/O by yielding to the gevent hub.
+
+    Installed with psycopg2.extensions.set_wait_callback, it turns every
+    query into non-blocking polls, so other greenlets run while one waits
+    on the database.
+    """
+    from gevent.socket import wait_read, wait_write
+    while True:
+        state = conn.poll()
+        if state == psycopg2_extensions.POLL_OK:
+            return
+        if state == psycopg2_extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2_extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(
+                'Bad result from poll: {!r}'.format(state)
+            )
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    """Put a new SQLite connection in WAL mode."""
+    cursor = dbapi_connection.cursor()
+    try:
+        # Readers no longer block the writer, nor it them. NORMAL only
+        # syncs at checkpoints, which WAL keeps safe against corruption.
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+    finally:
+        cursor.close()
+
+
+def init_app(app):
+    """
+    Configures the app's database connections.
+
+    In a gevent worker, psycopg2 waits cooperatively, so one slow query no
+    longer stalls every greenlet in the worker. SQLite files use WAL mode
+    when SQLITE_WAL is set. SQLite calls still block the worker while they
+    run, busy waits included, so gevent deployments should use Postgres.
+    """
+    if psycopg2 is not None and gevent_patched():
+        psycopg2_extensions.set_wait_callback(gevent_wait_callback)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite' and \
+                    app.config.get('SQLITE_WAL') and \
+                    not _in_memory(engine.url):
+                event.listen(engine, 'connect', _enable_wal)
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+GAME_DATA_FOLDER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'static'
+)
+
+GAME_DATA_FILES = {
+    'troop_stats': 'troop_stats.json',
+    'enforcer_buffs': 'enforcer_buffs.json',
+    'enforcer_tier_multipliers': 'enforcer_tier_multipliers.json',
+    'signature_weapon_buffs': 'signature_weapon_buffs.json',
+    'counter_info': 'counter_info.json',
+    'misc_buffs': 'misc_buffs.json',
+}
+
+# How often get_game_data checks the files for changes, in seconds.
+GAME_DATA_CHECK_INTERVAL = 1.0
+
+_game_data = None
+_game_data_signature = None
+_game_data_checked_at = 0.0
+_versioned_game_data = None
+_game_data_version = None
+_bundle = None
+
+logger = logging.getLogger(__name__)
+
+
+def load_game_data(folder=GAME_DATA_FOLDER):
+    """
+    Loads the game data JSON files served to the browser.
+
+    Args:
+        folder (str): The folder containing the game data files.
+
+    Returns:
+        dict: The parsed files keyed by name (e.g. 'troop_stats').
+    """
+    game_data = {}
+    for key, filename in GAME_DATA_FILES.items():
+        with open(os.path.join(folder, filename)) as f:
+            game_data[key] = json.load(f)
+    return game_data
+
+
+def validate_game_data(game_data):
+    """
+    Checks the shape of the game data.
+
+    Args:
+        game_data (dict): The parsed files keyed by name.
+
+    Raises:
+        ValueError: If a file is missing or malformed.
+    """
+    def number(value):
+        return isinstance(value, (int, float)) and \
+            not isinstance(value, bool)
+
+    def mapping(key):
+        value = game_data.get(key)
+        if not isinstance(value, dict) or not value:
+            raise ValueError('{} must be a non-empty object.'.format(key))
+        return value
+
+    for troop_type, tiers in mapping('troop_stats').items():
+        if not isinstance(tiers, dict) or not tiers:
+            raise ValueError('{} has no tiers.'.format(troop_type))
+        for tier, stats in tiers.items():
+            if not isinstance(stats, dict) or not all(
+                    number(stats.get(stat)) for stat in ('atk', 'def', 'hp')):
+                raise ValueError('{} {} needs numeric atk, def and hp.'.format(
+                    troop_type, tier))
+    enforcers = mapping('enforcer_buffs')
+    for name, enforcer in enforcers.items():
+        buffs = enforcer.get('buffs') if isinstance(enforcer, dict) else None
+        if not isinstance(buffs, list) or not all(
+                isinstance(buff, dict) and isinstance(buff.get('name'), str)
+                and number(buff.get('max_value')) for buff in buffs):
+            raise ValueError('{} needs a list of named buffs with a '
+                             'max_value.'.format(name))
+    for tier, multiplier in mapping('enforcer_tier_multipliers').items():
+        if not isinstance(multiplier, dict) or \
+                not number(multiplier.get('percentage_benefit')):
+            raise ValueError('Tier {} needs a numeric '
+                             'percentage_benefit.'.format(tier))
+    for name in mapping('signature_weapon_buffs'):
+        if name not in enforcers:
+            raise ValueError('Signature weapon for unknown enforcer '
+                             '{}.'.format(name))
+    for troop_type, counters in mapping('counter_info').items():
+        if not isinstance(counters, dict) or not all(
+                isinstance(counters.get(key, []), list)
+                for key in ('strong_against', 'weak_against')):
+            raise ValueError('Counters for {} must be lists.'.format(
+                troop_type))
+    mapping('misc_buffs')
+
+
+def game_data_signature(folder=None):
+    """
+    Summarises the modification times and sizes of the game data files.
+
+    Args:
+        folder (str): The folder containing the game data files. Defaults
+                      to GAME_DATA_FOLDER.
+
+    Returns:
+        tuple: A value that changes whenever any of the files changes.
+    """
+    folder = folder or GAME_DATA_FOLDER
+    signature = []
+    for filename in sorted(GAME_DATA_FILES.values()):
+        stat = os.stat(os.path.join(folder, filename))
+        signature.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def get_game_data():
+    """
+    Returns the game data, loading and validating it on first use.
+
+    The files are checked at most every GAME_DATA_CHECK_INTERVAL seconds
+    and reloaded when any of them has changed, which in turn changes
+    game_data_version and so invalidates every cached result. A reload
+    that fails validation is logged and the previous data kept, so a bad
+    edit never takes the site down.
+
+    Raises:
+        ValueError: If the data is invalid on first load.
+    """
+    global _game_data, _game_data_signature, _game_data_checked_at
+    now = time.monotonic()
+    if _game_data is None or \
+            now - _game_data_checked_at >= GAME_DATA_CHECK_INTERVAL:
+        _game_data_checked_at = now
+        signature = game_data_signature()
+        if _game_data is None or signature != _game_data_signature:
+            try:
+                game_data = load_game_data(GAME_DATA_FOLDER)
+                validate_game_data(game_data)
+            except ValueError as e:
+                if _game_data is None:
+                    raise
+                logger.error('Keeping the previous game data: %s', e)
+            else:
+                _game_data = game_data
+            _game_data_signature = signature
+    return _game_data
+
+
+def game_data_version(game_data=None):
+    """
+    Fingerprints the game data.
+
+    Results computed from the data are keyed by this version, so they are
+    never served after the data changes.
+
+    Args:
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        str: A hex digest of the canonical JSON form of the data.
+    """
+    global _versioned_game_data, _game_data_version
+    game_data = game_data or get_game_data()
+    if game_data is not _versioned_game_data:
+        _game_data_version = hashlib.sha256(
+            json.dumps(game_data, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        _versioned_game_data = game_data
+    return _game_data_version
+
+
+def game_data_bundle():
+    """
+    Returns all the game data as one JSON document.
+
+    The document is serialised once per version, so it can be served as
+    is with the version as its strong ETag.
+
+    Returns:
+        tuple: (version, the UTF-8 JSON bytes of {'version': ...,
+               'data': {...}}).
+    """
+    global _bundle
+    game_data = get_game_data()
+    version = game_data_version(game_data)
+    if _bundle is None or _bundle[0] != version:
+        _bundle = (version, json.dumps(
+            {'version': version, 'data': game_data},
+            sort_keys=True, separators=(',', ':')
+        ).encode('utf-8'))
+    return _bundle
@@ -0,0 +1,76 @@
+import numpy as np
+from PIL import Image, ImageOps
+
+# Images are reduced to HASH_IMAGE_SIZE square before the DCT, and the
+# lowest HASH_SIZE x HASH_SIZE frequencies make up the hash.
+HASH_IMAGE_SIZE = 32
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+# The hash is split into this many chunks, each stored in an indexed
+# column. Two hashes within HASH_CHUNKS - 1 bits of each other must agree
+# exactly on at least one chunk, so candidates are found by index lookups.
+HASH_CHUNKS = 4
+CHUNK_BITS = HASH_BITS // HASH_CHUNKS
+# Screenshots this close are treated as the same screen. Kept tight, since
+# the same screen with different numbers on it hashes close too.
+MAX_HASH_DISTANCE = HASH_CHUNKS - 1
+
+
+def _dct_matrix(size):
+    """Return the orthonormal DCT-II matrix of a size."""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_IMAGE_SIZE)
+
+
+def perceptual_hash(filepath):
+    """
+    Computes the DCT perceptual hash of an image.
+
+    Resizing, recompression and small colour shifts change only a few bits,
+    so near-duplicate images have hashes a small Hamming distance apart.
+
+    Args:
+        filepath (str): The path to the image.
+
+    Returns:
+        int: The HASH_BITS-bit hash.
+    """
+    with Image.open(filepath) as image:
+        image.draft('L', (HASH_IMAGE_SIZE * 8, HASH_IMAGE_SIZE * 8))
+        image = ImageOps.grayscale(ImageOps.exif_transpose(image)).resize(
+            (HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), Image.LANCZOS
+        )
+    pixels = np.asarray(image, dtype=np.float64)
+    frequencies = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only reflects overall brightness.
+    bits = frequencies > np.median(frequencies[1:])
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hash_chunks(value):
+    """
+    Splits a hash into the chunks stored in the index columns.
+
+    Args:
+        value (int): A perceptual hash.
+
+    Returns:
+        list: HASH_CHUNKS integers of CHUNK_BITS bits, most significant
+              first.
+    """
+    mask = (1 << CHUNK_BITS) - 1
+    return [
+        (value >> (CHUNK_BITS * (HASH_CHUNKS - 1 - i))) & mask
+        for i in range(HASH_CHUNKS)
+    ]
+
+
+def hamming_distance(first, second):
+    """Count the bits in which two hashes differ."""
+    return bin(first ^ second).count('1')
@@ -0,0 +1,220 @@
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+from optimizer import score_result
+
+# Jobs that have not finished yet; further submissions are refused.
+MAX_ACTIVE_JOBS = 8
+# Finished jobs kept for polling before the oldest are forgotten.
+MAX_FINISHED_JOBS = 100
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+def result_score(entry):
+    """Rank a job result by the battle simulation it carries."""
+    return score_result(entry['simulation'])
+
+
+class Job:
+    """A search split into shards that run in the worker pool."""
+
+    def __init__(self, kind, shard_count, top_k, key):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = RUNNING if shard_count else DONE
+        self.shard_count = shard_count
+        self.shards_done = 0
+        self.top_k = top_k
+        self.key = key
+        self.error = None
+        self.futures = []
+        self.heap = []
+        self.sequence = itertools.count()
+
+    def merge(self, entries):
+        """Add a shard's results to the job's top-K heap."""
+        for entry in entries:
+            item = (self.key(entry), -next(self.sequence), entry)
+            if len(self.heap) < self.top_k:
+                heapq.heappush(self.heap, item)
+            elif item[0] > self.heap[0][0]:
+                heapq.heapreplace(self.heap, item)
+
+    def to_dict(self):
+        """Return the JSON-serialisable state of the job."""
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'shards_total': self.shard_count,
+            'shards_done': self.shards_done,
+            'results': [entry for _, _, entry in sorted(self.heap,
+                                                        reverse=True)],
+        }
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class JobRunner:
+    """
+    Runs CPU-bound searches in a pool of worker processes.
+
+    Each job is split into shards that are evaluated in separate processes,
+    so long searches never hold up the web workers, and the shard results
+    are merged into a single top-K heap as they come in. Jobs live in the
+    memory of the web process that accepted them.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.jobs = OrderedDict()
+        self.lock = threading.RLock()
+        self.executor = None
+
+    def init_app(self, app):
+        """Read the pool size from the app config."""
+        self.max_workers = app.config.get('JOB_WORKERS') or self.max_workers
+        app.extensions['job_runner'] = self
+
+    def _get_executor(self):
+        """Start the worker pool on first use."""
+        if self.executor is None:
+            # Spawned workers do not inherit the web process's threads or
+            # gevent hub, which forking would copy in an unusable state.
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers or os.cpu_count(),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self.executor
+
+    def submit(self, kind, function, shards, top_k, key=result_score):
+        """
+        Queues a job.
+
+        Args:
+            kind (str): A label for the kind of search.
+            function (callable): A picklable module-level function that
+                                 returns a list of results for one shard.
+            shards (list): The argument tuples, one per shard.
+            top_k (int): The number of results to keep.
+            key (callable): Ranks a result, larger is better.
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            RuntimeError: If too many jobs are already running.
+        """
+        job = Job(kind, len(shards), top_k, key)
+        with self.lock:
+            active = sum(
+                1 for other in self.jobs.values()
+                if other.status not in FINISHED
+            )
+            if active >= MAX_ACTIVE_JOBS:
+                raise RuntimeError('Too many jobs are running, try again '
+                                   'later.')
+            self.jobs[job.id] = job
+            self._forget_finished()
+            executor = self._get_executor()
+            for args in shards:
+                future = executor.submit(function, *args)
+                job.futures.append(future)
+                future.add_done_callback(
+                    lambda future, job=job: self._shard_done(job, future)
+                )
+        return job.id
+
+    def _shard_done(self, job, future):
+        """Merge a finished shard into its job."""
+        try:
+            entries = future.result()
+        except CancelledError:
+            return
+        except Exception as e:
+            with self.lock:
+                if job.status not in FINISHED:
+                    job.status = FAILED
+                    job.error = str(e) or type(e).__name__
+                    self._cancel_futures(job)
+            return
+        with self.lock:
+            if job.status in FINISHED:
+                return
+            job.merge(entries)
+            job.shards_done += 1
+            if job.shards_done == job.shard_count:
+                job.status = DONE
+
+    def _cancel_futures(self, job):
+        """Cancel the shards of a job that have not started."""
+        for future in job.futures:
+            future.cancel()
+        job.futures = []
+
+    def _forget_finished(self):
+        """Drop the oldest finished jobs beyond MAX_FINISHED_JOBS."""
+        finished = [
+            job_id for job_id, job in self.jobs.items()
+            if job.status in FINISHED
+        ]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        """
+        Returns the state of a job.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            dict: The job's status, progress and best results so far, or
+                  None if the job is unknown.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def cancel(self, job_id):
+        """
+        Cancels a job.
+
+        Shards that have not started are dropped and the results of any
+        that are still running are ignored.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            dict: The job's state, or None if the job is unknown.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status not in FINISHED:
+                job.status = CANCELLED
+                self._cancel_futures(job)
+            return job.to_dict()
+
+    def shutdown(self):
+        """Stop the worker pool, cancelling shards that have not started."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+job_runner = JobRunner()
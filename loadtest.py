@@ -0,0 +1,638 @@
+import argparse
+import http.client
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+from werkzeug.serving import make_server
+
+from benchmark import PASSWORD, SCALES, create_app_with_database, \
+    generate_battalion, generate_follow_graph, generate_screenshot, \
+    generate_users
+
+DEFAULT_USERS = 1000
+DEFAULT_FOLLOWS = 10
+DEFAULT_CONCURRENCY = (8,)
+DEFAULT_DURATION = 30.0
+DEFAULT_WARMUP = 5.0
+PERCENTILES = (50, 95, 99)
+REQUEST_TIMEOUT = 30
+# Usernames the register flow creates start with this, so they are never
+# picked to log in with.
+REGISTERED_PREFIX = 'load-'
+# Battalions and screenshots are drawn from pools of this size, so the
+# simulation cache and upload deduplication see realistic repeats.
+BATTALION_POOL_SIZE = 50
+SCREENSHOT_POOL_SIZE = 4
+# A stage whose throughput grew less than this over the previous stage's
+# is where the server saturated.
+SATURATION_GAIN = 0.10
+CSRF_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+FLOWS = {}
+
+
+def flow(name, weight):
+    """
+    Registers a user flow and its default share of the mix.
+
+    The decorated function is given the VirtualUser and makes the flow's
+    requests through it.
+    """
+    def register(function):
+        FLOWS[name] = (function, weight)
+        return function
+    return register
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Leave redirects unfollowed, so each request is timed on its own."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def encode_multipart(fields, files):
+    """
+    Encodes a multipart/form-data body.
+
+    Args:
+        fields (dict): Form field names and values.
+        files (dict): File field names and (filename, content type, bytes).
+
+    Returns:
+        tuple: (body bytes, Content-Type header value).
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'
+            .format(boundary, name, value).encode()
+        )
+    for name, (filename, content_type, content) in files.items():
+        parts.append(
+            '--{}\r\nContent-Disposition: form-data; name="{}"; '
+            'filename="{}"\r\nContent-Type: {}\r\n\r\n'
+            .format(boundary, name, filename, content_type).encode()
+        )
+        parts.append(content + b'\r\n')
+    parts.append('--{}--\r\n'.format(boundary).encode())
+    return b''.join(parts), 'multipart/form-data; boundary=' + boundary
+
+
+class Stats:
+    """
+    Latencies and errors per route, shared by every virtual user.
+
+    Requests started before measure_from, during the warmup, are not
+    recorded.
+    """
+
+    def __init__(self, measure_from=0.0):
+        self.measure_from = measure_from
+        self.latencies = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, label, started, latency, error=None):
+        """Record one request, with the reason it failed if it did."""
+        if started < self.measure_from:
+            return
+        with self.lock:
+            self.latencies.setdefault(label, []).append(latency)
+            errors = self.errors.setdefault(label, Counter())
+            if error is not None:
+                errors[error] += 1
+
+    def summary(self, duration):
+        """
+        Summarizes the recorded requests.
+
+        Args:
+            duration (float): The seconds requests were recorded for.
+
+        Returns:
+            dict: Per route label, and for 'total', the request and error
+                  counts, error rate, requests per second, latency
+                  percentiles in milliseconds and the commonest errors.
+        """
+        with self.lock:
+            latencies = {label: list(values)
+                         for label, values in self.latencies.items()}
+            errors = {label: Counter(values)
+                      for label, values in self.errors.items()}
+        routes = {label: _summarize(values, errors[label], duration)
+                  for label, values in sorted(latencies.items())}
+        routes['total'] = _summarize(
+            [value for values in latencies.values() for value in values],
+            sum(errors.values(), Counter()), duration
+        )
+        return routes
+
+
+def _summarize(latencies, errors, duration):
+    """Summarize one route's latencies and errors."""
+    requests = len(latencies)
+    failed = sum(errors.values())
+    result = {
+        'requests': requests,
+        'errors': failed,
+        'error_rate': failed / requests if requests else 0.0,
+        'requests_per_second': requests / duration if duration else 0.0,
+        'top_errors': dict(errors.most_common(3)),
+    }
+    values = np.percentile(np.array(latencies) * 1000, PERCENTILES) \
+        if latencies else [0.0] * len(PERCENTILES)
+    for percentile, value in zip(PERCENTILES, values):
+        result['p{}_ms'.format(percentile)] = float(value)
+    return result
+
+
+class VirtualUser:
+    """
+    One simulated user, with its own cookies, replaying flows.
+
+    Args:
+        base_url (str): The app's URL.
+        stats (Stats): Where requests are recorded.
+        data (LoadData): The usernames, battalions and screenshots to use.
+        rng (random.Random): This user's random source.
+    """
+
+    def __init__(self, base_url, stats, data, rng):
+        self.base_url = base_url.rstrip('/')
+        self.stats = stats
+        self.data = data
+        self.rng = rng
+        self.opener = self.new_session()
+
+    @staticmethod
+    def new_session():
+        """Return an opener with an empty cookie jar."""
+        return urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect()
+        )
+
+    def request(self, label, path, method='GET', form=None, json_body=None,
+                files=None, expect=(200,), opener=None):
+        """
+        Makes one request and records it under a route label.
+
+        Args:
+            label (str): The route, e.g. 'GET /user/<username>'.
+            path (str): The path and query string.
+            method (str): The HTTP method.
+            form (dict): Form fields to post.
+            json_body: A value to post as JSON.
+            files (dict): Files to post, as for encode_multipart.
+            expect (tuple): Status codes that count as success.
+            opener: The session to use. Defaults to this user's.
+
+        Returns:
+            tuple: (status, body bytes); status is None if the request
+                   could not be made.
+        """
+        headers, data = {}, None
+        if files is not None:
+            data, headers['Content-Type'] = encode_multipart(form or {},
+                                                             files)
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        request = urllib.request.Request(self.base_url + path, data=data,
+                                         headers=headers, method=method)
+        started = time.time()
+        start = time.perf_counter()
+        status, body, error = None, b'', None
+        try:
+            with (opener or self.opener).open(
+                    request, timeout=REQUEST_TIMEOUT) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except (OSError, http.client.HTTPException) as e:
+            error = type(e).__name__
+        latency = time.perf_counter() - start
+        if error is None and status not in expect:
+            error = 'HTTP {}'.format(status)
+        self.stats.record(label, started, latency, error)
+        return status, body
+
+    def form_token(self, label, path, opener=None):
+        """GET a form page and return its CSRF token, if it has one."""
+        _, body = self.request(label, path, opener=opener)
+        match = CSRF_PATTERN.search(body.decode('utf-8', 'replace'))
+        return {'csrf_token': match.group(1)} if match else {}
+
+    def login(self):
+        """Log in as a seeded user in a new session."""
+        opener = self.new_session()
+        fields = self.form_token('GET /auth/login', '/auth/login', opener)
+        fields.update(username=self.rng.choice(self.data.usernames),
+                      password=PASSWORD)
+        self.request('POST /auth/login', '/auth/login', 'POST', form=fields,
+                     expect=(302,), opener=opener)
+        self.opener = opener
+
+    def run(self, flows, weights, stop, think_time):
+        """Replay randomly picked flows until stop is set."""
+        self.login()
+        while not stop.is_set():
+            self.rng.choices(flows, weights)[0](self)
+            if think_time:
+                stop.wait(self.rng.expovariate(1 / think_time))
+
+
+@flow('register', 1)
+def register_flow(user):
+    """Sign up as a new user, landing on the enforcer calculator."""
+    opener = user.new_session()
+    fields = user.form_token('GET /auth/register', '/auth/register', opener)
+    fields.update(username=REGISTERED_PREFIX + uuid.uuid4().hex[:12],
+                  password=PASSWORD, password2=PASSWORD)
+    user.request('POST /auth/register', '/auth/register', 'POST',
+                 form=fields, expect=(302,), opener=opener)
+    user.request('GET /enforcer_calculator', '/enforcer_calculator',
+                 opener=opener)
+
+
+@flow('login', 1)
+def login_flow(user):
+    """Log in again as a seeded user and open the index page."""
+    user.login()
+    user.request('GET /', '/')
+
+
+@flow('save_user_details', 2)
+def save_details_flow(user):
+    """Save a random battalion from the index page's text boxes."""
+    battalion = user.rng.choice(user.data.battalions)
+    user.request('POST /save_user_details', '/save_user_details', 'POST',
+                 form={
+                     'user_troops': '\n'.join(
+                         '{type},{tier},{quantity}'.format(**troop)
+                         for troop in battalion['troops']
+                     ),
+                     'user_enforcers': ';'.join(
+                         '{},{},{}'.format(
+                             enforcer['name'], enforcer['tier'],
+                             str(enforcer['has_signature_weapon']).lower()
+                         )
+                         for enforcer in battalion['enforcers']
+                     ),
+                 }, expect=(204,))
+
+
+@flow('find_friends', 4)
+def find_friends_flow(user):
+    """Browse suggestions, search, open a profile and sometimes follow."""
+    user.request('GET /find_friends', '/find_friends')
+    username = user.rng.choice(user.data.usernames)
+    start = user.rng.randrange(max(len(username) - 3, 1))
+    query = username[start:start + user.rng.randint(2, 6)]
+    user.request('GET /find_friends?q=', '/find_friends?' +
+                 urllib.parse.urlencode({'q': query}))
+    path = urllib.parse.quote(username)
+    user.request('GET /user/<username>', '/user/' + path)
+    if user.rng.random() < 0.3:
+        user.request('GET /follow/<username>', '/follow/' + path,
+                     expect=(302,))
+
+
+@flow('profile_upload', 1)
+def upload_flow(user):
+    """Open the profile page and upload a screenshot."""
+    user.request('GET /profile', '/profile')
+    image = user.rng.choice(user.data.screenshots)
+    user.request('POST /profile', '/profile', 'POST', files={
+        'screenshot': ('screenshot.png', 'image/png', image)
+    }, expect=(302,))
+
+
+@flow('calculators', 4)
+def calculators_flow(user):
+    """Simulate a battle, run both optimizers and the resource form."""
+    attacker, defender = user.rng.sample(user.data.battalions, 2)
+    user.request('POST /api/simulate', '/api/simulate', 'POST',
+                 json_body={'attacker': attacker, 'defender': defender})
+    user.request('POST /api/optimize/troops', '/api/optimize/troops',
+                 'POST', json_body={'opponent': defender})
+    user.request('POST /api/optimize/enforcers', '/api/optimize/enforcers',
+                 'POST', json_body={'user': attacker, 'opponent': defender})
+    fields = user.form_token('GET /resource_calculator',
+                             '/resource_calculator')
+    fields.update({resource: user.rng.randint(1, 10 ** 7) for resource in
+                   ('cash', 'cargo', 'arms', 'metal', 'diamonds')})
+    user.request('POST /resource_calculator', '/resource_calculator',
+                 'POST', form=fields)
+
+
+class LoadData:
+    """
+    What virtual users send: seeded usernames, battalions and screenshots.
+
+    Args:
+        usernames (list): Users that log in with PASSWORD.
+        game_data (dict): The loaded game data.
+        rng (random.Random): The random source.
+        screenshots (bool): Whether to draw screenshots, which only the
+                            upload flow needs.
+    """
+
+    def __init__(self, usernames, game_data, rng, screenshots=True):
+        self.usernames = usernames
+        self.battalions = [
+            generate_battalion(rng, game_data, rng.randint(2, 6))
+            for _ in range(BATTALION_POOL_SIZE)
+        ]
+        self.screenshots = [
+            generate_screenshot(SCALES['full']['screenshot'], rng)
+            for _ in range(SCREENSHOT_POOL_SIZE if screenshots else 0)
+        ]
+
+
+def seed_database(app, users, follows, rng):
+    """
+    Creates the tables and seeds users and follows into an empty database.
+
+    A database that already has users, e.g. from an earlier run, is used
+    as it is.
+
+    Args:
+        app (Flask): The app, configured with the database.
+        users (int): The number of users to seed.
+        follows (int): Follows per seeded user.
+        rng (random.Random): The random source.
+
+    Returns:
+        list: The usernames of users that log in with PASSWORD.
+    """
+    from app import db
+    from models import User
+    with app.app_context():
+        db.create_all()
+        if db.session.execute(db.select(db.func.count(User.id))).scalar():
+            print('Using the users already in the database.')
+        else:
+            print('Seeding {} users...'.format(users))
+            user_ids = generate_users(users, rng)
+            db.session.commit()
+            generate_follow_graph(user_ids, follows, rng)
+            db.session.commit()
+        return db.session.execute(
+            db.select(User.username)
+            .where(User.username.not_like(REGISTERED_PREFIX + '%'))
+        ).scalars().all()
+
+
+def run_stage(base_url, data, concurrency, duration, warmup, mix,
+              think_time=0.0, seed=0):
+    """
+    Drives the app with a number of concurrent virtual users.
+
+    Args:
+        base_url (str): The app's URL.
+        data (LoadData): What the virtual users send.
+        concurrency (int): The number of virtual users.
+        duration (float): Seconds to record requests for, after warmup.
+        warmup (float): Seconds to run before recording.
+        mix (dict): Flow names and their weights.
+        think_time (float): Mean seconds each user waits between flows.
+        seed (int): Seeds the virtual users' random sources.
+
+    Returns:
+        dict: The stage's concurrency and Stats.summary per route.
+    """
+    flows = [FLOWS[name][0] for name in mix]
+    weights = list(mix.values())
+    stats = Stats(time.time() + warmup)
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=VirtualUser(base_url, stats, data,
+                               random.Random(seed * 100003 + number)).run,
+            args=(flows, weights, stop, think_time),
+            name='virtual-user-{}'.format(number), daemon=True
+        )
+        for number in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup + duration)
+    stop.set()
+    for thread in threads:
+        thread.join(REQUEST_TIMEOUT)
+    return {'concurrency': concurrency,
+            'routes': stats.summary(duration)}
+
+
+def find_saturation(stages):
+    """
+    Finds where adding virtual users stopped adding throughput.
+
+    Args:
+        stages (list): Outputs of run_stage, by rising concurrency.
+
+    Returns:
+        int: The first concurrency whose throughput grew by less than
+             SATURATION_GAIN over the previous stage's, or None.
+    """
+    for previous, stage in zip(stages, stages[1:]):
+        before = previous['routes']['total']['requests_per_second']
+        after = stage['routes']['total']['requests_per_second']
+        if after < before * (1 + SATURATION_GAIN):
+            return stage['concurrency']
+    return None
+
+
+def serve(app):
+    """
+    Serves an app from a background thread on a free local port.
+
+    Returns:
+        tuple: (server, base URL); call server.shutdown() to stop it.
+    """
+    # Werkzeug logs every request, which would bury the results.
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-server',
+                     daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def _stop_workers():
+    """Stop the background workers the served app started."""
+    from analysis import analysis_queue
+    from suggestions import suggestion_refresher
+    from thumbnails import thumbnail_generator
+    for worker in (analysis_queue, suggestion_refresher,
+                   thumbnail_generator):
+        worker.shutdown()
+
+
+def _print_stage(stage):
+    """Print a stage's per-route results as a table."""
+    print()
+    print('Concurrency {}'.format(stage['concurrency']))
+    print('{:<32} {:>8} {:>8} {:>9} {:>9} {:>9} {:>7}'.format(
+        'route', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'
+    ))
+    for label, route in stage['routes'].items():
+        print('{:<32} {:>8} {:>8.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>7.1%}'
+              .format(label, route['requests'],
+                      route['requests_per_second'], route['p50_ms'],
+                      route['p95_ms'], route['p99_ms'], route['error_rate']))
+        for error, count in route['top_errors'].items():
+            print('    {} x {}'.format(count, error))
+
+
+def _parse_mix(values):
+    """Read name=weight pairs over the default flow weights."""
+    mix = {name: weight for name, (_, weight) in FLOWS.items()}
+    for value in values or ():
+        name, _, weight = value.partition('=')
+        if name not in FLOWS:
+            raise ValueError('Unknown flow: {}'.format(name))
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise ValueError('Invalid weight: {}'.format(value)) from None
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+    if not mix:
+        raise ValueError('The mix has no flows.')
+    return mix
+
+
+def main(argv=None):
+    """Run the load test command line; see --help."""
+    parser = argparse.ArgumentParser(
+        description='Replay a weighted mix of user flows against the app '
+                    'at rising concurrency and report throughput, latency '
+                    'and errors per route.'
+    )
+    parser.add_argument(
+        '--database',
+        help='database URL to seed and serve from (default: a temporary '
+             'SQLite file)'
+    )
+    parser.add_argument(
+        '--url',
+        help='drive an already running server, e.g. gunicorn, instead of '
+             'serving the app here; it must use --database'
+    )
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS,
+                        help='users to seed (default: %(default)s)')
+    parser.add_argument('--follows', type=int, default=DEFAULT_FOLLOWS,
+                        help='follows per seeded user (default: '
+                             '%(default)s)')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=list(DEFAULT_CONCURRENCY),
+                        help='virtual users per stage (default: 8)')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help='seconds recorded per stage (default: '
+                             '%(default)s)')
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP,
+                        help='seconds run unrecorded before each stage '
+                             '(default: %(default)s)')
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help='mean seconds between a user\'s flows '
+                             '(default: none)')
+    parser.add_argument('--mix', nargs='+', metavar='FLOW=WEIGHT',
+                        help='flow weights, e.g. calculators=10 register=0; '
+                             'flows: ' + ', '.join(sorted(FLOWS)))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON here')
+    args = parser.parse_args(argv)
+    try:
+        mix = _parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.url and not args.database:
+        parser.error('--url needs the --database the server uses.')
+
+    folder = tempfile.mkdtemp(prefix='tgm-loadtest-')
+    server = None
+    try:
+        app = create_app_with_database(
+            args.database or
+            'sqlite:///' + os.path.join(folder, 'loadtest.db')
+        )
+        app.config.update(
+            UPLOAD_FOLDER=os.path.join(folder, 'uploads'),
+            AVATAR_FOLDER=os.path.join(folder, 'avatars'),
+            THUMBNAIL_FOLDER=os.path.join(folder, 'thumbnails'),
+            PROFILE_FOLDER=os.path.join(folder, 'profiles'),
+        )
+        rng = random.Random(args.seed)
+        usernames = seed_database(app, args.users, args.follows, rng)
+        if not usernames:
+            parser.error('The database has no users to log in as.')
+        with app.app_context():
+            from game_data import get_game_data
+            data = LoadData(usernames, get_game_data(), rng,
+                            'profile_upload' in mix)
+        base_url = args.url
+        if base_url is None:
+            server, base_url = serve(app)
+            print('Serving the app at {}. The server shares this process '
+                  'with the load generator; use --url to measure a '
+                  'deployment.'.format(base_url))
+
+        stages = []
+        for concurrency in sorted(args.concurrency):
+            stage = run_stage(base_url, data, concurrency, args.duration,
+                              args.warmup, mix, args.think_time, args.seed)
+            stages.append(stage)
+            _print_stage(stage)
+    finally:
+        if server is not None:
+            server.shutdown()
+            _stop_workers()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print()
+    print('{:>11} {:>8} {:>9} {:>7}'.format(
+        'concurrency', 'req/s', 'p99 ms', 'errors'
+    ))
+    for stage in stages:
+        total = stage['routes']['total']
+        print('{:>11} {:>8.1f} {:>9.1f} {:>7.1%}'.format(
+            stage['concurrency'], total['requests_per_second'],
+            total['p99_ms'], total['error_rate']
+        ))
+    saturation = find_saturation(stages)
+    if saturation is not None:
+        print('Throughput stopped scaling at {} concurrent users.'.format(
+            saturation))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'url': args.url, 'mix': mix, 'duration': args.duration,
+                'think_time': args.think_time, 'stages': stages,
+                'saturation': saturation,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,40 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, \
-    request, current_app
+    request, jsonify, Response, abort, send_file, stream_with_context
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
-import os
+import io
+import re
+import json
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
-from PIL import Image
 
 from app import db
-from models import User, Screenshot
+from auth import admin_required
+from models import User, Screenshot, StoredFile, DEFAULT_PAGE_SIZE
 from forms import ChangePasswordForm, CalculatorForm, EnforcerCalculatorForm, ResourceCalculatorForm
-from calculator import calculate_optimal_troops, calculate_optimal_enforcers, calculate_resources, analyze_screenshot
+from calculator import calculate_optimal_troops, calculate_optimal_enforcers, calculate_resources
+from analysis import analysis_queue
+from search import search_users, DEFAULT_SEARCH_LIMIT
+from suggestions import get_suggestions, suggestion_refresher
+from roster import KINDS as ROSTER_KINDS, CONTENT_TYPES as ROSTER_TYPES, \
+    export_roster, import_roster
+from user_details import parse_troop_text, parse_enforcer_text, \
+    validate_details, save_details, details_text
+from storage import get_storage, store_file, release_file, \
+    screenshot_path, import_legacy_screenshots
+from thumbnails import thumbnail_generator, THUMBNAIL_SIZES, \
+    THUMBNAIL_FORMATS
+from buff_table import get_buff_table, buff_table_payload
+from game_data import game_data_bundle
+from metrics import track
+from cache import simulation_cache, battalion_fingerprint, cache_key
+from jobs import job_runner
+from optimizer import prepare_enforcer_search, search_enforcer_teams, \
+    enforcer_search_shards, run_enforcer_shard, DEFAULT_TOP_K, MAX_TOP_K, \
+    prepare_troop_mix_search, search_troop_mix, troop_mix_shards, \
+    run_troop_mix_shard, troop_mix_key, DEFAULT_MIX_SHARDS
+from simulation import calculate_battalion_stats, simulate_battle, \
+    simulate_batch, parse_battalion, battalion_summary, MAX_BATCH_BATTALIONS
 
 main_bp = Blueprint('main', __name__)
 
@@ -20,8 +45,7 @@ def index():
     user_troops = ''
     user_enforcers = ''
     if current_user.is_authenticated:
-        user_troops = current_user.user_troops
-        user_enforcers = current_user.user_enforcers
+        user_troops, user_enforcers = details_text(current_user)
     return render_template(
         'index.html', user_troops=user_troops, user_enforcers=user_enforcers
     )
@@ -45,9 +69,33 @@ def calculate():
 @main_bp.route('/user/<username>')
 @login_required
 def user(username):
-    """Render a user's profile page."""
+    """Render a user's profile page with a page of their follow list."""
     user = User.query.filter_by(username=username).first_or_404()
-    return render_template('user.html', user=user)
+    list_name = request.args.get('list', 'followers')
+    if list_name not in ('followers', 'following'):
+        abort(404)
+    list_page = user.list_followers if list_name == 'followers' \
+        else user.list_followed
+    users = list_page(request.args.get('after', type=int),
+                      DEFAULT_PAGE_SIZE + 1)
+    next_after = None
+    if len(users) > DEFAULT_PAGE_SIZE:
+        users = users[:DEFAULT_PAGE_SIZE]
+        next_after = users[-1].id
+    following = current_user.following_ids(
+        [user.id] + [listed.id for listed in users]
+    )
+    return render_template('user.html', user=user, users=users,
+                           list_name=list_name, next_after=next_after,
+                           following=following)
+
+
+def redirect_back(username):
+    """Redirect to the page named by 'next', or to a user's page."""
+    target = request.args.get('next', '')
+    if target.startswith('/') and not target.startswith('//'):
+        return redirect(target)
+    return redirect(url_for('main.user', username=username))
 
 
 @main_bp.route('/follow/<username>')
@@ -63,8 +111,9 @@ def follow(username):
         return redirect(url_for('main.user', username=username))
     current_user.follow(user)
     db.session.commit()
+    suggestion_refresher.notify()
     flash('You are following {}!'.format(username))
-    return redirect(url_for('main.user', username=username))
+    return redirect_back(username)
 
 
 @main_bp.route('/unfollow/<username>')
@@ -80,8 +129,9 @@ def unfollow(username):
         return redirect(url_for('main.user', username=username))
     current_user.unfollow(user)
     db.session.commit()
+    suggestion_refresher.notify()
     flash('You are not following {}.'.format(username))
-    return redirect(url_for('main.user', username=username))
+    return redirect_back(username)
 
 
 @main_bp.route('/profile', methods=['GET', 'POST'])
@@ -93,10 +143,12 @@ def profile():
             file = request.files['avatar']
             if file.filename != '':
                 filename = secure_filename(file.filename)
-                file.save(
-                    os.path.join(current_app.config['AVATAR_FOLDER'], filename)
-                )
+                with track('profile.store_avatar'):
+                    stored = store_file(file.stream, filename)
+                if current_user.avatar_hash:
+                    release_file(current_user.avatar_hash)
                 current_user.avatar = filename
+                current_user.avatar_hash = stored.digest
                 db.session.commit()
                 flash('Your avatar has been updated.')
                 return redirect(url_for('main.profile'))
@@ -108,32 +160,72 @@ def profile():
                 timestamp = now.strftime("%Y%m%d_%H%M%S")
                 filename = f"{timestamp}_{secure_filename(file.filename)}"
 
-                # Create uploads folder if it doesn't exist
-                uploads_folder = current_app.config['UPLOAD_FOLDER']
-                if not os.path.exists(uploads_folder):
-                    os.makedirs(uploads_folder)
-
-                # Save original screenshot
-                filepath = os.path.join(uploads_folder, filename)
-                file.save(filepath)
-
-                # Create thumbnail
-                thumb_folder = os.path.join(current_app.static_folder, 'thumbnails')
-                if not os.path.exists(thumb_folder):
-                    os.makedirs(thumb_folder)
-
-                thumb_path = os.path.join(thumb_folder, filename)
-                with Image.open(filepath) as img:
-                    img.thumbnail((128, 128))
-                    img.save(thumb_path)
-
-                screenshot = Screenshot(filename=filename, user=current_user)
+                # Stream the upload into the content store; an image that
+                # is already stored is not written again.
+                with track('profile.store_screenshot'):
+                    stored = store_file(file.stream, filename)
+                screenshot = Screenshot(filename=filename,
+                                        content_hash=stored.digest,
+                                        user=current_user)
                 db.session.add(screenshot)
                 db.session.commit()
+                # Thumbnails are generated off the request path; the
+                # thumbnail route regenerates any that are still missing.
+                thumbnail_generator.submit(screenshot_path(screenshot),
+                                           stored.digest)
+                # Start reading the screenshot now, so the result is usually
+                # ready by the time the user asks for it.
+                analysis_queue.submit(screenshot)
                 flash('Your screenshot has been uploaded.')
                 return redirect(url_for('main.profile'))
 
-    return render_template('profile.html', user=current_user)
+    screenshots = current_user.screenshots.all()
+    if import_legacy_screenshots(screenshots):
+        db.session.commit()
+    return render_template('profile.html', user=current_user,
+                           screenshots=screenshots)
+
+
+def send_immutable(path, mimetype, etag):
+    """Send a file whose URL changes with its content, caching it forever."""
+    response = send_file(path, mimetype=mimetype, etag=etag,
+                         max_age=365 * 24 * 60 * 60)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+
+@main_bp.route('/media/<digest>/<name>')
+def media(digest, name):
+    """Serve a stored upload; the name only labels the URL."""
+    stored = db.session.get(StoredFile, digest) or abort(404)
+    try:
+        path = get_storage().local_path(stored.digest)
+    except OSError:
+        abort(404)
+    return send_immutable(path, stored.content_type, stored.digest)
+
+
+@main_bp.route('/thumbnails/<digest>/<size>.<fmt>')
+def thumbnail(digest, size, fmt):
+    """Serve a screenshot thumbnail, generating it if it is missing."""
+    if size not in THUMBNAIL_SIZES or fmt not in THUMBNAIL_FORMATS or \
+            not re.fullmatch(r'[0-9a-f]{64}', digest):
+        abort(404)
+    screenshot = Screenshot.query.filter_by(
+        content_hash=digest
+    ).first_or_404()
+    try:
+        path = thumbnail_generator.ensure(screenshot_path(screenshot),
+                                          digest, size, fmt)
+    except FutureTimeoutError:
+        return Response('Thumbnail is being generated.', status=503,
+                        headers={'Retry-After': '1'})
+    except OSError:
+        abort(404)
+    return send_immutable(path, THUMBNAIL_FORMATS[fmt][1],
+                          '{}-{}.{}'.format(digest, size, fmt))
 
 
 @main_bp.route('/find_friends', methods=['GET', 'POST'])
@@ -141,12 +233,44 @@ def profile():
 def find_friends():
     """Render the find friends page and handle searches."""
     if request.method == 'POST':
-        search_username = request.form.get('username')
-        users = User.query.filter(
-            User.username.contains(search_username)
-        ).filter(User.id != current_user.id).all()
-        return render_template('find_friends.html', users=users)
-    return render_template('find_friends.html', users=None)
+        return redirect(url_for('main.find_friends',
+                                q=request.form.get('username', '')))
+    query = request.args.get('q', '')
+    try:
+        users, next_cursor = search_users(
+            query, after=request.args.get('after'),
+            exclude_id=current_user.id
+        )
+    except ValueError:
+        abort(400)
+    suggestions = [] if query else get_suggestions(current_user)
+    following = current_user.following_ids(user.id for user in users)
+    return render_template('find_friends.html', users=users if query
+                           else None, query=query, next_cursor=next_cursor,
+                           following=following, suggestions=suggestions)
+
+
+@main_bp.route('/api/users/search')
+@login_required
+def api_search_users():
+    """Return a page of users matching a query, for typeahead."""
+    try:
+        users, next_cursor = search_users(
+            request.args.get('q', ''),
+            limit=request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int),
+            after=request.args.get('after'),
+            exclude_id=current_user.id
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'users': [
+            {'id': user.id, 'username': user.username,
+             'url': url_for('main.user', username=user.username)}
+            for user in users
+        ],
+        'next': next_cursor,
+    })
 
 
 @main_bp.route('/change_password', methods=['GET', 'POST'])
@@ -169,15 +293,68 @@ def change_password():
 @login_required
 def save_user_details():
     """Save the user's troop and enforcer details."""
-    user_troops = request.form.get('user_troops')
-    user_enforcers = request.form.get('user_enforcers')
-    current_user.user_troops = user_troops
-    current_user.user_enforcers = user_enforcers
+    try:
+        troops, enforcers = validate_details(
+            parse_troop_text(request.form.get('user_troops')),
+            parse_enforcer_text(request.form.get('user_enforcers'))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    save_details(current_user, troops, enforcers)
     db.session.commit()
     flash('Your details have been saved.')
     return '', 204
 
 
+@main_bp.route('/api/battalion', methods=['GET', 'PUT'])
+@login_required
+def api_battalion():
+    """Return the user's saved troops and enforcers, or replace them."""
+    if request.method == 'PUT':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object.'}), 400
+        try:
+            troops, enforcers = validate_details(
+                data.get('troops', []), data.get('enforcers', [])
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        save_details(current_user, troops, enforcers)
+        db.session.commit()
+    return jsonify(current_user.battalion())
+
+
+@main_bp.route('/api/roster/<kind>', methods=['GET', 'POST'])
+@admin_required
+def api_roster(kind):
+    """
+    Export every member's troops or enforcers, or import them in bulk.
+
+    ?format= picks CSV (the default), the packed columnar format, or Arrow
+    where pyarrow is installed. Imports read the request body as it
+    arrives and replace the rows of every user in it, all or nothing.
+    """
+    if kind not in ROSTER_KINDS:
+        abort(404)
+    fmt = request.args.get('format', 'csv')
+    try:
+        if request.method == 'GET':
+            chunks = export_roster(kind, fmt)
+        else:
+            counts = import_roster(request.stream, kind, fmt)
+            db.session.commit()
+            return jsonify(counts)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    response = Response(stream_with_context(chunks),
+                        mimetype=ROSTER_TYPES[fmt])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename={}.{}'.format(kind, fmt)
+    return response
+
+
 @main_bp.route('/enforcer_calculator', methods=['GET', 'POST'])
 def enforcer_calculator():
     """Render the enforcer calculator page and handle calculations."""
@@ -220,24 +397,33 @@ def resource_calculator():
 @main_bp.route('/analyze_screenshot/<int:screenshot_id>')
 @login_required
 def analyze_screenshot_route(screenshot_id):
-    """Analyze a screenshot and display the extracted data."""
+    """Display the data extracted from a screenshot, or its progress."""
     screenshot = Screenshot.query.get_or_404(screenshot_id)
     if screenshot.user_id != current_user.id:
         flash('You do not have permission to analyze this screenshot.')
         return redirect(url_for('main.profile'))
 
-    filepath = os.path.join(
-        current_app.config['UPLOAD_FOLDER'], screenshot.filename
+    analysis = analysis_queue.ensure(
+        screenshot, retry=request.args.get('retry') == '1'
     )
-    extracted_data = analyze_screenshot(filepath)
-
     return render_template(
         'confirm_update.html',
         screenshot=screenshot,
-        extracted_data=extracted_data
+        analysis=analysis,
+        extracted_data=analysis.data
     )
 
 
+@main_bp.route('/api/screenshots/<int:screenshot_id>/analysis')
+@login_required
+def api_screenshot_analysis(screenshot_id):
+    """Return the status and result of a screenshot's analysis."""
+    screenshot = db.session.get(Screenshot, screenshot_id)
+    if screenshot is None or screenshot.user_id != current_user.id:
+        return jsonify({'error': 'Screenshot not found.'}), 404
+    return jsonify(analysis_queue.ensure(screenshot).to_dict())
+
+
 @main_bp.route('/confirm_update/<int:screenshot_id>', methods=['POST'])
 @login_required
 def confirm_update(screenshot_id):
@@ -247,10 +433,11 @@ def confirm_update(screenshot_id):
         flash('You do not have permission to update this profile.')
         return redirect(url_for('main.profile'))
 
-    filepath = os.path.join(
-        current_app.config['UPLOAD_FOLDER'], screenshot.filename
-    )
-    extracted_data = analyze_screenshot(filepath)
+    extracted_data = screenshot.analysis.data if screenshot.analysis else None
+    if extracted_data is None:
+        flash('The screenshot has not been analyzed yet.')
+        return redirect(url_for('main.analyze_screenshot_route',
+                                screenshot_id=screenshot_id))
 
     # Update user's profile with extracted data
     if 'training_center_level' in extracted_data:
@@ -267,3 +454,282 @@ def confirm_update(screenshot_id):
     db.session.commit()
     flash('Your profile has been updated.')
     return redirect(url_for('main.profile'))
+
+
+@main_bp.app_context_processor
+def inject_game_data_url():
+    """Give every page the versioned URL of the game data bundle."""
+    version, _ = game_data_bundle()
+    return {'game_data_url': url_for('main.api_game_data_version',
+                                     version=version)}
+
+
+@main_bp.route('/api/game_data')
+def api_game_data():
+    """Redirect to the current game data bundle."""
+    version, _ = game_data_bundle()
+    response = redirect(url_for('main.api_game_data_version',
+                                version=version))
+    response.cache_control.no_cache = True
+    return response
+
+
+@main_bp.route('/api/game_data/<version>.json')
+def api_game_data_version(version):
+    """
+    Serve all the game data in one document.
+
+    The URL carries the data's content hash, so the response is cached
+    forever; old versions redirect to the current one.
+    """
+    current, body = game_data_bundle()
+    if version != current:
+        return api_game_data()
+    return send_immutable(io.BytesIO(body), 'application/json', current)
+
+
+@main_bp.route('/api/buff_table')
+def api_buff_table():
+    """Return the compiled enforcer and signature weapon buff table."""
+    return jsonify(simulation_cache.get_or_compute(
+        cache_key('buff_table'),
+        lambda: buff_table_payload(get_buff_table())
+    ))
+
+
+@main_bp.route('/api/simulate', methods=['POST'])
+def api_simulate():
+    """Simulate a battle between two battalions posted as JSON."""
+    data = request.get_json(silent=True) or {}
+    try:
+        attacker = parse_battalion(data.get('attacker'))
+        defender = parse_battalion(data.get('defender'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def compute():
+        attacker_stats = calculate_battalion_stats(*attacker)
+        defender_stats = calculate_battalion_stats(*defender)
+        result = simulate_battle(attacker_stats, defender_stats)
+        result['attacker_stats'] = battalion_summary(attacker_stats)
+        result['defender_stats'] = battalion_summary(defender_stats)
+        return result
+
+    key = cache_key('simulate', battalion_fingerprint(*attacker),
+                    battalion_fingerprint(*defender))
+    return jsonify(simulation_cache.get_or_compute(key, compute))
+
+
+@main_bp.route('/api/simulate/batch', methods=['POST'])
+def api_simulate_batch():
+    """Simulate every posted attacker against every posted defender."""
+    data = request.get_json(silent=True) or {}
+    sides = {}
+    try:
+        for side in ('attackers', 'defenders'):
+            battalions = data.get(side)
+            if not isinstance(battalions, list) or not battalions:
+                raise ValueError(
+                    'Expected a list of {}.'.format(side)
+                )
+            if len(battalions) > MAX_BATCH_BATTALIONS:
+                raise ValueError('At most {} {} are allowed.'.format(
+                    MAX_BATCH_BATTALIONS, side
+                ))
+            sides[side] = [
+                parse_battalion(battalion) for battalion in battalions
+            ]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def compute():
+        results = simulate_batch(*[
+            [calculate_battalion_stats(*battalion) for battalion in battalions]
+            for battalions in (sides['attackers'], sides['defenders'])
+        ])
+        return {key: value.tolist() for key, value in results.items()}
+
+    key = cache_key('simulate_batch', *[
+        [battalion_fingerprint(*battalion) for battalion in battalions]
+        for battalions in (sides['attackers'], sides['defenders'])
+    ])
+    return jsonify(simulation_cache.get_or_compute(key, compute))
+
+
+def saved_battalion(battalion):
+    """
+    Resolves 'saved' in a posted body to the user's saved battalion.
+
+    Args:
+        battalion: A battalion from the body, or 'saved'.
+
+    Returns:
+        The battalion, with 'saved' replaced by the current user's troops
+        and enforcers.
+
+    Raises:
+        ValueError: If 'saved' is used without logging in.
+    """
+    if battalion != 'saved':
+        return battalion
+    if not current_user.is_authenticated:
+        raise ValueError('Log in to use your saved battalion.')
+    return current_user.battalion()
+
+
+def parse_enforcer_search(data):
+    """
+    Builds an enforcer team search from a posted JSON body.
+
+    Args:
+        data (dict): The body, with 'user' and 'opponent' battalions and an
+                     optional 'top_k'. The user's enforcers are the pool
+                     to choose from; all enforcers are used if none are
+                     given. 'user' may be 'saved' for the logged in
+                     user's saved battalion.
+
+    Returns:
+        tuple: (problem, top_k).
+
+    Raises:
+        ValueError: If the body is invalid.
+    """
+    troops, available, misc_buffs = parse_battalion(
+        saved_battalion(data.get('user'))
+    )
+    opponent = calculate_battalion_stats(
+        *parse_battalion(data.get('opponent'))
+    )
+    top_k = data.get('top_k', DEFAULT_TOP_K)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or \
+            not 1 <= top_k <= MAX_TOP_K:
+        raise ValueError(
+            'top_k must be between 1 and {}.'.format(MAX_TOP_K)
+        )
+    problem = prepare_enforcer_search(
+        troops, misc_buffs, opponent, available or None
+    )
+    return problem, top_k
+
+
+def parse_troop_mix_search(data):
+    """
+    Builds a troop mix search from a posted JSON body.
+
+    Args:
+        data (dict): The body, with the 'opponent' battalion, an optional
+                     'user' battalion whose troops cap what can be sent,
+                     'march_size' (defaulting to the user's troop count,
+                     or the opponent's if the user has none) and
+                     'objective' ('hp' or 'smallest'). 'user' may be
+                     'saved' for the logged in user's saved battalion.
+
+    Returns:
+        tuple: (problem, cache key).
+
+    Raises:
+        ValueError: If the body is invalid.
+    """
+    opponent_troops, opponent_enforcers, opponent_misc_buffs = \
+        parse_battalion(data.get('opponent'))
+    opponent = calculate_battalion_stats(
+        opponent_troops, opponent_enforcers, opponent_misc_buffs
+    )
+    inventory, enforcers, misc_buffs = parse_battalion(
+        saved_battalion(data.get('user')) or {}, require_troops=False
+    )
+    march_size = data.get('march_size') or sum(
+        troop['quantity'] for troop in inventory or opponent_troops
+    )
+    objective = data.get('objective', 'hp')
+    problem = prepare_troop_mix_search(
+        opponent, march_size, inventory, enforcers, misc_buffs, objective
+    )
+    key = cache_key(
+        'troop_mix',
+        battalion_fingerprint(
+            opponent_troops, opponent_enforcers, opponent_misc_buffs
+        ),
+        battalion_fingerprint(inventory, enforcers, misc_buffs),
+        march_size, objective
+    )
+    return problem, key
+
+
+@main_bp.route('/api/optimize/enforcers', methods=['POST'])
+def api_optimize_enforcers():
+    """Stream the best enforcer teams against an opponent as JSON lines."""
+    data = request.get_json(silent=True) or {}
+    try:
+        problem, top_k = parse_enforcer_search(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        for event in search_enforcer_teams(problem, top_k):
+            yield json.dumps(event) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@main_bp.route('/api/optimize/troops', methods=['POST'])
+def api_optimize_troops():
+    """Find the best troop mix against an opponent."""
+    data = request.get_json(silent=True) or {}
+    try:
+        problem, key = parse_troop_mix_search(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(simulation_cache.get_or_compute(
+        key, lambda: search_troop_mix(problem)
+    ))
+
+
+@main_bp.route('/api/cache/stats')
+def api_cache_stats():
+    """Return the simulation cache's hit/miss counters and size."""
+    return jsonify(simulation_cache.stats())
+
+
+@main_bp.route('/api/jobs', methods=['POST'])
+def api_submit_job():
+    """Start a search in the worker pool and return its id for polling."""
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    try:
+        if kind == 'enforcers':
+            problem, top_k = parse_enforcer_search(data.get('params') or {})
+            job_id = job_runner.submit(
+                kind, run_enforcer_shard,
+                enforcer_search_shards(problem, top_k), top_k
+            )
+        elif kind == 'troop_mix':
+            problem, _ = parse_troop_mix_search(data.get('params') or {})
+            shards = troop_mix_shards(problem, DEFAULT_MIX_SHARDS)
+            job_id = job_runner.submit(
+                kind, run_troop_mix_shard, shards, len(shards),
+                key=troop_mix_key
+            )
+        else:
+            raise ValueError('Unknown job kind: {}'.format(kind))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+
+    response = jsonify(job_runner.get(job_id))
+    response.status_code = 202
+    response.headers['Location'] = url_for('main.api_job', job_id=job_id)
+    return response
+
+
+@main_bp.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def api_job(job_id):
+    """Poll a job's progress and results, or cancel it with DELETE."""
+    if request.method == 'DELETE':
+        job = job_runner.cancel(job_id)
+    else:
+        job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job)
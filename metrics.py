@@ -0,0 +1,316 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, abort, current_app, g, has_request_context, \
+    request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Bucket upper bounds in seconds, from a quick query to a slow search.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Set by init_app; while False every hook returns straight away.
+enabled = False
+
+
+def _escape(value):
+    """Escape a label value for the text exposition format."""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    """Format label pairs as {a="1",b="2"}, or '' without labels."""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, _escape(value)) for name, value in pairs
+    ) + '}'
+
+
+def _format_value(value):
+    """Format a sample value as Prometheus expects it."""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """A monotonically increasing count, per combination of labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Add to the count for some label values."""
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) samples."""
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield '_total', key, (), value
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, per labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record one observation for some label values."""
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) samples."""
+        with self.lock:
+            values = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self.values.items()
+            )
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield '_bucket', key, (('le', _format_value(bound)),), \
+                    cumulative
+            yield '_bucket', key, (('le', '+Inf'),), count
+            yield '_sum', key, (), total
+            yield '_count', key, (), count
+
+
+class Registry:
+    """
+    Holds the metrics of this process and renders them for scraping.
+
+    Collectors are callables run at scrape time that return extra
+    (name, kind, help, value) samples, for figures other parts of the app
+    already keep, like the simulation cache's hit counters.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help_text, labels=()):
+        """Create and register a counter."""
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(),
+                  buckets=LATENCY_BUCKETS):
+        """Create and register a histogram."""
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a callable returning scrape-time samples."""
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def render(self):
+        """Return every metric in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for suffix, key, extra, value in metric.samples():
+                lines.append('{}{}{} {}'.format(
+                    metric.name, suffix,
+                    _format_labels(metric.labels, key, extra),
+                    _format_value(value)
+                ))
+        for collector in self.collectors:
+            for name, kind, help_text, value in collector():
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                lines.append('{} {}'.format(name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling requests.',
+    ('method', 'endpoint', 'status')
+)
+REQUEST_QUERIES = registry.histogram(
+    'http_request_db_queries', 'Database queries run per request.',
+    ('endpoint',), QUERY_COUNT_BUCKETS
+)
+QUERY_DURATION = registry.histogram(
+    'db_query_duration_seconds', 'Time spent running database queries.'
+)
+FUNCTION_DURATION = registry.histogram(
+    'function_duration_seconds', 'Time spent in instrumented code.',
+    ('function',)
+)
+POOL_WAIT = registry.histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent getting a connection from the database pool.'
+)
+POOL_TIMEOUTS = registry.counter(
+    'db_pool_timeouts', 'Pool checkouts that gave up waiting for a '
+    'connection.'
+)
+
+
+@contextmanager
+def track(name):
+    """Time a block of code as function_duration_seconds{function=name}."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        FUNCTION_DURATION.observe(time.perf_counter() - start, function=name)
+
+
+def timed(name):
+    """Decorate a function to time its calls, like track."""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with track(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context,
+                   executemany):
+    """Note when a query starts, and count it against the request."""
+    if not enabled:
+        return
+    conn.info.setdefault('metrics_query_start', []).append(
+        time.perf_counter()
+    )
+    if has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context,
+                    executemany):
+    """Record how long a query took."""
+    starts = conn.info.get('metrics_query_start')
+    if enabled and starts:
+        QUERY_DURATION.observe(time.perf_counter() - starts.pop())
+
+
+def _request_started():
+    """Start timing a request."""
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = 0
+
+
+def _request_finished(response):
+    """Record a request's latency and query count."""
+    if 'metrics_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else \
+            'unmatched'
+        REQUEST_DURATION.observe(
+            time.perf_counter() - g.metrics_start, method=request.method,
+            endpoint=endpoint, status=response.status_code
+        )
+        REQUEST_QUERIES.observe(g.metrics_queries, endpoint=endpoint)
+    return response
+
+
+def _cache_samples():
+    """Report the simulation cache's hit counters at scrape time."""
+    from cache import simulation_cache
+    stats = simulation_cache.stats()
+    return (
+        ('simulation_cache_hits_total', 'counter',
+         'Simulation cache lookups that found a result.', stats['hits']),
+        ('simulation_cache_misses_total', 'counter',
+         'Simulation cache lookups that missed.', stats['misses']),
+        ('simulation_cache_hit_ratio', 'gauge',
+         'Share of simulation cache lookups that hit.', stats['hit_rate']),
+    )
+
+
+def _pool_samples():
+    """Report the database pool's connections at scrape time."""
+    from app import db
+    from sqlalchemy.pool import QueuePool
+    pool = db.engine.pool
+    if not isinstance(pool, QueuePool):
+        return ()
+    return (
+        ('db_pool_size', 'gauge', 'Connections the pool keeps open.',
+         pool.size()),
+        ('db_pool_checked_out', 'gauge', 'Pool connections in use.',
+         pool.checkedout()),
+        ('db_pool_overflow', 'gauge',
+         'Connections open beyond the pool size.', max(pool.overflow(), 0)),
+    )
+
+
+def metrics_view():
+    """Serve the metrics in the Prometheus text format."""
+    if not current_app.config.get('METRICS_ENABLED'):
+        abort(404)
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app):
+    """
+    Instruments an app when METRICS_ENABLED is set.
+
+    Requests are timed and their queries counted, and /metrics serves
+    the results. Counts are per process, so with several workers each
+    one is scraped separately. Without the flag no hooks are installed,
+    and the query listeners and timers return straight away.
+    """
+    global enabled
+    enabled = bool(app.config.get('METRICS_ENABLED'))
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    if not enabled:
+        return
+    app.before_request(_request_started)
+    app.after_request(_request_finished)
+    registry.add_collector(_cache_samples)
+    registry.add_collector(_pool_samples)
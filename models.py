@@ -1,11 +1,21 @@
+import json
+from datetime import datetime
+
 from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 
+DEFAULT_PAGE_SIZE = 20
+
+# The primary key answers "whom does X follow" and the index answers "who
+# follows X", both in follower/followed id order for keyset pagination.
 followers = db.Table(
     'followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key=True),
+    db.Index('ix_followers_followed_follower', 'followed_id', 'follower_id')
 )
 
 
@@ -15,8 +25,20 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(150), unique=True, nullable=False)
     password_hash = db.Column(db.String(150), nullable=False)
     avatar = db.Column(db.String(150), nullable=True)
-    user_troops = db.Column(db.Text, nullable=True)
-    user_enforcers = db.Column(db.Text, nullable=True)
+    avatar_hash = db.Column(db.String(64), nullable=True)
+    # Admins manage every member's roster (see roster.py).
+    is_admin = db.Column(db.Boolean, nullable=False, default=False,
+                         server_default=db.false())
+    # Denormalized sizes of the follow lists, kept up to date by follow and
+    # unfollow so pages can show them without counting rows.
+    followers_count = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+    followed_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+    # Set when follows change the user's mutual connection counts, until
+    # the suggestion refresher re-ranks them (see suggestions.py).
+    suggestions_stale = db.Column(db.Boolean, nullable=False, default=False,
+                                  server_default=db.false(), index=True)
     followed = db.relationship(
         'User',
         secondary=followers,
@@ -26,6 +48,18 @@ class User(UserMixin, db.Model):
         lazy='dynamic'
     )
     screenshots = db.relationship('Screenshot', backref='user', lazy='dynamic')
+    troops = db.relationship(
+        'UserTroop', order_by='UserTroop.position',
+        cascade='all, delete-orphan'
+    )
+    enforcers = db.relationship(
+        'UserEnforcer', order_by='UserEnforcer.position',
+        cascade='all, delete-orphan'
+    )
+    # Case-insensitive prefix searches for short queries (see search.py).
+    __table_args__ = (
+        db.Index('ix_user_username_lower', db.func.lower(username)),
+    )
 
     def set_password(self, password):
         """Set the user's password."""
@@ -38,21 +72,283 @@ class User(UserMixin, db.Model):
     def follow(self, user):
         """Follow a user."""
         if not self.is_following(user):
-            self.followed.append(user)
+            db.session.execute(followers.insert().values(
+                follower_id=self.id, followed_id=user.id
+            ))
+            self.followed_count = User.followed_count + 1
+            user.followers_count = User.followers_count + 1
+            update_mutual_connections(self.id, user.id, 1)
 
     def unfollow(self, user):
         """Unfollow a user."""
-        if self.is_following(user):
-            self.followed.remove(user)
+        deleted = db.session.execute(followers.delete().where(
+            followers.c.follower_id == self.id,
+            followers.c.followed_id == user.id
+        )).rowcount
+        if deleted:
+            self.followed_count = User.followed_count - 1
+            user.followers_count = User.followers_count - 1
+            update_mutual_connections(self.id, user.id, -1)
 
     def is_following(self, user):
         """Check if the user is following another user."""
-        return self.followed.filter(
-            followers.c.followed_id == user.id).count() > 0
+        return user.id in self.following_ids([user.id])
+
+    def following_ids(self, user_ids):
+        """
+        Looks up which of a list of users this user follows.
+
+        Args:
+            user_ids (list): User ids, e.g. of the users shown on a page.
+
+        Returns:
+            set: The ids among them that this user follows, found with one
+                 primary key lookup.
+        """
+        user_ids = list(user_ids)
+        if not user_ids or self.id is None:
+            return set()
+        return set(db.session.execute(
+            db.select(followers.c.followed_id).where(
+                followers.c.follower_id == self.id,
+                followers.c.followed_id.in_(user_ids)
+            )
+        ).scalars())
+
+    def _follow_page(self, own_column, other_column, after, limit):
+        """Return a keyset page of users linked to this one."""
+        query = User.query.join(
+            followers, other_column == User.id
+        ).filter(own_column == self.id)
+        if after is not None:
+            query = query.filter(other_column > after)
+        return query.order_by(other_column).limit(limit).all()
+
+    def list_followers(self, after=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Returns a page of the users following this user.
+
+        Args:
+            after (int): The id of the last user on the previous page.
+            limit (int): The page size.
+
+        Returns:
+            list: Users in id order.
+        """
+        return self._follow_page(followers.c.followed_id,
+                                 followers.c.follower_id, after, limit)
+
+    def list_followed(self, after=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Returns a page of the users this user follows.
+
+        Args:
+            after (int): The id of the last user on the previous page.
+            limit (int): The page size.
+
+        Returns:
+            list: Users in id order.
+        """
+        return self._follow_page(followers.c.follower_id,
+                                 followers.c.followed_id, after, limit)
+
+    def battalion(self):
+        """
+        Returns the user's saved troops and enforcers.
+
+        Returns:
+            dict: {'troops': [...], 'enforcers': [...]} in the form
+                  parse_battalion accepts.
+        """
+        return {
+            'troops': [troop.to_dict() for troop in self.troops],
+            'enforcers': [enforcer.to_dict() for enforcer in self.enforcers],
+        }
+
+    @staticmethod
+    def recount_follows():
+        """Recompute every user's follow counters from the follow table."""
+        for column, counter in ((followers.c.followed_id,
+                                 User.followers_count),
+                                (followers.c.follower_id,
+                                 User.followed_count)):
+            db.session.execute(db.update(User).values({
+                counter: db.select(db.func.count()).where(
+                    column == User.id
+                ).scalar_subquery()
+            }))
+
+
+class UserTroop(db.Model):
+    """A quantity of one troop type and tier that a user has."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        primary_key=True)
+    troop_type = db.Column(db.String(50), primary_key=True)
+    tier = db.Column(db.String(10), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    # The order the user listed their troops in.
+    position = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        """Return the troop as the simulation expects it."""
+        return {'type': self.troop_type, 'tier': self.tier,
+                'quantity': self.quantity}
+
+
+class UserEnforcer(db.Model):
+    """An enforcer a user has, at its tier."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        primary_key=True)
+    name = db.Column(db.String(50), primary_key=True)
+    tier = db.Column(db.String(10), nullable=False)
+    has_signature_weapon = db.Column(db.Boolean, nullable=False,
+                                     default=False)
+    # The order the user listed their enforcers in.
+    position = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        """Return the enforcer as the simulation expects it."""
+        return {'name': self.name, 'tier': self.tier,
+                'has_signature_weapon': self.has_signature_weapon}
+
+
+class MutualConnection(db.Model):
+    """
+    The number of users through whom one user reaches another.
+
+    mutual_count is how many users user_id follows that follow
+    candidate_id. Rows are kept up to date incrementally by follow and
+    unfollow, and dropped when the count reaches zero.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        primary_key=True)
+    candidate_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                             primary_key=True)
+    mutual_count = db.Column(db.Integer, nullable=False)
+
+
+class FollowSuggestion(db.Model):
+    """A user's ranked suggestions, stored by the suggestion refresher."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    suggested_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                             nullable=False)
+    mutual_count = db.Column(db.Integer, nullable=False)
+    suggested = db.relationship('User', foreign_keys=[suggested_id])
+
+
+def update_mutual_connections(follower_id, followed_id, delta):
+    """
+    Applies a follow or unfollow to the mutual connection counts.
+
+    The follow follower -> followed adds or removes exactly the two-step
+    paths follower -> followed -> X and U -> follower -> followed, so only
+    the pairs (follower, X) and (U, followed) change, each by delta. Their
+    users are marked for the suggestion refresher.
+
+    Args:
+        follower_id (int): The following user.
+        followed_id (int): The followed user.
+        delta (int): 1 for a follow, -1 for an unfollow.
+    """
+    table = MutualConnection.__table__
+    followed_by_followed = db.select(followers.c.followed_id).where(
+        followers.c.follower_id == followed_id
+    )
+    followers_of_follower = db.select(followers.c.follower_id).where(
+        followers.c.followed_id == follower_id
+    )
+    # (fixed column, fixed id, varying column, varying ids)
+    paths = ((table.c.user_id, follower_id, table.c.candidate_id,
+              followed_by_followed),
+             (table.c.candidate_id, followed_id, table.c.user_id,
+              followers_of_follower))
+    for fixed, fixed_id, varying, ids in paths:
+        db.session.execute(table.update().where(
+            fixed == fixed_id, varying.in_(ids)
+        ).values(mutual_count=table.c.mutual_count + delta))
+        if delta > 0:
+            other = ids.selected_columns[0]
+            existing = db.select(table).where(
+                fixed == fixed_id, varying == other
+            ).exists()
+            columns = {fixed.name: db.literal(fixed_id),
+                       varying.name: other,
+                       'mutual_count': db.literal(delta)}
+            names = ['user_id', 'candidate_id', 'mutual_count']
+            db.session.execute(table.insert().from_select(
+                names,
+                ids.with_only_columns(*(columns[name] for name in names))
+                .where(~existing)
+            ))
+        else:
+            db.session.execute(table.delete().where(
+                fixed == fixed_id, table.c.mutual_count <= 0
+            ))
+    db.session.execute(
+        db.update(User).where(db.or_(
+            User.id == follower_id, User.id.in_(followers_of_follower)
+        )).values(suggestions_stale=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+class StoredFile(db.Model):
+    """A file in the content-addressed upload storage."""
+    digest = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)
+    # Screenshots and avatars referring to the file; it is deleted from the
+    # storage when this drops to zero.
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
 
 
 class Screenshot(db.Model):
     """Screenshot model for the application."""
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(150), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # The image's perceptual hash in hex, and its chunks in indexed columns
+    # for near-duplicate lookups (see image_hash.HASH_CHUNKS).
+    phash = db.Column(db.String(16), nullable=True)
+    phash_0 = db.Column(db.Integer, nullable=True, index=True)
+    phash_1 = db.Column(db.Integer, nullable=True, index=True)
+    phash_2 = db.Column(db.Integer, nullable=True, index=True)
+    phash_3 = db.Column(db.Integer, nullable=True, index=True)
+
+
+class ScreenshotAnalysis(db.Model):
+    """The OCR result for a screenshot, filled in by the analysis queue."""
+    screenshot_id = db.Column(
+        db.Integer, db.ForeignKey('screenshot.id'), primary_key=True
+    )
+    status = db.Column(db.String(16), nullable=False)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    # The near-duplicate screenshot whose result was reused, if any.
+    reused_from = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now,
+                           onupdate=datetime.now)
+    screenshot = db.relationship(
+        'Screenshot', backref=db.backref('analysis', uselist=False)
+    )
+
+    @property
+    def data(self):
+        """The extracted data, or None until the analysis is done."""
+        return json.loads(self.result) if self.result else None
+
+    def to_dict(self):
+        """Return the JSON-serialisable state of the analysis."""
+        data = {
+            'screenshot_id': self.screenshot_id,
+            'status': self.status,
+            'result': self.data,
+        }
+        if self.error:
+            data['error'] = self.error
+        if self.reused_from:
+            data['reused_from'] = self.reused_from
+        return data
@@ -0,0 +1,731 @@
+import heapq
+import itertools
+import math
+
+import numpy as np
+
+from buff_table import STATS, get_buff_table, normalize_troop_type, \
+    team_coefficients
+from game_data import get_game_data
+from simulation import MAX_BATTLE_ROUNDS, battalion_base, build_battalion, \
+    calculate_battalion_stats, counter_matrix, simulate_batch, \
+    battalion_summary
+
+TEAM_SIZE = 5
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 50
+# Complete teams are simulated together in batches of this size.
+LEAF_BATCH_SIZE = 256
+# Slack on the analytic bounds so float rounding in the stepped simulation
+# can never prune a team that would have made the top K.
+BOUND_TOLERANCE = 1e-9
+
+TROOP_MIX_OBJECTIVES = ('hp', 'smallest')
+MAX_MARCH_SIZE = 10000000
+# The coarse seeds split the march between types in steps of 1/COARSE_STEPS.
+COARSE_STEPS = 4
+# The troop mix search stops refining below march_size / FINE_STEP_DIVISOR.
+FINE_STEP_DIVISOR = 4096
+DEFAULT_MIX_SHARDS = 4
+
+ATK = STATS.index('atk')
+HP = STATS.index('hp')
+
+
+def default_available_enforcers(game_data=None):
+    """
+    Lists every enforcer at Grand tier, with its signature weapon if known.
+
+    Args:
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        list: Enforcer dicts with 'name', 'tier' and 'has_signature_weapon'.
+    """
+    game_data = game_data or get_game_data()
+    weapons = game_data['signature_weapon_buffs']
+    return [
+        {'name': name, 'tier': 'Grand',
+         'has_signature_weapon': name in weapons}
+        for name in sorted(game_data['enforcer_buffs'])
+    ]
+
+
+def prepare_enforcer_search(troops, misc_buffs, opponent, available=None,
+                            team_size=TEAM_SIZE, max_rounds=MAX_BATTLE_ROUNDS,
+                            game_data=None):
+    """
+    Precomputes everything the enforcer team search needs.
+
+    Enforcers whose buffs change the user's groups in exactly the same way
+    are merged into one class, so the search enumerates multisets of
+    classes rather than every combination of names.
+
+    Args:
+        troops (list): The user's troop dicts.
+        misc_buffs (dict): The user's misc buffs.
+        opponent (dict): The opponent, from calculate_battalion_stats.
+        available (list): The user's enforcer dicts. Defaults to
+                          default_available_enforcers().
+        team_size (int): The number of enforcers in a team.
+        max_rounds (int): The battle round limit.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        dict: The search problem, picklable so it can be sent to workers.
+
+    Raises:
+        ValueError: If either side has no HP or there are too few
+                    enforcers to form a team.
+    """
+    game_data = game_data or get_game_data()
+    table = get_buff_table(game_data)
+    types, base, bonus = battalion_base(troops, misc_buffs, game_data)
+    if base[:, HP].sum() <= 0:
+        raise ValueError('Your troops have no HP.')
+    if opponent['total_hp'] <= 0:
+        raise ValueError('The opponent has no HP.')
+
+    candidates = []
+    seen = set()
+    for enforcer in available or default_available_enforcers(game_data):
+        if enforcer['name'] in table['enforcer_index'] and \
+                enforcer['name'] not in seen:
+            seen.add(enforcer['name'])
+            candidates.append({
+                'name': enforcer['name'],
+                'tier': enforcer['tier'],
+                'has_signature_weapon':
+                    bool(enforcer.get('has_signature_weapon')),
+            })
+    if len(candidates) < team_size:
+        raise ValueError(
+            'Need at least {} known enforcers, found {}.'.format(
+                team_size, len(candidates)
+            )
+        )
+
+    classes = {}
+    for i, enforcer in enumerate(candidates):
+        contribution = base * team_coefficients([enforcer], table)[types]
+        key = np.round(contribution, 9).tobytes()
+        classes.setdefault(key, (contribution, []))[1].append(i)
+    # Strongest classes first so good teams are found, and the pruning
+    # threshold rises, early.
+    totals = np.maximum(base[:, [ATK, HP]].sum(axis=0), 1)
+    classes = sorted(
+        classes.values(),
+        key=lambda c: -(c[0][:, [ATK, HP]].sum(axis=0) / totals).sum()
+    )
+
+    damage_per_atk, incoming_weights = _exchange_rates(
+        types, opponent, game_data
+    )
+    return {
+        'candidates': candidates,
+        'members': [members for _, members in classes],
+        'contributions': np.array([c for c, _ in classes]),
+        'types': types,
+        'stats': base * (1 + bonus),
+        'team_size': team_size,
+        'max_rounds': max_rounds,
+        'opponent': opponent,
+        'opponent_hp': opponent['hp'].sum(),
+        'damage_per_atk': damage_per_atk,
+        'incoming_weights': incoming_weights,
+        'game_data': game_data,
+    }
+
+
+def _exchange_rates(types, opponent, game_data):
+    """
+    Calculates how a battalion's groups trade damage with the opponent.
+
+    Returns:
+        tuple: (damage_per_atk, incoming_weights) where damage_per_atk is
+               the damage dealt to the opponent per point of each group's
+               ATK, and the damage taken per round is incoming_weights . hp
+               divided by the total HP.
+    """
+    matrix = 1 + counter_matrix(game_data)
+    damage_per_atk = matrix[np.ix_(types, opponent['types'])] @ \
+        (opponent['hp'] / opponent['hp'].sum())
+    incoming_weights = np.where(opponent['hp'] > 0, opponent['atk'], 0) @ \
+        matrix[np.ix_(opponent['types'], types)]
+    return damage_per_atk, incoming_weights
+
+
+def _suffix_sums(problem):
+    """
+    Precomputes the largest and smallest contributions still available.
+
+    Returns:
+        tuple: (top, bottom, capacity) where top[i][r] and bottom[i][r]
+               are the per-group sums of the r largest and smallest
+               contributions among classes i onwards, and capacity[i] is
+               the number of enforcers in those classes.
+    """
+    team_size = problem['team_size']
+    contributions = problem['contributions']
+    top, bottom, capacity = [], [], []
+    for i in range(len(contributions) + 1):
+        values = [
+            np.repeat(contribution[None], min(len(members), team_size), 0)
+            for contribution, members in zip(
+                contributions[i:], problem['members'][i:]
+            )
+        ]
+        values = np.sort(
+            np.concatenate(values) if values
+            else np.zeros((0,) + problem['stats'].shape), axis=0
+        )
+        top.append([values[len(values) - r:].sum(axis=0)
+                    for r in range(team_size + 1)])
+        bottom.append([values[:r].sum(axis=0)
+                       for r in range(team_size + 1)])
+        capacity.append(len(values))
+    return top, bottom, capacity
+
+
+def score_bound(problem, atk, hp_low, hp_high):
+    """
+    Bounds the score of any team whose stats lie within the given ranges.
+
+    With HP-proportional damage sharing every group of a side loses the
+    same fraction of its HP each round, so each side loses a constant
+    fraction of its starting HP per round. That gives closed forms for the
+    rounds each side survives and the HP left when the battle ends.
+
+    Args:
+        problem (dict): The output of prepare_enforcer_search.
+        atk (numpy.ndarray): Upper bound on each group's ATK.
+        hp_low (numpy.ndarray): Lower bound on each group's HP.
+        hp_high (numpy.ndarray): Upper bound on each group's HP.
+
+    Returns:
+        tuple: An upper bound on score_result for those teams.
+    """
+    max_rounds = problem['max_rounds']
+    opponent_loss = atk @ problem['damage_per_atk'] / \
+        problem['opponent_hp'] * (1 + BOUND_TOLERANCE)
+    own_loss = problem['incoming_weights'] @ hp_low / \
+        hp_high.sum() ** 2 * (1 - BOUND_TOLERANCE)
+    opponent_rounds = math.ceil(1 / opponent_loss) if opponent_loss > 0 \
+        else max_rounds
+    own_rounds = math.ceil(1 / own_loss) if own_loss > 0 else max_rounds
+    own_left = max(0, 1 - min(opponent_rounds, max_rounds) * own_loss)
+    opponent_left = max(0, 1 - min(own_rounds, max_rounds) * opponent_loss)
+    return own_left > opponent_left, own_left * 100, -opponent_left * 100
+
+
+def score_result(result):
+    """
+    Ranks a simulation result: wins first, then HP kept, then damage done.
+
+    Args:
+        result (dict): A battle result.
+
+    Returns:
+        tuple: The sort key, larger is better.
+    """
+    return (
+        result['winner'] == 'attacker',
+        result['attacker_hp_remaining_percentage'],
+        -result['defender_hp_remaining_percentage'],
+    )
+
+
+def _evaluate(problem, leaves):
+    """Simulate complete teams, given as class counts, in one batch."""
+    stats = problem['stats']
+    battalions = []
+    for counts in leaves:
+        added = np.tensordot(counts, problem['contributions'], axes=1)
+        battalions.append(build_battalion(problem['types'], stats + added))
+    results = simulate_batch(
+        battalions, [problem['opponent']], problem['max_rounds'],
+        problem['game_data']
+    )
+    for i, battalion in enumerate(battalions):
+        result = {
+            'winner': str(results['winner'][i, 0]),
+            'rounds_fought': int(results['rounds_fought'][i, 0]),
+            'attacker_hp_remaining_percentage':
+                float(results['attacker_hp_remaining_percentage'][i, 0]),
+            'defender_hp_remaining_percentage':
+                float(results['defender_hp_remaining_percentage'][i, 0]),
+        }
+        yield result, battalion_summary(battalion)
+
+
+def _teams(problem, counts, limit):
+    """Yield up to limit concrete teams for a multiset of classes."""
+    choices = [
+        itertools.combinations(members, count)
+        for members, count in zip(problem['members'], counts) if count
+    ]
+    for combination in itertools.islice(itertools.product(*choices), limit):
+        yield tuple(i for group in combination for i in group)
+
+
+def format_team(problem, entry):
+    """Return the JSON-serialisable form of a top-K heap entry."""
+    _, _, team, result, summary = entry
+    return {
+        'enforcer_team': [problem['candidates'][i] for i in team],
+        'user_stats_summary': summary,
+        'simulation': result,
+    }
+
+
+def top_teams(problem, heap):
+    """Return the teams in a top-K heap, best first."""
+    return [format_team(problem, entry) for entry in sorted(heap,
+                                                            reverse=True)]
+
+
+def search_enforcer_teams(problem, top_k=DEFAULT_TOP_K, first_class=None):
+    """
+    Searches every team for the top K against the opponent.
+
+    Walks multisets of enforcer classes depth first and prunes any partial
+    team whose score_bound, taken over all ways to fill its remaining
+    slots, cannot beat the current K-th best team.
+
+    Args:
+        problem (dict): The output of prepare_enforcer_search.
+        top_k (int): The number of teams to keep.
+        first_class (int): If given, only search teams whose first class
+                           (in search order) is this one, so the search
+                           can be split into independent shards.
+
+    Yields:
+        dict: A 'progress' event whenever the top K changes after a batch
+              of simulations, then a final 'done' event. Both carry the
+              'teams' found so far and 'evaluated'/'pruned' counters.
+    """
+    top, bottom, capacity = _suffix_sums(problem)
+    stats = problem['stats']
+    heap = []
+    sequence = itertools.count()
+    counters = {'evaluated': 0, 'pruned': 0}
+    pending = []
+
+    def threshold():
+        return heap[0][0] if len(heap) >= top_k else None
+
+    def flush():
+        changed = False
+        for counts, (result, summary) in zip(
+                pending, _evaluate(problem, pending)):
+            counters['evaluated'] += 1
+            score = score_result(result)
+            for team in _teams(problem, counts, top_k):
+                if len(heap) < top_k:
+                    heapq.heappush(
+                        heap, (score, -next(sequence), team, result, summary)
+                    )
+                elif score > heap[0][0]:
+                    heapq.heapreplace(
+                        heap, (score, -next(sequence), team, result, summary)
+                    )
+                else:
+                    break
+                changed = True
+        del pending[:]
+        return changed
+
+    def visit(i, remaining, counts, added, minimum=0):
+        if remaining == 0:
+            pending.append(list(counts))
+            return
+        if i >= len(counts) or capacity[i] < remaining:
+            return
+        bound = score_bound(
+            problem,
+            stats[:, ATK] + added[:, ATK] + top[i][remaining][:, ATK],
+            stats[:, HP] + added[:, HP] + bottom[i][remaining][:, HP],
+            stats[:, HP] + added[:, HP] + top[i][remaining][:, HP],
+        )
+        if threshold() is not None and bound <= threshold():
+            counters['pruned'] += 1
+            return
+        most = min(len(problem['members'][i]), remaining)
+        for count in range(most, minimum - 1, -1):
+            counts[i] = count
+            yield from visit(
+                i + 1, remaining - count, counts,
+                added + count * problem['contributions'][i]
+            )
+            counts[i] = 0
+            if len(pending) >= LEAF_BATCH_SIZE and flush():
+                yield {'event': 'progress',
+                       'teams': top_teams(problem, heap), **counters}
+
+    counts = [0] * len(problem['members'])
+    added = np.zeros_like(stats)
+    if first_class is None:
+        yield from visit(0, problem['team_size'], counts, added)
+    else:
+        yield from visit(first_class, problem['team_size'], counts, added,
+                         minimum=1)
+    if pending:
+        flush()
+    yield {'event': 'done', 'teams': top_teams(problem, heap), **counters}
+
+
+def enforcer_search_shards(problem, top_k=DEFAULT_TOP_K):
+    """
+    Splits an enforcer team search into independent shards.
+
+    Args:
+        problem (dict): The output of prepare_enforcer_search.
+        top_k (int): The number of teams each shard keeps.
+
+    Returns:
+        list: Argument tuples for run_enforcer_shard, one per class that
+              can start a team.
+    """
+    return [
+        (problem, top_k, first_class)
+        for first_class in range(len(problem['members']))
+    ]
+
+
+def run_enforcer_shard(problem, top_k, first_class):
+    """
+    Runs one shard of an enforcer team search to completion.
+
+    Args:
+        problem (dict): The output of prepare_enforcer_search.
+        top_k (int): The number of teams to keep.
+        first_class (int): The class every team in the shard starts with.
+
+    Returns:
+        list: The shard's best teams, best first.
+    """
+    for event in search_enforcer_teams(problem, top_k, first_class):
+        pass
+    return event['teams']
+
+
+def optimize_enforcer_team(troops, misc_buffs, opponent, available=None,
+                           top_k=DEFAULT_TOP_K, game_data=None):
+    """
+    Finds the best enforcer teams for a battalion against an opponent.
+
+    Args:
+        troops (list): The user's troop dicts.
+        misc_buffs (dict): The user's misc buffs.
+        opponent (dict): The opponent, from calculate_battalion_stats.
+        available (list): The user's enforcer dicts. Defaults to
+                          default_available_enforcers().
+        top_k (int): The number of teams to return.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Yields:
+        dict: The events of search_enforcer_teams.
+    """
+    problem = prepare_enforcer_search(
+        troops, misc_buffs, opponent, available, game_data=game_data
+    )
+    yield from search_enforcer_teams(problem, top_k)
+
+
+def prepare_troop_mix_search(opponent, march_size, inventory=None,
+                             enforcers=(), misc_buffs=None, objective='hp',
+                             max_rounds=MAX_BATTLE_ROUNDS, game_data=None):
+    """
+    Precomputes everything the troop mix search needs.
+
+    Args:
+        opponent (dict): The opponent, from calculate_battalion_stats.
+        march_size (int): The most troops the march may hold.
+        inventory (list): The user's troop dicts, capping how many of each
+                          type and tier can be sent. Every type and tier is
+                          available without a cap if not given.
+        enforcers (list): The user's enforcer team.
+        misc_buffs (dict): The user's misc buffs.
+        objective (str): 'hp' to keep the most HP, or 'smallest' for the
+                         smallest winning mix.
+        max_rounds (int): The battle round limit.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        dict: The search problem, picklable so it can be sent to workers.
+
+    Raises:
+        ValueError: If the opponent has no HP, the march size or objective
+                    is invalid, or no known troops are available.
+    """
+    game_data = game_data or get_game_data()
+    troop_stats = game_data['troop_stats']
+    troop_types = list(troop_stats)
+    if opponent['total_hp'] <= 0:
+        raise ValueError('The opponent has no HP.')
+    if isinstance(march_size, bool) or not isinstance(march_size, int) or \
+            not 1 <= march_size <= MAX_MARCH_SIZE:
+        raise ValueError(
+            'march_size must be between 1 and {}.'.format(MAX_MARCH_SIZE)
+        )
+    if objective not in TROOP_MIX_OBJECTIVES:
+        raise ValueError('objective must be one of {}.'.format(
+            ', '.join(TROOP_MIX_OBJECTIVES)
+        ))
+
+    caps = {}
+    if inventory:
+        for troop in inventory:
+            troop_type = normalize_troop_type(troop['type'], troop_types)
+            if troop_type is not None and \
+                    troop['tier'] in troop_stats[troop_type]:
+                cell = (troop_type, troop['tier'])
+                caps[cell] = caps.get(cell, 0) + troop['quantity']
+    else:
+        for troop_type, tiers in troop_stats.items():
+            for tier in tiers:
+                caps[(troop_type, tier)] = march_size
+    cells = [cell for cell, cap in caps.items() if cap > 0]
+    if not cells:
+        raise ValueError('No known troops are available.')
+
+    unit = calculate_battalion_stats(
+        [{'type': troop_type, 'tier': tier, 'quantity': 1}
+         for troop_type, tier in cells],
+        enforcers, misc_buffs, game_data
+    )
+    damage_per_atk, incoming_weights = _exchange_rates(
+        unit['types'], opponent, game_data
+    )
+    return {
+        'cells': cells,
+        'caps': np.array([min(caps[cell], march_size) for cell in cells]),
+        # Higher tiers of a type are filled first when seeding.
+        'tier_rank': np.array([
+            list(troop_stats[troop_type]).index(tier)
+            for troop_type, tier in cells
+        ]),
+        'types': unit['types'],
+        'unit_stats': np.stack(
+            [unit['atk'], unit['def'], unit['hp']], axis=1
+        ),
+        # Per troop: damage dealt per round as a fraction of the
+        # opponent's HP, and weighted HP for the damage taken.
+        'unit_damage': unit['atk'] * damage_per_atk / opponent['total_hp'],
+        'unit_exposure': unit['hp'] * incoming_weights,
+        'march_size': march_size,
+        'objective': objective,
+        'opponent': opponent,
+        'max_rounds': max_rounds,
+        'game_data': game_data,
+    }
+
+
+def _mix_scores(problem, mixes):
+    """Simulate troop mixes, given as cell counts, in one batch."""
+    battalions = [
+        build_battalion(problem['types'], problem['unit_stats'] * mix[:, None])
+        for mix in mixes
+    ]
+    results = simulate_batch(
+        battalions, [problem['opponent']], problem['max_rounds'],
+        problem['game_data']
+    )
+    won = results['winner'][:, 0] == 'attacker'
+    own = results['attacker_hp_remaining_percentage'][:, 0]
+    enemy = results['defender_hp_remaining_percentage'][:, 0]
+    totals = mixes.sum(axis=1)
+    # Mixes that do not win (often both sides wiped out in the same round)
+    # are told apart by how fast they wear the opponent down relative to
+    # their own losses, so the search can climb towards a win.
+    hp = mixes @ problem['unit_stats'][:, HP]
+    own_loss = mixes @ problem['unit_exposure'] / np.maximum(hp, 1) ** 2
+    advantage = mixes @ problem['unit_damage'] / np.maximum(own_loss, 1e-12)
+    if problem['objective'] == 'smallest':
+        return [
+            (bool(w), -int(t) if w else 0, float(o - e),
+             0 if w else float(a))
+            for w, t, o, e, a in zip(won, totals, own, enemy, advantage)
+        ]
+    return [
+        (bool(w), float(o), -float(e), -int(t) if w else float(a))
+        for w, t, o, e, a in zip(won, totals, own, enemy, advantage)
+    ]
+
+
+def _fill(problem, budgets):
+    """Spread a troop budget per type over its cells, highest tier first."""
+    mix = np.zeros(len(problem['cells']), dtype=int)
+    order = np.lexsort((-problem['tier_rank'], problem['types']))
+    left = dict(budgets)
+    for cell in order:
+        troop_type = problem['types'][cell]
+        take = min(left.get(troop_type, 0), problem['caps'][cell])
+        mix[cell] = take
+        left[troop_type] = left.get(troop_type, 0) - take
+    return mix
+
+
+def troop_mix_seeds(problem):
+    """
+    Builds the coarse starting mixes for the troop mix search.
+
+    Every split of the march between troop types in steps of
+    1/COARSE_STEPS is tried, each type's share going to its highest
+    tiers first.
+
+    Args:
+        problem (dict): The output of prepare_troop_mix_search.
+
+    Returns:
+        numpy.ndarray: The distinct seed mixes indexed [mix, cell].
+    """
+    types = sorted(set(problem['types'].tolist()))
+    march_size = problem['march_size']
+    seeds = set()
+    for split in itertools.product(range(COARSE_STEPS + 1),
+                                   repeat=len(types)):
+        if sum(split) != COARSE_STEPS:
+            continue
+        mix = _fill(problem, {
+            troop_type: march_size * share // COARSE_STEPS
+            for troop_type, share in zip(types, split)
+        })
+        if mix.sum() > 0:
+            seeds.add(tuple(mix.tolist()))
+    return np.array(sorted(seeds), dtype=int)
+
+
+def _neighbours(problem, mix, step):
+    """Mixes one step away: moving, adding or removing step troops."""
+    caps = problem['caps']
+    room = caps - mix
+    moves = []
+
+    amount = np.minimum(np.minimum(step, mix)[:, None], room[None, :])
+    np.fill_diagonal(amount, 0)
+    source, target = np.nonzero(amount > 0)
+    moved = np.repeat(mix[None], len(source), axis=0)
+    rows = np.arange(len(source))
+    moved[rows, source] -= amount[source, target]
+    moved[rows, target] += amount[source, target]
+    moves.append(moved)
+
+    space = problem['march_size'] - mix.sum()
+    added = np.minimum(np.minimum(step, room), space)
+    for cell in np.nonzero(added > 0)[0]:
+        grown = mix.copy()
+        grown[cell] += added[cell]
+        moves.append(grown[None])
+
+    removed = np.minimum(step, mix)
+    for cell in np.nonzero(removed > 0)[0]:
+        if mix.sum() - removed[cell] > 0:
+            shrunk = mix.copy()
+            shrunk[cell] -= removed[cell]
+            moves.append(shrunk[None])
+    return np.concatenate(moves)
+
+
+def search_troop_mix(problem, seed=None):
+    """
+    Searches troop mixes for the best one against the opponent.
+
+    Starts from the best coarse seed (or the given one) and runs a pattern
+    search: every mix that moves, adds or removes one step of troops is
+    simulated in a batch, the best improvement is taken, and the step is
+    halved whenever nothing improves, down to 1/4096 of the march.
+
+    Args:
+        problem (dict): The output of prepare_troop_mix_search.
+        seed (numpy.ndarray): The mix to start from, indexed by cell.
+
+    Returns:
+        dict: 'recommended_mix' as troop dicts, 'total_troops', the
+              'simulation' result, 'user_stats_summary', the 'score' it
+              was ranked by and the number of mixes 'evaluated'.
+    """
+    if seed is None:
+        seeds = troop_mix_seeds(problem)
+        scores = _mix_scores(problem, seeds)
+        best = max(range(len(seeds)), key=scores.__getitem__)
+        mix, score = seeds[best], scores[best]
+        evaluated = len(seeds)
+    else:
+        mix = np.asarray(seed, dtype=int)
+        score = _mix_scores(problem, mix[None])[0]
+        evaluated = 1
+
+    march_size = problem['march_size']
+    step = max(1, march_size // (2 * COARSE_STEPS))
+    min_step = max(1, march_size // FINE_STEP_DIVISOR)
+    while step >= min_step:
+        candidates = _neighbours(problem, mix, step)
+        scores = _mix_scores(problem, candidates)
+        evaluated += len(candidates)
+        best = max(range(len(candidates)), key=scores.__getitem__)
+        if scores[best] > score:
+            mix, score = candidates[best], scores[best]
+        else:
+            step //= 2
+
+    return format_troop_mix(problem, mix, score, evaluated)
+
+
+def format_troop_mix(problem, mix, score, evaluated):
+    """Return the JSON-serialisable form of a troop mix search result."""
+    battalion = build_battalion(
+        problem['types'], problem['unit_stats'] * mix[:, None]
+    )
+    results = simulate_batch(
+        [battalion], [problem['opponent']], problem['max_rounds'],
+        problem['game_data']
+    )
+    return {
+        'recommended_mix': [
+            {'type': troop_type, 'tier': tier, 'quantity': int(quantity)}
+            for (troop_type, tier), quantity in zip(problem['cells'], mix)
+            if quantity > 0
+        ],
+        'total_troops': int(mix.sum()),
+        'objective': problem['objective'],
+        'simulation': {
+            'winner': str(results['winner'][0, 0]),
+            'rounds_fought': int(results['rounds_fought'][0, 0]),
+            'attacker_hp_remaining_percentage':
+                float(results['attacker_hp_remaining_percentage'][0, 0]),
+            'defender_hp_remaining_percentage':
+                float(results['defender_hp_remaining_percentage'][0, 0]),
+        },
+        'user_stats_summary': battalion_summary(battalion),
+        'score': list(score),
+        'evaluated': evaluated,
+    }
+
+
+def troop_mix_shards(problem, shard_count):
+    """
+    Splits a troop mix search into independent restarts.
+
+    Args:
+        problem (dict): The output of prepare_troop_mix_search.
+        shard_count (int): The number of seeds to refine.
+
+    Returns:
+        list: Argument tuples for run_troop_mix_shard, one per seed, best
+              seeds first.
+    """
+    seeds = troop_mix_seeds(problem)
+    scores = _mix_scores(problem, seeds)
+    order = sorted(range(len(seeds)), key=scores.__getitem__, reverse=True)
+    return [(problem, seeds[i]) for i in order[:shard_count]]
+
+
+def run_troop_mix_shard(problem, seed):
+    """Refine one seed of a troop mix search; returns a one-item list."""
+    return [search_troop_mix(problem, seed)]
+
+
+def troop_mix_key(entry):
+    """Rank a troop mix search result, larger is better."""
+    return tuple(entry['score'])
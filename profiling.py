@@ -0,0 +1,275 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import Blueprint, current_app, g, render_template, request, \
+    send_from_directory, abort
+from flask_login import current_user
+
+from auth import admin_required
+
+# Seconds between stack samples of an in-flight request.
+SAMPLE_INTERVAL = 0.01
+# Samples kept per request; a request running longer keeps its first ones.
+MAX_SAMPLES = 3000
+# Requests sampled at once; others run unsampled.
+MAX_SAMPLED_REQUESTS = 8
+# Profiles kept on disk; the oldest are deleted first.
+MAX_STORED_PROFILES = 100
+# Query parameter an admin adds to a URL to profile that request.
+PROFILE_PARAMETER = '_profile'
+
+profiling_bp = Blueprint('profiling', __name__)
+
+
+def collapse_stack(frame):
+    """
+    Formats a stack as one line of the collapsed-stack format.
+
+    Args:
+        frame: The innermost frame.
+
+    Returns:
+        str: 'outer;...;inner' with each frame as 'function (file:line)'.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(
+            code.co_name, os.path.basename(code.co_filename), frame.f_lineno
+        ))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """
+    Samples the stacks of in-flight requests from a background thread.
+
+    Only threads that have registered a request are sampled, at most
+    MAX_SAMPLED_REQUESTS at once and MAX_SAMPLES each, so the cost is
+    bounded however busy the server is. The thread sleeps while no
+    request is registered.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, max_samples=MAX_SAMPLES,
+                 max_requests=MAX_SAMPLED_REQUESTS):
+        self.interval = interval
+        self.max_samples = max_samples
+        self.max_requests = max_requests
+        self.stacks = {}
+        self.lock = threading.Lock()
+        self.active = threading.Condition(self.lock)
+        self.thread = None
+
+    def start(self):
+        """
+        Starts sampling the calling thread.
+
+        Returns:
+            Counter: The sampled stacks, filled in until stop is called,
+                     or None if too many requests are being sampled.
+        """
+        ident = threading.get_ident()
+        with self.lock:
+            if len(self.stacks) >= self.max_requests:
+                return None
+            stacks = self.stacks[ident] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._loop, name='stack-sampler', daemon=True
+                )
+                self.thread.start()
+            self.active.notify()
+        return stacks
+
+    def stop(self):
+        """Stop sampling the calling thread."""
+        with self.lock:
+            self.stacks.pop(threading.get_ident(), None)
+
+    def _loop(self):
+        """Sample the registered threads until the process exits."""
+        while True:
+            with self.lock:
+                while not self.stacks:
+                    self.active.wait()
+                targets = list(self.stacks.items())
+            frames = sys._current_frames()
+            for ident, stacks in targets:
+                frame = frames.get(ident)
+                if frame is not None and \
+                        stacks.total() < self.max_samples:
+                    stacks[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+sampler = StackSampler()
+# cProfile cannot run in two threads at once, so only one request is
+# profiled at a time; other requests for a profile run unprofiled.
+_profile_lock = threading.Lock()
+
+
+def profile_folder():
+    """Return the profile folder of the current app."""
+    return os.path.abspath(current_app.config['PROFILE_FOLDER'])
+
+
+def list_profiles(folder=None):
+    """
+    Lists the stored profiles, newest first.
+
+    Returns:
+        list: The metadata dicts written by save_profile.
+    """
+    folder = folder or profile_folder()
+    profiles = []
+    if not os.path.isdir(folder):
+        return profiles
+    for name in os.listdir(folder):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(folder, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return sorted(profiles, key=lambda profile: profile['created'],
+                  reverse=True)
+
+
+def save_profile(kind, write, duration, folder=None, **details):
+    """
+    Stores a profile and its metadata, pruning the oldest profiles.
+
+    Args:
+        kind (str): 'pstats' or 'collapsed', also the file extension.
+        write (callable): Writes the profile to the path it is given.
+        duration (float): The request's duration in seconds.
+        folder (str): The profile folder. Defaults to PROFILE_FOLDER.
+        **details: Extra metadata, e.g. the request's method and path.
+
+    Returns:
+        dict: The profile's metadata.
+    """
+    folder = folder or profile_folder()
+    os.makedirs(folder, exist_ok=True)
+    created = datetime.now()
+    profile_id = '{}-{}'.format(created.strftime('%Y%m%d%H%M%S'),
+                                uuid.uuid4().hex[:8])
+    filename = '{}.{}'.format(profile_id, kind)
+    write(os.path.join(folder, filename))
+    metadata = dict(details, id=profile_id, kind=kind, file=filename,
+                    duration=duration, created=created.isoformat())
+    with open(os.path.join(folder, profile_id + '.json'), 'w') as f:
+        json.dump(metadata, f)
+
+    for old in list_profiles(folder)[MAX_STORED_PROFILES:]:
+        for name in (old['file'], old['id'] + '.json'):
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+    return metadata
+
+
+def _write_collapsed(stacks):
+    """Return a writer for stacks in the collapsed-stack format."""
+    def write(path):
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+    return write
+
+
+def _wants_profile():
+    """Check if an admin asked for this request to be profiled."""
+    return request.args.get(PROFILE_PARAMETER) == '1' and \
+        current_user.is_authenticated and current_user.is_admin
+
+
+def _request_started():
+    """Start profiling or sampling a request."""
+    g.profile_start = time.perf_counter()
+    if _wants_profile() and _profile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler, e.g. a debugger's, is already running.
+            _profile_lock.release()
+        else:
+            g.profiler = profiler
+    elif current_app.config.get('PROFILE_SLOW_THRESHOLD'):
+        g.profile_stacks = sampler.start()
+
+
+def _request_finished(response):
+    """Store the request's profile if it was requested or slow."""
+    if 'profile_start' not in g:
+        return response
+    duration = time.perf_counter() - g.profile_start
+    details = {'method': request.method, 'path': request.full_path,
+               'endpoint': request.endpoint, 'status': response.status_code}
+    profiler = g.get('profiler')
+    if profiler is not None:
+        _stop_profiling()
+        save_profile('pstats', profiler.dump_stats, duration, **details)
+    stacks = g.get('profile_stacks')
+    if stacks is not None:
+        _stop_profiling()
+        threshold = current_app.config['PROFILE_SLOW_THRESHOLD']
+        if duration >= threshold and stacks:
+            save_profile('collapsed', _write_collapsed(stacks), duration,
+                         samples=stacks.total(), **details)
+    return response
+
+
+def _stop_profiling(exception=None):
+    """Stop profiling or sampling, even if the request failed."""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+    if g.pop('profile_stacks', None) is not None:
+        sampler.stop()
+
+
+def init_app(app):
+    """
+    Adds request profiling to an app.
+
+    Admins profile any request with cProfile by adding ?_profile=1 to
+    its URL. When PROFILE_SLOW_THRESHOLD is set, requests are also
+    stack-sampled, and the samples of those slower than the threshold
+    are stored. Profiles are listed at /admin/profiles.
+    """
+    app.before_request(_request_started)
+    app.after_request(_request_finished)
+    app.teardown_request(_stop_profiling)
+    app.register_blueprint(profiling_bp, url_prefix='/admin/profiles')
+
+
+@profiling_bp.route('/')
+@admin_required
+def index():
+    """List the stored profiles."""
+    return render_template('profiles.html', profiles=list_profiles(),
+                           threshold=current_app.config.get(
+                               'PROFILE_SLOW_THRESHOLD'),
+                           parameter=PROFILE_PARAMETER)
+
+
+@profiling_bp.route('/<name>')
+@admin_required
+def download(name):
+    """Download a stored profile."""
+    if not name.endswith(('.pstats', '.collapsed')):
+        abort(404)
+    return send_from_directory(profile_folder(), name, as_attachment=True)
@@ -0,0 +1,403 @@
+import csv
+import io
+import struct
+
+import numpy as np
+
+from app import db
+from game_data import get_game_data
+from models import User, UserTroop, UserEnforcer
+from user_details import validate_troop, validate_enforcer
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # pragma: no cover - depends on the environment
+    pyarrow = None
+
+KINDS = ('troops', 'enforcers')
+CSV_COLUMNS = {
+    'troops': ('username', 'type', 'tier', 'quantity'),
+    'enforcers': ('username', 'name', 'tier', 'has_signature_weapon'),
+}
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'packed': 'application/octet-stream',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+# Rows sent to the database per executemany.
+IMPORT_BATCH_SIZE = 1000
+# Rows per row group in the packed format, and per CSV or Arrow chunk.
+ROW_GROUP_SIZE = 4096
+MAX_IMPORT_ROWS = 1000000
+
+# The packed format: the magic, a version byte and a kind byte, then row
+# groups, each a little-endian uint32 row count (0 ends the file), a
+# uint32 string count and the strings as uint16 length-prefixed UTF-8,
+# then the columns: uint32 string indexes for username, name and tier,
+# and the value column, uint32 quantities or uint8 signature weapon flags.
+PACKED_MAGIC = b'TGMR'
+PACKED_VERSION = 1
+PACKED_VALUE_TYPES = {'troops': np.dtype('<u4'), 'enforcers': np.dtype('u1')}
+_INDEX_TYPE = np.dtype('<u4')
+
+
+def available_formats():
+    """List the formats rosters can be imported and exported in."""
+    return ('csv', 'packed', 'arrow') if pyarrow else ('csv', 'packed')
+
+
+def _parse_flag(value):
+    """Parse a CSV signature weapon flag."""
+    lowered = value.strip().lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no', ''):
+        return False
+    raise ValueError('Expected true or false, got "{}".'.format(value))
+
+
+def read_csv(stream, kind):
+    """
+    Reads roster rows from CSV as they arrive.
+
+    The first line is the header; its columns are CSV_COLUMNS[kind].
+
+    Args:
+        stream: A binary file-like object.
+        kind (str): 'troops' or 'enforcers'.
+
+    Yields:
+        tuple: (username, name, tier, value) per row, where name is the
+               troop type or enforcer and value the quantity or signature
+               weapon flag.
+
+    Raises:
+        ValueError: If the CSV is malformed.
+    """
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig',
+                                         newline=''))
+    header = next(reader, None)
+    if header is None or \
+            tuple(column.strip().lower() for column in header) != \
+            CSV_COLUMNS[kind]:
+        raise ValueError('Expected the header {}.'.format(
+            ','.join(CSV_COLUMNS[kind])))
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(CSV_COLUMNS[kind]):
+            raise ValueError('Line {}: expected {} columns.'.format(
+                reader.line_num, len(CSV_COLUMNS[kind])))
+        username, name, tier, value = (field.strip() for field in row)
+        try:
+            value = int(value) if kind == 'troops' else _parse_flag(value)
+        except ValueError as e:
+            raise ValueError('Line {}: {}'.format(reader.line_num, e)) \
+                from None
+        yield username, name, tier, value
+
+
+def write_csv(rows, kind):
+    """
+    Writes roster rows as CSV.
+
+    Args:
+        rows: (username, name, tier, value) tuples.
+        kind (str): 'troops' or 'enforcers'.
+
+    Yields:
+        bytes: Chunks of the file.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS[kind])
+    for number, (username, name, tier, value) in enumerate(rows, 1):
+        if kind == 'enforcers':
+            value = 'true' if value else 'false'
+        writer.writerow((username, name, tier, value))
+        if number % ROW_GROUP_SIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _read_exact(stream, size):
+    """Read exactly size bytes from a stream."""
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError('Unexpected end of file.')
+        data += chunk
+    return data
+
+
+def read_packed(stream, kind):
+    """
+    Reads roster rows from the packed format, one row group at a time.
+
+    Args:
+        stream: A binary file-like object.
+        kind (str): 'troops' or 'enforcers'.
+
+    Yields:
+        tuple: (username, name, tier, value) per row.
+
+    Raises:
+        ValueError: If the data is malformed or of another kind.
+    """
+    magic, version, file_kind = struct.unpack(
+        '<4sBB', _read_exact(stream, 6)
+    )
+    if magic != PACKED_MAGIC or version != PACKED_VERSION:
+        raise ValueError('Not a packed roster file.')
+    if file_kind != KINDS.index(kind):
+        raise ValueError('The file holds another kind of roster.')
+    value_type = PACKED_VALUE_TYPES[kind]
+    while True:
+        count, string_count = struct.unpack('<II', _read_exact(stream, 8))
+        if not count:
+            return
+        strings = []
+        for _ in range(string_count):
+            length, = struct.unpack('<H', _read_exact(stream, 2))
+            strings.append(_read_exact(stream, length).decode('utf-8'))
+        indexes = np.frombuffer(
+            _read_exact(stream, 3 * count * _INDEX_TYPE.itemsize),
+            dtype=_INDEX_TYPE
+        ).reshape(3, count)
+        if count and indexes.max() >= string_count:
+            raise ValueError('String index out of range.')
+        values = np.frombuffer(
+            _read_exact(stream, count * value_type.itemsize),
+            dtype=value_type
+        )
+        values = values.astype(bool) if kind == 'enforcers' else values
+        for username, name, tier, value in zip(*indexes.tolist(),
+                                               values.tolist()):
+            yield strings[username], strings[name], strings[tier], value
+
+
+def write_packed(rows, kind):
+    """
+    Writes roster rows in the packed format.
+
+    Args:
+        rows: (username, name, tier, value) tuples.
+        kind (str): 'troops' or 'enforcers'.
+
+    Yields:
+        bytes: The header, then one chunk per row group.
+    """
+    yield struct.pack('<4sBB', PACKED_MAGIC, PACKED_VERSION,
+                      KINDS.index(kind))
+    group = []
+    for row in rows:
+        group.append(row)
+        if len(group) == ROW_GROUP_SIZE:
+            yield _pack_group(group, kind)
+            group = []
+    if group:
+        yield _pack_group(group, kind)
+    yield struct.pack('<II', 0, 0)
+
+
+def _pack_group(rows, kind):
+    """Pack one row group."""
+    strings = {}
+    indexes = np.empty((3, len(rows)), dtype=_INDEX_TYPE)
+    for row_number, row in enumerate(rows):
+        for column in range(3):
+            indexes[column, row_number] = strings.setdefault(
+                row[column], len(strings)
+            )
+    parts = [struct.pack('<II', len(rows), len(strings))]
+    for string in strings:
+        encoded = string.encode('utf-8')
+        parts.append(struct.pack('<H', len(encoded)) + encoded)
+    parts.append(indexes.tobytes())
+    parts.append(np.array([row[3] for row in rows],
+                          dtype=PACKED_VALUE_TYPES[kind]).tobytes())
+    return b''.join(parts)
+
+
+def _arrow_schema(kind):
+    """Return the Arrow schema of a roster kind."""
+    return pyarrow.schema([
+        (CSV_COLUMNS[kind][0], pyarrow.string()),
+        (CSV_COLUMNS[kind][1], pyarrow.string()),
+        (CSV_COLUMNS[kind][2], pyarrow.string()),
+        (CSV_COLUMNS[kind][3],
+         pyarrow.int64() if kind == 'troops' else pyarrow.bool_()),
+    ])
+
+
+def read_arrow(stream, kind):
+    """
+    Reads roster rows from an Arrow IPC stream, one batch at a time.
+
+    Raises:
+        ValueError: If the stream is malformed or has other columns.
+    """
+    try:
+        reader = pyarrow.ipc.open_stream(stream)
+        columns = CSV_COLUMNS[kind]
+        if tuple(reader.schema.names) != columns:
+            raise ValueError('Expected the columns {}.'.format(
+                ', '.join(columns)))
+        for batch in reader:
+            yield from zip(*(batch.column(column).to_pylist()
+                             for column in columns))
+    except pyarrow.ArrowInvalid as e:
+        raise ValueError(str(e)) from e
+
+
+def write_arrow(rows, kind):
+    """Writes roster rows as an Arrow IPC stream, in batches."""
+    schema = _arrow_schema(kind)
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        group = []
+        for row in rows:
+            group.append(row)
+            if len(group) == ROW_GROUP_SIZE:
+                writer.write_batch(pyarrow.record_batch(
+                    list(map(list, zip(*group))), schema=schema
+                ))
+                group = []
+                yield sink.getvalue()
+                sink.seek(0)
+                sink.truncate()
+        if group:
+            writer.write_batch(pyarrow.record_batch(
+                list(map(list, zip(*group))), schema=schema
+            ))
+    yield sink.getvalue()
+
+
+READERS = {'csv': read_csv, 'packed': read_packed, 'arrow': read_arrow}
+WRITERS = {'csv': write_csv, 'packed': write_packed, 'arrow': write_arrow}
+
+
+def _check_format(fmt):
+    """Raise ValueError for a format this server cannot read or write."""
+    if fmt not in available_formats():
+        raise ValueError('Unknown format: {}'.format(fmt))
+
+
+def export_roster(kind, fmt):
+    """
+    Streams every user's troops or enforcers.
+
+    Rows are read from the database in batches as the response is sent,
+    ordered by username and then as each user listed them.
+
+    Args:
+        kind (str): 'troops' or 'enforcers'.
+        fmt (str): One of available_formats().
+
+    Returns:
+        generator: Chunks of the file.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    _check_format(fmt)
+    model = UserTroop if kind == 'troops' else UserEnforcer
+    columns = (
+        (UserTroop.troop_type, UserTroop.tier, UserTroop.quantity)
+        if kind == 'troops' else
+        (UserEnforcer.name, UserEnforcer.tier,
+         UserEnforcer.has_signature_weapon)
+    )
+    rows = db.session.execute(
+        db.select(User.username, *columns)
+        .join(User, User.id == model.user_id)
+        .order_by(User.username, model.position)
+        .execution_options(yield_per=IMPORT_BATCH_SIZE)
+    )
+    return WRITERS[fmt]((tuple(row) for row in rows), kind)
+
+
+def import_roster(stream, kind, fmt):
+    """
+    Replaces the troops or enforcers of every user in an uploaded roster.
+
+    The file is parsed as it is read and rows are validated against the
+    game data, then inserted IMPORT_BATCH_SIZE at a time with
+    executemany. Users missing from the file keep what they have. The
+    caller commits, or rolls back on error so nothing is half imported.
+
+    Args:
+        stream: The uploaded file, a binary file-like object.
+        kind (str): 'troops' or 'enforcers'.
+        fmt (str): One of available_formats().
+
+    Returns:
+        dict: The number of 'users' and 'rows' imported.
+
+    Raises:
+        ValueError: If the file is malformed, names an unknown user, or a
+                    row does not validate.
+    """
+    _check_format(fmt)
+    game_data = get_game_data()
+    model = UserTroop if kind == 'troops' else UserEnforcer
+    user_ids = {}
+    positions = {}
+    seen = set()
+    batch = []
+    rows = 0
+    for number, (username, name, tier, value) in enumerate(
+            READERS[fmt](stream, kind), 1):
+        try:
+            if number > MAX_IMPORT_ROWS:
+                raise ValueError('At most {} rows are allowed.'.format(
+                    MAX_IMPORT_ROWS))
+            if username not in user_ids:
+                user_id = db.session.execute(
+                    db.select(User.id).where(User.username == username)
+                ).scalar()
+                if user_id is None:
+                    raise ValueError('Unknown user: {}'.format(username))
+                db.session.execute(
+                    db.delete(model).where(model.user_id == user_id)
+                )
+                user_ids[username] = user_id
+                positions[user_id] = 0
+            user_id = user_ids[username]
+            if kind == 'troops':
+                troop = validate_troop(
+                    {'type': name, 'tier': tier, 'quantity': value},
+                    game_data['troop_stats']
+                )
+                key = (user_id, troop['type'], troop['tier'])
+                label = '{} {}'.format(troop['type'], troop['tier'])
+                row = {'troop_type': troop['type'], 'tier': troop['tier'],
+                       'quantity': troop['quantity']}
+            else:
+                enforcer = validate_enforcer(
+                    {'name': name, 'tier': tier,
+                     'has_signature_weapon': value}, game_data
+                )
+                key = (user_id, enforcer['name'])
+                label = enforcer['name']
+                row = dict(enforcer)
+            if key in seen:
+                raise ValueError('{} is listed twice for {}.'.format(
+                    label, username))
+        except ValueError as e:
+            raise ValueError('Row {}: {}'.format(number, e)) from None
+        seen.add(key)
+        row.update(user_id=user_id, position=positions[user_id])
+        positions[user_id] += 1
+        batch.append(row)
+        rows += 1
+        if len(batch) == IMPORT_BATCH_SIZE:
+            db.session.execute(db.insert(model), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(model), batch)
+    return {'users': len(user_ids), 'rows': rows}
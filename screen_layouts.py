@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+from functools import lru_cache
+
+SCREEN_LAYOUTS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'static', 'screen_layouts.json'
+)
+FIELDS = ('training_center_level', 'troop_levels', 'enforcers')
+KINDS = ('number', 'text')
+
+_layouts = None
+_layouts_signature = None
+_layouts_lock = threading.Lock()
+
+
+def validate_layouts(layouts):
+    """
+    Checks screen layout templates.
+
+    Each screen type has an integer 'version', a 'title' region with
+    'keywords' identifying the screen and named 'regions' to read. Boxes
+    are [left, top, right, bottom] fractions of the screenshot's size, so
+    one template fits every resolution with the same aspect ratio.
+
+    Args:
+        layouts (dict): The templates by screen type.
+
+    Raises:
+        ValueError: If a template is malformed.
+    """
+    def check_box(name, box):
+        if not (isinstance(box, list) and len(box) == 4 and
+                all(isinstance(value, (int, float)) for value in box) and
+                0 <= box[0] < box[2] <= 1 and 0 <= box[1] < box[3] <= 1):
+            raise ValueError('Invalid box for {}.'.format(name))
+
+    for screen_type, layout in layouts.items():
+        if not isinstance(layout.get('version'), int):
+            raise ValueError('{} has no version.'.format(screen_type))
+        title = layout.get('title') or {}
+        check_box(screen_type + ' title', title.get('box'))
+        if not title.get('keywords'):
+            raise ValueError('{} has no title keywords.'.format(screen_type))
+        for name, region in layout.get('regions', {}).items():
+            check_box('{} {}'.format(screen_type, name), region.get('box'))
+            if region.get('field') not in FIELDS:
+                raise ValueError('Unknown field for {} {}.'.format(
+                    screen_type, name))
+            if region.get('kind') not in KINDS:
+                raise ValueError('Unknown kind for {} {}.'.format(
+                    screen_type, name))
+
+
+def get_screen_layouts(path=None):
+    """
+    Returns the screen layout templates, reloading them when they change.
+
+    Args:
+        path (str): The templates file. Defaults to SCREEN_LAYOUTS_FILE.
+
+    Returns:
+        dict: The validated templates by screen type.
+    """
+    global _layouts, _layouts_signature
+    path = path or SCREEN_LAYOUTS_FILE
+    stat = os.stat(path)
+    signature = (path, stat.st_mtime_ns, stat.st_size)
+    with _layouts_lock:
+        if signature != _layouts_signature:
+            with open(path) as f:
+                layouts = json.load(f)
+            validate_layouts(layouts)
+            _layouts, _layouts_signature = layouts, signature
+        return _layouts
+
+
+@lru_cache(maxsize=256)
+def pixel_box(box, size):
+    """
+    Converts a fractional box to pixels for an image size.
+
+    Args:
+        box (tuple): (left, top, right, bottom) fractions.
+        size (tuple): The image's (width, height).
+
+    Returns:
+        tuple: The box in pixels, as PIL's crop expects it.
+    """
+    width, height = size
+    left, top, right, bottom = box
+    return (round(left * width), round(top * height),
+            round(right * width), round(bottom * height))
+
+
+def classify_screen(titles, layouts):
+    """
+    Picks the screen type whose title keywords appear in the title text.
+
+    Args:
+        titles (dict): The text read from each title box, keyed by the box
+                       as a tuple.
+        layouts (dict): The templates by screen type.
+
+    Returns:
+        str: The screen type, or None if no template matches.
+    """
+    best, best_length = None, 0
+    for screen_type, layout in layouts.items():
+        text = ' '.join(titles.get(tuple(layout['title']['box']), '').split())
+        for keyword in layout['title']['keywords']:
+            # The longest matching keyword wins, so 'TRAINING CENTER'
+            # beats a bare 'CENTER' on another screen.
+            if keyword.upper() in text.upper() and len(keyword) > best_length:
+                best, best_length = screen_type, len(keyword)
+    return best
@@ -0,0 +1,203 @@
+import base64
+import json
+import threading
+
+from sqlalchemy import case, event, func, select, text, tuple_
+
+from app import db
+from models import User
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 50
+# Trigram indexes cannot answer queries shorter than a trigram; those fall
+# back to a prefix scan of the lower(username) index.
+MIN_TRIGRAM_LENGTH = 3
+MAX_QUERY_LENGTH = 150
+
+SQLITE_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5("
+    "username, content='user', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS user_search_insert AFTER INSERT ON user "
+    "BEGIN INSERT INTO user_search(rowid, username) "
+    "VALUES (new.id, new.username); END",
+    "CREATE TRIGGER IF NOT EXISTS user_search_delete AFTER DELETE ON user "
+    "BEGIN INSERT INTO user_search(user_search, rowid, username) "
+    "VALUES ('delete', old.id, old.username); END",
+    "CREATE TRIGGER IF NOT EXISTS user_search_update "
+    "AFTER UPDATE OF username ON user "
+    "BEGIN INSERT INTO user_search(user_search, rowid, username) "
+    "VALUES ('delete', old.id, old.username); "
+    "INSERT INTO user_search(rowid, username) "
+    "VALUES (new.id, new.username); END",
+)
+POSTGRES_INDEX_DDL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_user_username_trgm ON "user" '
+    'USING gin (username gin_trgm_ops)',
+)
+
+_indexed_engines = set()
+_indexed_lock = threading.Lock()
+
+
+def create_search_index(connection):
+    """
+    Creates the username search index for the connection's database.
+
+    SQLite gets an FTS5 trigram table kept in sync with the user table by
+    triggers; Postgres gets a pg_trgm GIN index. Other databases search
+    without an index.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): An open connection.
+
+    Returns:
+        bool: Whether the database has a trigram index.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'user_search'"
+        )).first()
+        for statement in SQLITE_INDEX_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            connection.execute(text(
+                "INSERT INTO user_search(user_search) VALUES ('rebuild')"
+            ))
+        return True
+    if dialect == 'postgresql':
+        for statement in POSTGRES_INDEX_DDL:
+            connection.execute(text(statement))
+        return True
+    return False
+
+
+@event.listens_for(User.__table__, 'after_create')
+def _user_table_created(target, connection, **kw):
+    """Index the user table as soon as it is created."""
+    create_search_index(connection)
+
+
+@event.listens_for(User.__table__, 'before_drop')
+def _user_table_dropped(target, connection, **kw):
+    """Drop the SQLite search table along with the user table."""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS user_search'))
+    with _indexed_lock:
+        _indexed_engines.discard(connection.engine)
+
+
+def ensure_search_index():
+    """Create the search index once per engine, for existing databases."""
+    engine = db.engine
+    with _indexed_lock:
+        if engine in _indexed_engines:
+            return
+    with engine.begin() as connection:
+        create_search_index(connection)
+    with _indexed_lock:
+        _indexed_engines.add(engine)
+
+
+def encode_cursor(key):
+    """Encode a result's sort key as an opaque pagination cursor."""
+    return base64.urlsafe_b64encode(
+        json.dumps(key, separators=(',', ':')).encode('utf-8')
+    ).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a pagination cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor.') from e
+    if not (isinstance(key, list) and len(key) == 3 and
+            isinstance(key[0], int) and isinstance(key[1], int) and
+            isinstance(key[2], str)):
+        raise ValueError('Invalid cursor.')
+    return key
+
+
+def _escape_like(value):
+    """Escape LIKE wildcards in a user-supplied string."""
+    return value.replace('\\', '\\\\').replace('%', '\\%') \
+        .replace('_', '\\_')
+
+
+def search_users(query, limit=DEFAULT_SEARCH_LIMIT, after=None,
+                 exclude_id=None):
+    """
+    Finds users whose username contains a query.
+
+    Candidates come from the trigram index (FTS5 on SQLite, pg_trgm on
+    Postgres), or from a prefix scan for queries too short for trigrams.
+    Results are ranked exact match first, then prefix matches, then other
+    matches, shorter usernames first, and paginated by keyset: the cursor
+    is the last result's rank, so later pages cost the same as the first.
+
+    Args:
+        query (str): The text to look for, case-insensitively.
+        limit (int): The page size, at most MAX_SEARCH_LIMIT.
+        after (str): The cursor returned with the previous page.
+        exclude_id (int): A user to leave out, e.g. the one searching.
+
+    Returns:
+        tuple: (list of User, cursor for the next page or None).
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    query = (query or '').strip()[:MAX_QUERY_LENGTH]
+    if not query:
+        return [], None
+    limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+    ensure_search_index()
+
+    lowered = func.lower(User.username)
+    pattern = _escape_like(query.lower())
+    rank = case(
+        (lowered == query.lower(), 0),
+        (lowered.like(pattern + '%', escape='\\'), 1),
+        else_=2,
+    )
+    length = func.length(User.username)
+    statement = select(User, rank, length)
+
+    dialect = db.engine.dialect.name
+    if len(query) < MIN_TRIGRAM_LENGTH:
+        statement = statement.where(
+            lowered >= query.lower(), lowered < query.lower() + '\uffff'
+        )
+    elif dialect == 'sqlite':
+        phrase = '"{}"'.format(query.replace('"', '""'))
+        statement = statement.where(User.id.in_(
+            select(text('rowid')).select_from(text('user_search'))
+            .where(text('user_search MATCH :phrase'))
+        )).params(phrase=phrase)
+    else:
+        statement = statement.where(
+            User.username.ilike('%' + pattern + '%', escape='\\')
+        )
+    if exclude_id is not None:
+        statement = statement.where(User.id != exclude_id)
+    if after:
+        statement = statement.where(
+            tuple_(rank, length, User.username) > tuple_(*decode_cursor(after))
+        )
+    rows = db.session.execute(
+        statement.order_by(rank, length, User.username).limit(limit + 1)
+    ).all()
+
+    users = [row[0] for row in rows[:limit]]
+    cursor = None
+    if len(rows) > limit:
+        user, user_rank, user_length = rows[limit - 1]
+        cursor = encode_cursor([user_rank, user_length, user.username])
+    return users, cursor
@@ -0,0 +1,513 @@
+import numpy as np
+
+from game_data import get_game_data
+from buff_table import STATS, get_buff_table, normalize_troop_type, \
+    team_coefficients
+
+# Mirrors the constants used by simulateBattle in combat_logic.js.
+COUNTER_STRONG_MOD = 0.5
+COUNTER_WEAK_MOD = -0.33
+MAX_BATTLE_ROUNDS = 100
+
+# Upper bound on each side of a batch simulation request.
+MAX_BATCH_BATTALIONS = 200
+
+# Closed-form results this close (relative) to a tie, or to a side dying
+# exactly on a round boundary, could come out differently in the stepped
+# simulation's floating point, so those pairings are stepped instead.
+CLOSED_FORM_TOLERANCE = 1e-9
+
+
+def get_counter_modifier(attacker_type, defender_type, counter_info):
+    """
+    Gets the damage modifier of one troop type attacking another.
+
+    Args:
+        attacker_type (str): The attacking troop type.
+        defender_type (str): The defending troop type.
+        counter_info (dict): The contents of counter_info.json.
+
+    Returns:
+        float: COUNTER_STRONG_MOD, COUNTER_WEAK_MOD or 0.
+    """
+    attacker_type = attacker_type[:-1] if attacker_type.endswith('s') \
+        else attacker_type
+    defender_type = defender_type[:-1] if defender_type.endswith('s') \
+        else defender_type
+    info = counter_info.get(attacker_type)
+    if info:
+        if defender_type in info.get('strong_against', []):
+            return COUNTER_STRONG_MOD
+        if defender_type in info.get('weak_against', []):
+            return COUNTER_WEAK_MOD
+    return 0
+
+
+def counter_matrix(game_data):
+    """
+    Builds the counter modifier matrix for every pair of troop types.
+
+    Args:
+        game_data (dict): The loaded game data.
+
+    Returns:
+        numpy.ndarray: Matrix indexed [attacker type, defender type] in the
+                       order of troop_stats.json.
+    """
+    troop_types = list(game_data['troop_stats'])
+    matrix = np.zeros((len(troop_types), len(troop_types)))
+    for i, attacker_type in enumerate(troop_types):
+        for j, defender_type in enumerate(troop_types):
+            matrix[i, j] = get_counter_modifier(
+                attacker_type, defender_type, game_data['counter_info']
+            )
+    return matrix
+
+
+def battalion_base(troops, misc_buffs=None, game_data=None):
+    """
+    Calculates the unbuffed stats of each troop group and its misc buffs.
+
+    Args:
+        troops (list): Troop dicts with 'type', 'tier' and 'quantity'.
+        misc_buffs (dict): Misc buffs, e.g. {'training_center_level': 12}.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        tuple: (types, base, bonus) where types holds each group's troop
+               type index, base its unbuffed stats indexed [group, stat]
+               and bonus the misc buff fractions in the same layout.
+               Groups whose base stats are unknown are left out.
+    """
+    game_data = game_data or get_game_data()
+    troop_stats = game_data['troop_stats']
+    troop_types = list(troop_stats)
+
+    group_types = []
+    base = []
+    for troop in troops:
+        troop_type = normalize_troop_type(troop['type'], troop_types)
+        if troop_type is None or troop['tier'] not in troop_stats[troop_type]:
+            continue
+        tier_stats = troop_stats[troop_type][troop['tier']]
+        group_types.append(troop_types.index(troop_type))
+        base.append([tier_stats[stat] * troop['quantity'] for stat in STATS])
+
+    group_types = np.array(group_types, dtype=int)
+    base = np.array(base, dtype=float).reshape(-1, len(STATS))
+    bonus = np.zeros_like(base)
+
+    misc_buffs = misc_buffs or {}
+    if 'training_center_level' in misc_buffs:
+        tc_bonus = game_data['misc_buffs'].get(
+            'training_center_def_bonus', {}
+        ).get('level_{}'.format(misc_buffs['training_center_level']))
+        if isinstance(tc_bonus, (int, float)):
+            bonus[:, STATS.index('def')] += tc_bonus
+    return group_types, base, bonus
+
+
+def build_battalion(group_types, stats):
+    """
+    Packs buffed group stats into the battalion dict used by the engine.
+
+    Args:
+        group_types (numpy.ndarray): Each group's troop type index.
+        stats (numpy.ndarray): Buffed stats indexed [group, stat].
+
+    Returns:
+        dict: Per-group arrays ('types', 'atk', 'def', 'hp') together with
+              'total_atk', 'total_def' and 'total_hp'.
+    """
+    battalion = {'types': group_types}
+    for i, stat in enumerate(STATS):
+        battalion[stat] = stats[:, i]
+        battalion['total_' + stat] = float(stats[:, i].sum())
+    return battalion
+
+
+def calculate_battalion_stats(troops, enforcers=(), misc_buffs=None,
+                              game_data=None):
+    """
+    Calculates the buffed ATK, DEF and HP of each troop group.
+
+    Follows calculateBattalionStats in combat_logic.js: the Training Center
+    DEF bonus is applied first, then every enforcer and signature weapon
+    buff adds a percentage of the group's unbuffed stat. The enforcer buffs
+    come from the compiled buff table rather than being parsed per call.
+
+    Args:
+        troops (list): Troop dicts with 'type', 'tier' and 'quantity'.
+        enforcers (list): Enforcer dicts with 'name', 'tier' and
+                          'has_signature_weapon'.
+        misc_buffs (dict): Misc buffs, e.g. {'training_center_level': 12}.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        dict: The output of build_battalion. Groups whose base stats are
+              unknown are left out.
+    """
+    group_types, base, bonus = battalion_base(troops, misc_buffs, game_data)
+    if enforcers:
+        coefficients = team_coefficients(
+            enforcers, get_buff_table(game_data)
+        )
+        bonus += coefficients[group_types]
+    return build_battalion(group_types, base * (1 + bonus))
+
+
+def stack_battalions(battalions):
+    """
+    Pads the per-group arrays of several battalions into 2-D arrays.
+
+    Padding groups have no ATK and no HP, so they never take part in a
+    battle.
+
+    Args:
+        battalions (list): Outputs of calculate_battalion_stats.
+
+    Returns:
+        tuple: (types, atk, hp) arrays of shape (battalions, groups).
+    """
+    width = max([len(battalion['types']) for battalion in battalions] + [1])
+    types = np.zeros((len(battalions), width), dtype=int)
+    atk = np.zeros((len(battalions), width))
+    hp = np.zeros((len(battalions), width))
+    for i, battalion in enumerate(battalions):
+        groups = len(battalion['types'])
+        types[i, :groups] = battalion['types']
+        atk[i, :groups] = battalion['atk']
+        hp[i, :groups] = battalion['hp']
+    return types, atk, hp
+
+
+def step_batch(attackers, defenders, max_rounds=MAX_BATTLE_ROUNDS,
+               game_data=None):
+    """
+    Simulates every attacker against every defender round by round.
+
+    Reproduces the round semantics of simulateBattle in combat_logic.js:
+    each round both sides deal damage at the same time, every living group
+    spreads its ATK over the enemy groups in proportion to their HP (with
+    the counter modifier applied), and the damage a side takes is shared
+    between its groups in proportion to their HP. All pairings advance
+    together as one (attackers, defenders, groups) tensor; a pairing stops
+    changing once either side has no HP left.
+
+    Args:
+        attackers (list): Outputs of calculate_battalion_stats.
+        defenders (list): Outputs of calculate_battalion_stats.
+        max_rounds (int): The round limit.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        dict: (attackers, defenders) arrays 'winner' ('attacker',
+              'defender' or 'draw'), 'rounds_fought',
+              'attacker_hp_remaining_percentage' and
+              'defender_hp_remaining_percentage'.
+    """
+    matrix = 1 + counter_matrix(game_data or get_game_data())
+    att_types, att_atk, att_initial = stack_battalions(attackers)
+    def_types, def_atk, def_initial = stack_battalions(defenders)
+    shape = (len(attackers), len(defenders))
+
+    # Counter modifiers indexed [attacker, defender, group, enemy group].
+    att_vs_def = matrix[att_types[:, None, :, None],
+                        def_types[None, :, None, :]]
+    def_vs_att = matrix[def_types[None, :, :, None],
+                        att_types[:, None, None, :]]
+    att_atk = np.broadcast_to(att_atk[:, None, :], shape + att_atk.shape[1:])
+    def_atk = np.broadcast_to(def_atk[None, :, :], shape + def_atk.shape[1:])
+    att_hp = np.broadcast_to(
+        att_initial[:, None, :], att_atk.shape
+    ).copy()
+    def_hp = np.broadcast_to(
+        def_initial[None, :, :], def_atk.shape
+    ).copy()
+
+    rounds_fought = np.zeros(shape, dtype=int)
+    for battle_round in range(1, max_rounds + 1):
+        att_total = att_hp.sum(axis=-1, keepdims=True)
+        def_total = def_hp.sum(axis=-1, keepdims=True)
+        fighting = (att_total > 0) & (def_total > 0)
+        if not fighting.any():
+            break
+        rounds_fought[fighting[..., 0]] = battle_round
+
+        att_share = np.divide(att_hp, att_total, where=fighting,
+                              out=np.zeros_like(att_hp))
+        def_share = np.divide(def_hp, def_total, where=fighting,
+                              out=np.zeros_like(def_hp))
+        damage_to_def = np.einsum(
+            'nma,nmad,nmd->nm', np.where(att_hp > 0, att_atk, 0),
+            att_vs_def, def_share
+        )
+        damage_to_att = np.einsum(
+            'nmd,nmda,nma->nm', np.where(def_hp > 0, def_atk, 0),
+            def_vs_att, att_share
+        )
+
+        def_hp = np.maximum(0, def_hp - damage_to_def[..., None] * def_share)
+        att_hp = np.maximum(0, att_hp - damage_to_att[..., None] * att_share)
+
+    att_fraction = att_hp.sum(axis=-1) / \
+        np.maximum(1, att_initial.sum(axis=-1))[:, None]
+    def_fraction = def_hp.sum(axis=-1) / \
+        np.maximum(1, def_initial.sum(axis=-1))[None, :]
+    return {
+        'winner': np.where(
+            att_fraction > def_fraction, 'attacker',
+            np.where(def_fraction > att_fraction, 'defender', 'draw')
+        ),
+        'rounds_fought': rounds_fought,
+        'attacker_hp_remaining_percentage': att_fraction * 100,
+        'defender_hp_remaining_percentage': def_fraction * 100,
+    }
+
+
+def _type_totals(types, values, type_count):
+    """Sum per-group values by troop type into a (battalions, types) array."""
+    totals = np.zeros((len(types), type_count))
+    rows = np.broadcast_to(np.arange(len(types))[:, None], types.shape)
+    np.add.at(totals, (rows, types), values)
+    return totals
+
+
+def _rounds_to_kill(hp, damage):
+    """Return hp / damage, or infinity where no damage is dealt."""
+    hp, damage = np.broadcast_arrays(hp, damage)
+    return np.divide(hp, damage, out=np.full(hp.shape, np.inf),
+                     where=damage > 0)
+
+
+def _near_integer(values):
+    """Flag finite values within CLOSED_FORM_TOLERANCE of a whole number."""
+    finite = np.isfinite(values)
+    safe = np.where(finite, values, 0)
+    return finite & (np.abs(safe - np.round(safe))
+                     <= CLOSED_FORM_TOLERANCE * np.maximum(1, safe))
+
+
+def resolve_batch(attackers, defenders, max_rounds=MAX_BATTLE_ROUNDS,
+                  game_data=None):
+    """
+    Resolves every attacker against every defender in closed form.
+
+    Under the rules of step_batch each group of a side takes the same
+    fraction of its HP every round, so HP shares, and with them the damage
+    each side deals per round, stay constant until a side is wiped out. A
+    side with total HP H facing damage D per round therefore dies in round
+    ceil(H / D), and the HP left at the end follows directly.
+
+    Args:
+        attackers (list): Outputs of calculate_battalion_stats.
+        defenders (list): Outputs of calculate_battalion_stats.
+        max_rounds (int): The round limit.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        tuple: (results, inexact) where results has the layout of
+               step_batch and inexact flags the pairings whose outcome
+               floating point rounding could change.
+    """
+    matrix = 1 + counter_matrix(game_data or get_game_data())
+    type_count = len(matrix)
+    att_types, att_atk, att_hp = stack_battalions(attackers)
+    def_types, def_atk, def_hp = stack_battalions(defenders)
+    att_total = att_hp.sum(axis=1)
+    def_total = def_hp.sum(axis=1)
+
+    def shares(types, hp, total):
+        return _type_totals(types, hp, type_count) / \
+            np.maximum(total, np.finfo(float).tiny)[:, None]
+
+    # Damage per round indexed [attacker, defender].
+    damage_to_def = _type_totals(
+        att_types, np.where(att_hp > 0, att_atk, 0), type_count
+    ) @ matrix @ shares(def_types, def_hp, def_total).T
+    damage_to_att = (_type_totals(
+        def_types, np.where(def_hp > 0, def_atk, 0), type_count
+    ) @ matrix @ shares(att_types, att_hp, att_total).T).T
+
+    att_rounds = _rounds_to_kill(att_total[:, None], damage_to_att)
+    def_rounds = _rounds_to_kill(def_total[None, :], damage_to_def)
+    att_death = np.ceil(att_rounds)
+    def_death = np.ceil(def_rounds)
+    fighting = (att_total[:, None] > 0) & (def_total[None, :] > 0)
+    rounds = np.where(
+        fighting, np.minimum(np.minimum(att_death, def_death), max_rounds), 0
+    ).astype(int)
+
+    att_left = np.where(
+        fighting & (rounds >= att_death), 0,
+        np.maximum(0, att_total[:, None] - rounds * damage_to_att)
+    )
+    def_left = np.where(
+        fighting & (rounds >= def_death), 0,
+        np.maximum(0, def_total[None, :] - rounds * damage_to_def)
+    )
+    att_fraction = att_left / np.maximum(1, att_total)[:, None]
+    def_fraction = def_left / np.maximum(1, def_total)[None, :]
+
+    inexact = fighting & (
+        (_near_integer(att_rounds) & (att_rounds <= max_rounds + 1)) |
+        (_near_integer(def_rounds) & (def_rounds <= max_rounds + 1)) |
+        ((att_fraction > 0) & (np.abs(att_fraction - def_fraction)
+                               <= CLOSED_FORM_TOLERANCE))
+    )
+    results = {
+        'winner': np.where(
+            att_fraction > def_fraction, 'attacker',
+            np.where(def_fraction > att_fraction, 'defender', 'draw')
+        ),
+        'rounds_fought': rounds,
+        'attacker_hp_remaining_percentage': att_fraction * 100,
+        'defender_hp_remaining_percentage': def_fraction * 100,
+    }
+    return results, inexact
+
+
+def simulate_batch(attackers, defenders, max_rounds=MAX_BATTLE_ROUNDS,
+                   game_data=None, fast=True):
+    """
+    Simulates every attacker against every defender at once.
+
+    Uses the closed form of resolve_batch and steps round by round, with
+    step_batch, only the pairings it flags as inexact.
+
+    Args:
+        attackers (list): Outputs of calculate_battalion_stats.
+        defenders (list): Outputs of calculate_battalion_stats.
+        max_rounds (int): The round limit.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+        fast (bool): Set to False to step every pairing.
+
+    Returns:
+        dict: (attackers, defenders) arrays 'winner' ('attacker',
+              'defender' or 'draw'), 'rounds_fought',
+              'attacker_hp_remaining_percentage' and
+              'defender_hp_remaining_percentage'.
+    """
+    if not fast:
+        return step_batch(attackers, defenders, max_rounds, game_data)
+    results, inexact = resolve_batch(
+        attackers, defenders, max_rounds, game_data
+    )
+    if inexact.any():
+        rows = np.unique(np.nonzero(inexact)[0])
+        cols = np.unique(np.nonzero(inexact)[1])
+        stepped = step_batch(
+            [attackers[i] for i in rows], [defenders[j] for j in cols],
+            max_rounds, game_data
+        )
+        block = np.ix_(rows, cols)
+        for key, values in results.items():
+            values[block] = np.where(
+                inexact[block], stepped[key], values[block]
+            )
+    return results
+
+
+def simulate_battle(attacker, defender, max_rounds=MAX_BATTLE_ROUNDS,
+                    game_data=None):
+    """
+    Simulates a battle between two battalions.
+
+    Args:
+        attacker (dict): Output of calculate_battalion_stats.
+        defender (dict): Output of calculate_battalion_stats.
+        max_rounds (int): The round limit.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        dict: The winner ('attacker', 'defender' or 'draw'), rounds fought
+              and the HP percentage each side has left.
+    """
+    results = simulate_batch([attacker], [defender], max_rounds, game_data)
+    return battle_result(
+        results['attacker_hp_remaining_percentage'][0, 0] / 100,
+        results['defender_hp_remaining_percentage'][0, 0] / 100,
+        results['rounds_fought'][0, 0]
+    )
+
+
+def battle_result(att_fraction, def_fraction, rounds_fought):
+    """
+    Builds a battle result from the HP fraction each side has left.
+
+    Args:
+        att_fraction (float): Attacker HP remaining / initial HP.
+        def_fraction (float): Defender HP remaining / initial HP.
+        rounds_fought (int): The number of rounds fought.
+
+    Returns:
+        dict: The battle result.
+    """
+    if att_fraction > def_fraction:
+        winner = 'attacker'
+    elif def_fraction > att_fraction:
+        winner = 'defender'
+    else:
+        winner = 'draw'
+    return {
+        'winner': winner,
+        'rounds_fought': int(rounds_fought),
+        'attacker_hp_remaining_percentage': float(att_fraction * 100),
+        'defender_hp_remaining_percentage': float(def_fraction * 100),
+    }
+
+
+def parse_battalion(data, require_troops=True):
+    """
+    Validates a battalion posted to the simulation API.
+
+    Args:
+        data (dict): {'troops': [...], 'enforcers': [...],
+                      'misc_buffs': {...}}.
+        require_troops (bool): If False, the troop list may be left out
+                               or empty.
+
+    Returns:
+        tuple: (troops, enforcers, misc_buffs) ready for
+               calculate_battalion_stats.
+
+    Raises:
+        ValueError: If the battalion is malformed.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Battalion must be an object.')
+    troops = data.get('troops', None if require_troops else [])
+    if not isinstance(troops, list) or (require_troops and not troops):
+        raise ValueError('Battalion must have a list of troops.')
+    for troop in troops:
+        if not isinstance(troop, dict) or \
+                not isinstance(troop.get('type'), str) or \
+                not isinstance(troop.get('tier'), str):
+            raise ValueError('Troops need a type and a tier.')
+        quantity = troop.get('quantity')
+        if isinstance(quantity, bool) or not isinstance(quantity, int) \
+                or quantity < 0:
+            raise ValueError('Troop quantity must be a non-negative integer.')
+
+    enforcers = data.get('enforcers', [])
+    if not isinstance(enforcers, list):
+        raise ValueError('Enforcers must be a list.')
+    for enforcer in enforcers:
+        if not isinstance(enforcer, dict) or \
+                not isinstance(enforcer.get('name'), str) or \
+                not isinstance(enforcer.get('tier'), str):
+            raise ValueError('Enforcers need a name and a tier.')
+
+    misc_buffs = data.get('misc_buffs', {})
+    if not isinstance(misc_buffs, dict):
+        raise ValueError('Misc buffs must be an object.')
+    return troops, enforcers, misc_buffs
+
+
+def battalion_summary(battalion):
+    """Return the JSON-serialisable totals of a battalion."""
+    return {
+        'total_atk': battalion['total_atk'],
+        'total_def': battalion['total_def'],
+        'total_hp': battalion['total_hp'],
+    }
@@ -0,0 +1,425 @@
+import hashlib
+import hmac
+import http.client
+import logging
+import mimetypes
+import os
+import tempfile
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs, quote
+
+from flask import current_app
+
+from app import db
+from models import StoredFile
+
+# Uploads are read, hashed and written in chunks of this many bytes, so a
+# large upload is never held in memory at once.
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_TIMEOUT = 10
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+logger = logging.getLogger(__name__)
+
+
+class LocalStorage:
+    """
+    Stores files on the local filesystem under their SHA-256 digest.
+
+    Files live at '<root>/<digest[:2]>/<digest>'. Uploads are streamed to a
+    temporary file while they are hashed and then renamed into place, so a
+    reader never sees a partial file and identical uploads are stored once.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path(self, digest):
+        """Return where a file is stored."""
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        """Check if a file is stored."""
+        return os.path.exists(self.path(digest))
+
+    def spool(self, stream):
+        """
+        Streams data into a temporary file in the store, hashing it.
+
+        Args:
+            stream: A readable binary file-like object.
+
+        Returns:
+            tuple: (temporary path, hex SHA-256 digest, size in bytes).
+        """
+        temp_folder = os.path.join(self.root, '.tmp')
+        os.makedirs(temp_folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_folder)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path, digest.hexdigest(), size
+
+    def commit(self, temp_path, digest):
+        """Move a spooled file into place, dropping it if already stored."""
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.unlink(temp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def save(self, stream):
+        """
+        Stores the data read from a stream.
+
+        Args:
+            stream: A readable binary file-like object.
+
+        Returns:
+            tuple: (hex SHA-256 digest, size in bytes).
+        """
+        temp_path, digest, size = self.spool(stream)
+        self.commit(temp_path, digest)
+        return digest, size
+
+    def local_path(self, digest):
+        """Return a local path holding a stored file."""
+        return self.path(digest)
+
+    def delete(self, digest):
+        """Delete a stored file, if it exists."""
+        try:
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+class S3Storage:
+    """
+    Stores files in an S3-compatible bucket under their SHA-256 digest.
+
+    Speaks the S3 REST API with Signature Version 4 over http.client, so
+    no client library is needed; path-style URLs keep it compatible with
+    MinIO and similar servers. Uploads are spooled to a local cache while
+    they are hashed, skipped if the bucket already holds the digest, and
+    sent with the digest as their signed payload hash. Image processing
+    works on local copies, which are downloaded into the same cache.
+    """
+
+    def __init__(self, url, cache_root, timeout=DEFAULT_TIMEOUT):
+        parsed = urlparse(url)
+        query = parse_qs(parsed.query)
+        self.secure = query.get('secure', ['1'])[0] != '0'
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or (443 if self.secure else 80)
+        self.access_key = parsed.username or ''
+        self.secret_key = parsed.password or ''
+        parts = parsed.path.strip('/').split('/', 1)
+        self.bucket = parts[0]
+        self.prefix = parts[1].rstrip('/') + '/' if len(parts) > 1 else ''
+        self.region = query.get('region', ['us-east-1'])[0]
+        self.timeout = timeout
+        self.cache = LocalStorage(cache_root)
+
+    def _object_path(self, digest):
+        """Return the URL path of an object."""
+        return '/{}/{}{}'.format(self.bucket, self.prefix, digest)
+
+    def _sign(self, method, path, headers, payload_hash):
+        """Add the SigV4 authorization headers to a request."""
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = amz_date[:8]
+        headers['Host'] = '{}:{}'.format(self.host, self.port)
+        headers['x-amz-date'] = amz_date
+        headers['x-amz-content-sha256'] = payload_hash
+        names = sorted(name.lower() for name in headers)
+        values = {name.lower(): str(value).strip()
+                  for name, value in headers.items()}
+        canonical_request = '\n'.join([
+            method,
+            quote(path),
+            '',
+            ''.join('{}:{}\n'.format(name, values[name]) for name in names),
+            ';'.join(names),
+            payload_hash,
+        ])
+        scope = '{}/{}/s3/aws4_request'.format(date, self.region)
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+        ])
+        key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in (date, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode('utf-8'),
+                             hashlib.sha256).hexdigest()
+        headers['Authorization'] = (
+            'AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, '
+            'Signature={}'.format(self.access_key, scope, ';'.join(names),
+                                  signature)
+        )
+
+    def _request(self, method, digest, body=None, size=0,
+                 payload_hash=EMPTY_SHA256):
+        """
+        Sends a signed request for an object.
+
+        Returns:
+            tuple: (connection, response). The caller reads the response
+                   and closes the connection.
+        """
+        path = self._object_path(digest)
+        headers = {}
+        if body is not None:
+            headers['Content-Length'] = str(size)
+        self._sign(method, path, headers, payload_hash)
+        connection_class = http.client.HTTPSConnection if self.secure \
+            else http.client.HTTPConnection
+        connection = connection_class(self.host, self.port,
+                                      timeout=self.timeout)
+        try:
+            connection.request(method, quote(path), body=body,
+                               headers=headers)
+            return connection, connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+
+    def _call(self, method, digest, **kwargs):
+        """Send a request whose response body is not needed."""
+        connection, response = self._request(method, digest, **kwargs)
+        try:
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def exists(self, digest):
+        """Check if the bucket holds a file."""
+        status = self._call('HEAD', digest)
+        if status not in (200, 404):
+            raise OSError('Storage server returned {} for HEAD.'.format(
+                status))
+        return status == 200
+
+    def save(self, stream):
+        """
+        Stores the data read from a stream.
+
+        Args:
+            stream: A readable binary file-like object.
+
+        Returns:
+            tuple: (hex SHA-256 digest, size in bytes).
+
+        Raises:
+            OSError: If the storage server rejects the upload.
+        """
+        temp_path, digest, size = self.cache.spool(stream)
+        try:
+            if not self.exists(digest):
+                with open(temp_path, 'rb') as f:
+                    status = self._call('PUT', digest, body=f, size=size,
+                                        payload_hash=digest)
+                if status != 200:
+                    raise OSError('Storage server returned {} for PUT.'
+                                  .format(status))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.cache.commit(temp_path, digest)
+        return digest, size
+
+    def local_path(self, digest):
+        """
+        Returns a local path holding a stored file.
+
+        Downloads the file into the local cache if it is not there yet.
+
+        Raises:
+            FileNotFoundError: If the bucket does not hold the file.
+        """
+        if self.cache.exists(digest):
+            return self.cache.path(digest)
+        connection, response = self._request('GET', digest)
+        try:
+            if response.status != 200:
+                response.read()
+                raise FileNotFoundError(digest)
+            temp_path, received, _ = self.cache.spool(response)
+        finally:
+            connection.close()
+        if received != digest:
+            os.unlink(temp_path)
+            raise OSError('Downloaded file does not match its digest.')
+        self.cache.commit(temp_path, digest)
+        return self.cache.path(digest)
+
+    def delete(self, digest):
+        """Delete a stored file and its local copy."""
+        self._call('DELETE', digest)
+        self.cache.delete(digest)
+
+
+def create_storage(url, root):
+    """
+    Creates the upload storage for a URL.
+
+    Args:
+        url (str): 's3://access_key:secret_key@host[:port]/bucket[/prefix]'
+                   with optional 'region' and 'secure=0' query parameters
+                   for an S3-compatible server; anything else stores files
+                   locally.
+        root (str): The local folder for stored files or, with S3, for the
+                    local copies.
+
+    Returns:
+        LocalStorage or S3Storage: The storage.
+    """
+    if url and urlparse(url).scheme == 's3':
+        return S3Storage(url, root)
+    return LocalStorage(root)
+
+
+def get_storage():
+    """Return the upload storage configured for the current app."""
+    config = (current_app.config.get('STORAGE_URL'),
+              current_app.config['UPLOAD_FOLDER'])
+    storage, storage_config = current_app.extensions.get(
+        'upload_storage', (None, None)
+    )
+    if storage is None or storage_config != config:
+        storage = create_storage(*config)
+        current_app.extensions['upload_storage'] = (storage, config)
+    return storage
+
+
+def guess_content_type(filename):
+    """
+    Guesses the type a stored file is served as.
+
+    Only image types are trusted; anything else is served as a download.
+
+    Args:
+        filename (str): The uploaded file's name.
+
+    Returns:
+        str: The MIME type.
+    """
+    content_type = mimetypes.guess_type(filename)[0]
+    if content_type and content_type.startswith('image/') and \
+            content_type != 'image/svg+xml':
+        return content_type
+    return 'application/octet-stream'
+
+
+def store_file(stream, filename):
+    """
+    Stores an upload and takes a reference to it.
+
+    Identical uploads are stored once; each call adds a reference that
+    release_file gives back. The reference is committed with the caller's
+    session.
+
+    Args:
+        stream: A readable binary file-like object.
+        filename (str): The uploaded file's name.
+
+    Returns:
+        StoredFile: The stored file's record.
+    """
+    digest, size = get_storage().save(stream)
+    stored = db.session.get(StoredFile, digest)
+    if stored is None:
+        stored = StoredFile(digest=digest, size=size, ref_count=1,
+                            content_type=guess_content_type(filename))
+        db.session.add(stored)
+    else:
+        stored.ref_count = StoredFile.ref_count + 1
+    db.session.flush()
+    return stored
+
+
+def release_file(digest):
+    """
+    Gives back a reference taken by store_file.
+
+    The file is deleted once nothing refers to it.
+
+    Args:
+        digest (str): The stored file's digest.
+    """
+    stored = db.session.get(StoredFile, digest)
+    if stored is None:
+        return
+    stored.ref_count = StoredFile.ref_count - 1
+    db.session.flush()
+    db.session.refresh(stored)
+    if stored.ref_count <= 0:
+        db.session.delete(stored)
+        db.session.flush()
+        try:
+            get_storage().delete(digest)
+        except OSError as e:
+            logger.warning('Could not delete stored file %s: %s', digest, e)
+
+
+def screenshot_path(screenshot):
+    """
+    Returns a local path holding a screenshot's image.
+
+    Screenshots stored before uploads were content-addressed are read from
+    their original location.
+
+    Args:
+        screenshot (Screenshot): The screenshot.
+
+    Returns:
+        str: The path.
+    """
+    if screenshot.content_hash and \
+            db.session.get(StoredFile, screenshot.content_hash):
+        return get_storage().local_path(screenshot.content_hash)
+    return os.path.join(current_app.config['UPLOAD_FOLDER'],
+                        screenshot.filename)
+
+
+def import_legacy_screenshots(screenshots):
+    """
+    Moves screenshots stored under their file name into the content store.
+
+    Args:
+        screenshots (list): Screenshot rows; those already in the store are
+                            skipped.
+
+    Returns:
+        bool: Whether any screenshot was imported. The caller commits.
+    """
+    hashes = {screenshot.content_hash for screenshot in screenshots
+              if screenshot.content_hash}
+    stored = {digest for (digest,) in db.session.query(StoredFile.digest)
+              .filter(StoredFile.digest.in_(hashes))} if hashes else set()
+    imported = False
+    for screenshot in screenshots:
+        if screenshot.content_hash in stored:
+            continue
+        legacy_path = os.path.join(current_app.config['UPLOAD_FOLDER'],
+                                   screenshot.filename)
+        if not os.path.isfile(legacy_path):
+            continue
+        with open(legacy_path, 'rb') as f:
+            screenshot.content_hash = store_file(f, screenshot.filename).digest
+        imported = True
+    return imported
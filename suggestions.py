@@ -0,0 +1,210 @@
+import logging
+import threading
+
+from flask import current_app
+
+from app import db
+from models import User, MutualConnection, FollowSuggestion, followers
+
+# Suggestions stored per user.
+SUGGESTION_LIMIT = 20
+# Stale users re-ranked per transaction by the refresher.
+REFRESH_BATCH_SIZE = 100
+# Seconds between refresher runs when nothing notifies it.
+DEFAULT_REFRESH_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+
+def rank_suggestions(user_id, limit=SUGGESTION_LIMIT):
+    """
+    Re-ranks one user's suggestions from their mutual connection counts.
+
+    Candidates the user already follows, and the user themselves, are left
+    out. The most mutual connections rank first, then the most followed
+    users. The caller commits.
+
+    Args:
+        user_id (int): The user to rank suggestions for.
+        limit (int): The number of suggestions to store.
+
+    Returns:
+        int: The number of suggestions stored.
+    """
+    # Cleared first, so a follow committed while ranking marks the user
+    # stale again instead of being overwritten.
+    db.session.execute(
+        db.update(User).where(User.id == user_id)
+        .values(suggestions_stale=False)
+        .execution_options(synchronize_session=False)
+    )
+    followed = db.select(followers.c.followed_id).where(
+        followers.c.follower_id == user_id
+    )
+    rows = db.session.execute(
+        db.select(MutualConnection.candidate_id,
+                  MutualConnection.mutual_count)
+        .join(User, User.id == MutualConnection.candidate_id)
+        .where(MutualConnection.user_id == user_id,
+               MutualConnection.candidate_id != user_id,
+               MutualConnection.candidate_id.not_in(followed))
+        .order_by(MutualConnection.mutual_count.desc(),
+                  User.followers_count.desc(), User.id)
+        .limit(limit)
+    ).all()
+    db.session.execute(db.delete(FollowSuggestion).where(
+        FollowSuggestion.user_id == user_id
+    ))
+    if rows:
+        db.session.execute(db.insert(FollowSuggestion), [
+            {'user_id': user_id, 'rank': rank, 'suggested_id': candidate_id,
+             'mutual_count': mutual_count}
+            for rank, (candidate_id, mutual_count) in enumerate(rows)
+        ])
+    return len(rows)
+
+
+def refresh_stale_suggestions(batch_size=REFRESH_BATCH_SIZE):
+    """
+    Re-ranks the suggestions of every user marked stale.
+
+    Args:
+        batch_size (int): Users re-ranked per transaction.
+
+    Returns:
+        int: The number of users re-ranked.
+    """
+    refreshed = 0
+    while True:
+        user_ids = db.session.execute(
+            db.select(User.id).where(User.suggestions_stale.is_(True))
+            .order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            return refreshed
+        for user_id in user_ids:
+            rank_suggestions(user_id)
+        db.session.commit()
+        refreshed += len(user_ids)
+
+
+def rebuild_mutual_connections():
+    """
+    Recomputes every mutual connection count from the follow table.
+
+    For existing databases, or to repair drift; follow and unfollow keep
+    the counts up to date incrementally afterwards. Every user is marked
+    for the refresher. The caller commits.
+    """
+    first = followers.alias('first')
+    second = followers.alias('second')
+    table = MutualConnection.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['user_id', 'candidate_id', 'mutual_count'],
+        db.select(first.c.follower_id, second.c.followed_id, db.func.count())
+        .select_from(first.join(
+            second, first.c.followed_id == second.c.follower_id
+        ))
+        .group_by(first.c.follower_id, second.c.followed_id)
+    ))
+    db.session.execute(
+        db.update(User).values(suggestions_stale=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def get_suggestions(user, limit=SUGGESTION_LIMIT):
+    """
+    Returns a user's stored suggestions.
+
+    Reads the rankings kept by the refresher with one primary key range
+    scan, and wakes the refresher if they are out of date.
+
+    Args:
+        user (User): The user to suggest people to.
+        limit (int): The number of suggestions to return.
+
+    Returns:
+        list: (User, mutual connection count) tuples, best first.
+    """
+    if user.suggestions_stale:
+        suggestion_refresher.notify()
+    rows = db.session.execute(
+        db.select(User, FollowSuggestion.mutual_count)
+        .join(FollowSuggestion, FollowSuggestion.suggested_id == User.id)
+        .where(FollowSuggestion.user_id == user.id)
+        .order_by(FollowSuggestion.rank)
+        .limit(limit)
+    ).all()
+    return [tuple(row) for row in rows]
+
+
+class SuggestionRefresher:
+    """
+    Re-ranks stale suggestions in a background thread.
+
+    Follows only adjust mutual connection counts and mark the affected
+    users; this thread turns the counts into stored rankings, either when
+    notified or every interval seconds, so pages never rank on the fly.
+    """
+
+    def __init__(self, interval=DEFAULT_REFRESH_INTERVAL):
+        self.interval = interval
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def init_app(self, app):
+        """Read the refresh interval from the app config."""
+        self.interval = app.config.get('SUGGESTION_REFRESH_INTERVAL') or \
+            self.interval
+        app.extensions['suggestion_refresher'] = self
+
+    def notify(self):
+        """
+        Asks for stale suggestions to be re-ranked soon.
+
+        Re-ranks them inline instead when SUGGESTIONS_EAGER is set.
+        """
+        if current_app.config.get('SUGGESTIONS_EAGER'):
+            refresh_stale_suggestions()
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(
+                    target=self._loop,
+                    args=(current_app._get_current_object(),),
+                    name='suggestion-refresher', daemon=True
+                )
+                self.thread.start()
+        self.wake.set()
+
+    def _loop(self, app):
+        """Refresh stale suggestions until shut down."""
+        while not self.stopping.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if self.stopping.is_set():
+                break
+            with app.app_context():
+                try:
+                    refresh_stale_suggestions()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Refreshing suggestions failed.')
+                finally:
+                    db.session.remove()
+
+    def shutdown(self):
+        """Stop the refresher thread."""
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+suggestion_refresher = SuggestionRefresher()
@@ -0,0 +1,221 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from app import create_app, db
+from analysis import AnalysisQueue
+from calculator import parse_screenshot_text
+from image_hash import perceptual_hash, hamming_distance, hash_chunks, \
+    MAX_HASH_DISTANCE
+from jobs import RUNNING, DONE, FAILED
+from models import User, Screenshot, ScreenshotAnalysis
+
+
+def game_screen(seed):
+    """Return an image with a blocky, screen-like layout."""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 255, (24, 12, 3), dtype=np.uint8)
+    return Image.fromarray(blocks).resize((540, 1080), Image.NEAREST)
+
+
+EXTRACTED = {
+    'type': 'troops',
+    'training_center_level': 12,
+    'troop_levels': {'Biker': 4},
+}
+
+
+class ScreenshotAnalysisCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        self.app.config['OCR_EAGER'] = True
+        self.addCleanup(shutil.rmtree, self.app.config['UPLOAD_FOLDER'])
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(username='reader')
+        self.user.set_password('password')
+        other = User(username='other')
+        other.set_password('password')
+        db.session.add_all([self.user, other])
+        db.session.commit()
+
+        filename = 'screen.png'
+        Image.new('RGB', (64, 32), color='white').save(
+            os.path.join(self.app.config['UPLOAD_FOLDER'], filename)
+        )
+        self.screenshot = Screenshot(filename=filename, user=self.user)
+        db.session.add(self.screenshot)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, client, username='reader'):
+        client.post('/auth/login', data=dict(
+            username=username, password='password'
+        ))
+
+    def test_parse_screenshot_text(self):
+        text = ('TRAINING CENTER  Lv. 17\n'
+                'Bruisers Lv.9    Mortar  Car Level 3\n'
+                'Hitman T5')
+        self.assertEqual(parse_screenshot_text(text), {
+            'type': 'troops',
+            'training_center_level': 17,
+            'troop_levels': {'Bruiser': 9, 'Hitman': 5, 'Mortar Car': 3},
+        })
+        self.assertEqual(parse_screenshot_text('Welcome back, boss'),
+                         {'type': 'unknown'})
+
+    @mock.patch('analysis.analyze_screenshot', return_value=EXTRACTED)
+    def test_result_is_stored_and_reused(self, analyze):
+        with self.app.test_client() as client:
+            self.login(client)
+            url = '/api/screenshots/{}/analysis'.format(self.screenshot.id)
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['status'], DONE)
+            self.assertEqual(response.json['result'], EXTRACTED)
+
+            client.get('/analyze_screenshot/{}'.format(self.screenshot.id))
+            response = client.post(
+                '/confirm_update/{}'.format(self.screenshot.id),
+                follow_redirects=True
+            )
+            self.assertIn(b'Your profile has been updated.', response.data)
+        self.assertEqual(analyze.call_count, 1)
+
+    @mock.patch('analysis.analyze_screenshot',
+                side_effect=RuntimeError('OCR is not available.'))
+    def test_failed_analysis_can_be_retried(self, analyze):
+        with self.app.test_client() as client:
+            self.login(client)
+            page = '/analyze_screenshot/{}'.format(self.screenshot.id)
+            response = client.get(page)
+            self.assertIn(b'OCR is not available.', response.data)
+            client.get(page)
+            self.assertEqual(analyze.call_count, 1)
+
+            response = client.post(
+                '/confirm_update/{}'.format(self.screenshot.id)
+            )
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.location.endswith(page))
+
+            analyze.side_effect = None
+            analyze.return_value = EXTRACTED
+            response = client.get(page + '?retry=1')
+            self.assertIn(b'Confirm Update', response.data)
+            self.assertEqual(analyze.call_count, 2)
+
+    def test_other_users_cannot_poll(self):
+        with self.app.test_client() as client:
+            self.login(client, 'other')
+            response = client.get(
+                '/api/screenshots/{}/analysis'.format(self.screenshot.id)
+            )
+            self.assertEqual(response.status_code, 404)
+        self.assertIsNone(self.screenshot.analysis)
+
+    def test_background_analysis(self):
+        self.app.config['OCR_EAGER'] = False
+        queue = AnalysisQueue()
+        self.addCleanup(queue.shutdown)
+        analysis = queue.submit(self.screenshot)
+        self.assertEqual(analysis.status, RUNNING)
+
+        deadline = time.time() + 60
+        while time.time() < deadline and queue.pending:
+            time.sleep(0.05)
+        db.session.expire_all()
+        analysis = db.session.get(ScreenshotAnalysis, self.screenshot.id)
+        # Without pytesseract installed the analysis fails, but either way
+        # the worker's outcome is stored against the screenshot.
+        self.assertIn(analysis.status, (DONE, FAILED))
+        self.assertEqual(analysis.status == FAILED, analysis.error is not None)
+
+    def test_lost_analysis_is_requeued(self):
+        queue = AnalysisQueue()
+        db.session.add(ScreenshotAnalysis(
+            screenshot=self.screenshot, status=RUNNING
+        ))
+        db.session.commit()
+        with mock.patch('analysis.analyze_screenshot',
+                        return_value=EXTRACTED):
+            self.assertEqual(queue.ensure(self.screenshot).status, RUNNING)
+            with mock.patch('analysis.ANALYSIS_TIMEOUT', -1):
+                self.assertEqual(queue.ensure(self.screenshot).status, DONE)
+
+    def add_screenshot(self, image, filename, user=None, **save_args):
+        image.save(os.path.join(self.app.config['UPLOAD_FOLDER'], filename),
+                   **save_args)
+        screenshot = Screenshot(filename=filename, user=user or self.user)
+        db.session.add(screenshot)
+        db.session.commit()
+        return screenshot
+
+    def test_perceptual_hash(self):
+        folder = self.app.config['UPLOAD_FOLDER']
+        screen = game_screen(1)
+        screen.save(os.path.join(folder, 'a.png'))
+        screen.resize((270, 540)).save(os.path.join(folder, 'b.jpg'),
+                                       quality=60)
+        game_screen(2).save(os.path.join(folder, 'c.png'))
+        first, resized, other = (
+            perceptual_hash(os.path.join(folder, name))
+            for name in ('a.png', 'b.jpg', 'c.png')
+        )
+        self.assertLessEqual(hamming_distance(first, resized),
+                             MAX_HASH_DISTANCE)
+        self.assertGreater(hamming_distance(first, other), 16)
+        chunks = hash_chunks(first)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(
+            sum(chunk << (16 * (3 - i)) for i, chunk in enumerate(chunks)),
+            first
+        )
+
+    @mock.patch('analysis.analyze_screenshot', return_value=EXTRACTED)
+    def test_near_duplicate_reuses_analysis(self, analyze):
+        queue = AnalysisQueue()
+        original = self.add_screenshot(game_screen(1), 'first.png')
+        queue.submit(original)
+        self.assertEqual(analyze.call_count, 1)
+
+        duplicate = self.add_screenshot(game_screen(1).resize((270, 540)),
+                                        'second.jpg', quality=60)
+        analysis = queue.submit(duplicate)
+        self.assertEqual(analyze.call_count, 1)
+        self.assertEqual(analysis.status, DONE)
+        self.assertEqual(analysis.data, EXTRACTED)
+        self.assertEqual(analysis.to_dict()['reused_from'], original.id)
+
+        # A different screen, or another user's copy, is read afresh.
+        queue.submit(self.add_screenshot(game_screen(2), 'third.png'))
+        other = User.query.filter_by(username='other').first()
+        queue.submit(self.add_screenshot(game_screen(1), 'fourth.png',
+                                         user=other))
+        self.assertEqual(analyze.call_count, 3)
+
+        # Asking again reads the reused screenshot itself.
+        analysis = queue.ensure(duplicate, retry=True)
+        self.assertEqual(analyze.call_count, 4)
+        self.assertIsNone(analysis.reused_from)
+
+
+if __name__ == '__main__':
+    unittest.main()
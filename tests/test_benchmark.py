@@ -0,0 +1,120 @@
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from app import create_app
+import benchmark
+from benchmark import compare, generate_battalion, generate_screenshot, \
+    measure, run_benchmarks, select_benchmarks
+from game_data import get_game_data
+from simulation import parse_battalion
+
+
+def run(**results):
+    """Build a run holding only the given p50 latencies."""
+    return {'scale': 'small', 'results': {
+        name: {'p50_ms': value} for name, value in results.items()
+    }}
+
+
+class BenchmarkCase(unittest.TestCase):
+    def test_measure(self):
+        calls = []
+        result = measure(lambda: calls.append(1), 0, min_iterations=7,
+                         warmup=2)
+        self.assertEqual(result['iterations'], 7)
+        self.assertEqual(len(calls), 9)
+        self.assertGreater(result['ops_per_second'], 0)
+        self.assertLessEqual(result['min_ms'], result['p50_ms'])
+        self.assertLessEqual(result['p50_ms'], result['p90_ms'])
+        self.assertLessEqual(result['p99_ms'], result['max_ms'])
+
+        result = measure(lambda: None, 60, max_iterations=50)
+        self.assertEqual(result['iterations'], 50)
+
+    def test_compare(self):
+        rows = compare(run(fast=1.0, slow=2.0, gone=1.0),
+                       run(fast=0.5, slow=2.5, new=1.0), threshold=0.2)
+        self.assertEqual([row['name'] for row in rows], ['fast', 'slow'])
+        self.assertEqual(rows[0]['change'], -0.5)
+        self.assertFalse(rows[0]['regression'])
+        self.assertAlmostEqual(rows[1]['change'], 0.25)
+        self.assertTrue(rows[1]['regression'])
+        self.assertFalse(compare(run(slow=2.0), run(slow=2.5),
+                                 threshold=0.3)[0]['regression'])
+
+    def test_select_benchmarks(self):
+        self.assertEqual(select_benchmarks(), sorted(benchmark.BENCHMARKS))
+        self.assertEqual(select_benchmarks(['simulation.batch']),
+                         ['simulation.batch'])
+        self.assertTrue(all(name.startswith('upload.')
+                            for name in select_benchmarks(['upload'])))
+        with self.assertRaises(ValueError):
+            select_benchmarks(['simulation.bat'])
+
+    def test_generated_data(self):
+        app = create_app()
+        with app.app_context():
+            game_data = get_game_data()
+            battalion = generate_battalion(random.Random(1), game_data)
+            troops, enforcers, misc_buffs = parse_battalion(battalion)
+        self.assertEqual(len(troops), sum(
+            len(tiers) for tiers in game_data['troop_stats'].values()
+        ))
+        self.assertEqual(len({enforcer['name'] for enforcer in enforcers}),
+                         len(enforcers))
+        self.assertEqual(battalion, generate_battalion(random.Random(1),
+                                                       game_data))
+
+        image = generate_screenshot((120, 260), random.Random(1))
+        self.assertTrue(image.startswith(b'\x89PNG'))
+
+    def test_run_and_compare(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        baseline_path = os.path.join(folder, 'baseline.json')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = benchmark.main([
+                'run', '--scale', 'small', '--duration', '0',
+                '--only', 'search', 'upload.store_file',
+                '--output', baseline_path,
+            ])
+        self.assertEqual(status, 0)
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        self.assertEqual(sorted(baseline['results']), [
+            'search.find_friends', 'search.users', 'upload.store_file'
+        ])
+        self.assertIn('search.users', output.getvalue())
+
+        # Make the baseline ten times faster than the run, so it regressed.
+        for result in baseline['results'].values():
+            result['p50_ms'] /= 10
+        current_path = os.path.join(folder, 'current.json')
+        shutil.copy(baseline_path, current_path)
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            status = benchmark.main(['compare', baseline_path,
+                                     current_path])
+        self.assertEqual(status, 1)
+        self.assertIn('3 of 3 benchmarks regressed', output.getvalue())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(benchmark.main(['compare', current_path,
+                                             current_path]), 0)
+
+    def test_run_benchmarks(self):
+        result = run_benchmarks(['calculator'], scale='small', duration=0)
+        self.assertEqual(list(result['results']),
+                         ['calculator.optimal_troops'])
+        self.assertEqual(result['scale'], 'small')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+from app import create_app, db
+from buff_table import compile_buff_table, get_buff_table, \
+    team_coefficients, parse_buff_name, STATS
+from game_data import get_game_data
+
+
+class BuffTableCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_parse_buff_name(self):
+        troop_types = list(get_game_data()['troop_stats'])
+        self.assertEqual(
+            parse_buff_name('Crew ATK Up', troop_types), ('Crew', 'atk')
+        )
+        self.assertEqual(
+            parse_buff_name('Mortar Car DEF Up', troop_types),
+            ('Mortar Car', 'def')
+        )
+        self.assertIsNone(parse_buff_name('March Speed Up', troop_types))
+        self.assertIsNone(
+            parse_buff_name('Crew ATK Up (when attacking)', troop_types)
+        )
+
+    def test_table_shape(self):
+        game_data = get_game_data()
+        table = compile_buff_table(game_data)
+        self.assertEqual(
+            table['enforcer_coefficients'].shape,
+            (len(game_data['enforcer_buffs']),
+             len(game_data['enforcer_tier_multipliers']),
+             len(game_data['troop_stats']), len(STATS))
+        )
+        self.assertIs(get_buff_table(game_data), get_buff_table(game_data))
+
+    def test_team_coefficients(self):
+        table = get_buff_table()
+        bruiser = table['troop_types'].index('Bruiser')
+        biker = table['troop_types'].index('Biker')
+        atk, hp = STATS.index('atk'), STATS.index('hp')
+
+        coefficients = team_coefficients([
+            {'name': 'Bubba', 'tier': 'Grand', 'has_signature_weapon': True},
+            {'name': 'Unknown', 'tier': 'Grand'},
+        ], table)
+        # Bubba: Bruiser ATK +20%, Crew HP +10%; weapon: Bruiser HP +10%,
+        # Crew HP +5%.
+        self.assertAlmostEqual(coefficients[bruiser, atk], 0.2)
+        self.assertAlmostEqual(coefficients[bruiser, hp], 0.25)
+        self.assertAlmostEqual(coefficients[biker, atk], 0)
+        self.assertAlmostEqual(coefficients[biker, hp], 0.15)
+
+        coefficients = team_coefficients(
+            [{'name': 'Bubba', 'tier': 'Elite'}], table
+        )
+        self.assertAlmostEqual(coefficients[bruiser, atk], 0.2 * 0.7)
+
+        coefficients = team_coefficients(
+            [{'name': 'Bubba', 'tier': 'Mythic',
+              'has_signature_weapon': True}], table
+        )
+        self.assertAlmostEqual(coefficients[bruiser, atk], 0)
+        self.assertAlmostEqual(coefficients[bruiser, hp], 0.15)
+
+    def test_api_buff_table(self):
+        with self.app.test_client() as client:
+            response = client.get('/api/buff_table')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Bubba', response.json['enforcers'])
+            self.assertEqual(response.json['stats'], list(STATS))
+            self.assertEqual(
+                len(response.json['enforcer_coefficients']),
+                len(response.json['enforcers'])
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+import copy
+import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import game_data as game_data_module
+from app import create_app, db
+from cache import SimulationCache, MemoryBackend, RedisBackend, \
+    simulation_cache, battalion_fingerprint, cache_key, create_backend
+from game_data import get_game_data
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Serves the subset of Redis commands the cache uses."""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(value, int):
+            self.wfile.write(b':%d\r\n' % value)
+        elif isinstance(value, list):
+            self.wfile.write(b'*%d\r\n' % len(value))
+            for item in value:
+                self.reply(item)
+        elif isinstance(value, str):
+            self.wfile.write(('+' + value + '\r\n').encode('utf-8'))
+        else:
+            self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+
+    def handle(self):
+        server = self.server
+        db_index = 0
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            server.commands.append([command] + args[1:])
+            data = server.databases.setdefault(db_index, {})
+            if command == b'SELECT':
+                db_index = int(args[1])
+                self.reply('OK')
+            elif command == b'GET':
+                self.reply(data.get(args[1]))
+            elif command == b'SET':
+                data[args[1]] = args[2]
+                self.reply('OK')
+            elif command == b'DEL':
+                self.reply(sum(
+                    1 for key in args[1:] if data.pop(key, None) is not None
+                ))
+            elif command == b'SCAN':
+                prefix = args[3].rstrip(b'*')
+                self.reply([b'0', [
+                    key for key in data if key.startswith(prefix)
+                ]])
+            else:
+                self.wfile.write(b'-ERR unknown command\r\n')
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """An in-process stand-in for a Redis server."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.databases = {}
+        self.commands = []
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'redis://127.0.0.1:{}/2'.format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SimulationCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        simulation_cache.clear()
+
+    def tearDown(self):
+        simulation_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_fingerprint_is_canonical(self):
+        first = battalion_fingerprint(
+            [
+                {'type': 'Bikers', 'tier': 'T1', 'quantity': 100},
+                {'type': 'Bruiser', 'tier': 'T2', 'quantity': 50},
+                {'type': 'Biker', 'tier': 'T1', 'quantity': 20},
+                {'type': 'Hitman', 'tier': 'T1', 'quantity': 0},
+            ],
+            [
+                {'name': 'Bubba', 'tier': 'Grand',
+                 'has_signature_weapon': True},
+                {'name': 'Captain', 'tier': 'Elite'},
+            ],
+            {'training_center_level': 12}
+        )
+        second = battalion_fingerprint(
+            [
+                {'type': 'Bruiser', 'tier': 'T2', 'quantity': 50},
+                {'type': 'Biker', 'tier': 'T1', 'quantity': 120},
+            ],
+            [
+                {'name': 'Captain', 'tier': 'Elite',
+                 'has_signature_weapon': False},
+                {'name': 'Bubba', 'tier': 'Grand',
+                 'has_signature_weapon': True},
+            ],
+            {'training_center_level': 12}
+        )
+        self.assertEqual(cache_key('simulate', first),
+                         cache_key('simulate', second))
+
+        third = battalion_fingerprint(
+            [{'type': 'Biker', 'tier': 'T1', 'quantity': 120}]
+        )
+        self.assertNotEqual(cache_key('simulate', first),
+                            cache_key('simulate', third))
+
+    def test_key_changes_with_game_data(self):
+        game_data = copy.deepcopy(get_game_data())
+        self.assertEqual(cache_key('simulate', game_data=game_data),
+                         cache_key('simulate'))
+        game_data['troop_stats']['Biker']['T1']['atk'] += 1
+        self.assertNotEqual(cache_key('simulate', game_data=game_data),
+                            cache_key('simulate'))
+
+    def test_lru_eviction(self):
+        cache = SimulationCache(MemoryBackend(max_bytes=100))
+        cache.set('a', 'x' * 20)
+        cache.set('b', 'y' * 20)
+        self.assertEqual(cache.get('a'), 'x' * 20)
+        cache.set('c', 'z' * 60)
+        # 'b' was the least recently used entry.
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'x' * 20)
+        self.assertEqual(cache.get('c'), 'z' * 60)
+        cache.set('d', 'w' * 200)
+        self.assertIsNone(cache.get('d'))
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertLessEqual(stats['size_bytes'], 100)
+
+    def test_api_simulate_is_cached(self):
+        body = {
+            'attacker': {
+                'troops': [{'type': 'Biker', 'tier': 'T1', 'quantity': 1000}],
+            },
+            'defender': {
+                'troops': [{'type': 'Bruiser', 'tier': 'T1', 'quantity': 10}],
+            },
+        }
+        with self.app.test_client() as client:
+            first = client.post('/api/simulate', json=body)
+            body['attacker']['troops'] = [
+                {'type': 'Bikers', 'tier': 'T1', 'quantity': 400},
+                {'type': 'Biker', 'tier': 'T1', 'quantity': 600},
+            ]
+            second = client.post('/api/simulate', json=body)
+            self.assertEqual(first.json, second.json)
+
+            stats = client.get('/api/cache/stats').json
+            self.assertEqual(stats['hits'], 1)
+            self.assertEqual(stats['misses'], 1)
+            self.assertEqual(stats['entries'], 1)
+
+
+class CacheBackendCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeRedisServer()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_create_backend(self):
+        self.assertIsInstance(create_backend('memory://'), MemoryBackend)
+        self.assertIsInstance(create_backend(None), MemoryBackend)
+        backend = create_backend(self.server.url, ttl=60)
+        self.assertIsInstance(backend, RedisBackend)
+        self.assertEqual(backend.db, 2)
+        self.assertEqual(backend.ttl, 60)
+
+    def test_redis_backend(self):
+        cache = SimulationCache(RedisBackend(self.server.url, ttl=60))
+        value = {'winner': 'attacker', 'rounds_fought': [1, 2]}
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', value)
+        self.assertEqual(cache.get('key'), value)
+        self.assertIn([b'SET', b'tgm-calc:key', json.dumps(value).encode(),
+                       b'EX', b'60'], self.server.commands)
+        self.assertIn(b'tgm-calc:key', self.server.databases[2])
+
+        # A second worker sees the first one's entries.
+        other = SimulationCache(RedisBackend(self.server.url))
+        self.assertEqual(other.get_or_compute('key', dict), value)
+
+        self.server.databases[2][b'unrelated'] = b'1'
+        cache.clear()
+        self.assertEqual(list(self.server.databases[2]), [b'unrelated'])
+
+        stats = cache.stats()
+        self.assertEqual(stats['backend'], 'redis')
+        self.assertEqual(stats['errors'], 0)
+
+    def test_unreachable_server_is_a_miss(self):
+        self.server.stop()
+        cache = SimulationCache(RedisBackend(self.server.url, timeout=0.1))
+        self.server = FakeRedisServer()
+        cache.set('key', 1)
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.get_or_compute('key', lambda: 5), 5)
+        self.assertGreater(cache.stats()['errors'], 0)
+
+    def test_game_data_change_invalidates(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        for filename in game_data_module.GAME_DATA_FILES.values():
+            shutil.copy(
+                os.path.join(game_data_module.GAME_DATA_FOLDER, filename),
+                folder
+            )
+        with mock.patch.object(game_data_module, 'GAME_DATA_FOLDER',
+                               folder), \
+                mock.patch.object(game_data_module,
+                                  'GAME_DATA_CHECK_INTERVAL', 0), \
+                mock.patch.object(game_data_module, '_game_data', None), \
+                mock.patch.object(game_data_module, '_game_data_signature',
+                                  None):
+            cache = SimulationCache(RedisBackend(self.server.url))
+            key = cache_key('simulate')
+            cache.set(key, 'old')
+            self.assertEqual(cache.get(cache_key('simulate')), 'old')
+
+            path = os.path.join(folder, 'troop_stats.json')
+            with open(path) as f:
+                troop_stats = json.load(f)
+            troop_stats['Biker']['T1']['atk'] += 1
+            with open(path, 'w') as f:
+                json.dump(troop_stats, f)
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns,
+                               stat.st_mtime_ns + 10 ** 9))
+
+            self.assertNotEqual(cache_key('simulate'), key)
+            self.assertIsNone(cache.get(cache_key('simulate')))
+            self.assertEqual(
+                get_game_data()['troop_stats']['Biker']['T1']['atk'],
+                troop_stats['Biker']['T1']['atk']
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from sqlalchemy import exc, text
+from sqlalchemy.pool import StaticPool
+
+from app import create_app, db
+import database
+import metrics
+from database import TimedQueuePool, engine_options
+
+
+def config(uri, **settings):
+    """Build the database settings of an app config."""
+    values = {'SQLALCHEMY_DATABASE_URI': uri, 'DB_POOL_SIZE': None,
+              'DB_MAX_OVERFLOW': None, 'DB_POOL_TIMEOUT': 30,
+              'DB_POOL_RECYCLE': 1800, 'DB_POOL_PRE_PING': True,
+              'SQLITE_BUSY_TIMEOUT': 5.0}
+    values.update(settings)
+    return values
+
+
+class EngineOptionsCase(unittest.TestCase):
+    def test_postgres(self):
+        options = engine_options(config(
+            'postgresql://tgm@db/tgm', DB_POOL_SIZE=20, DB_MAX_OVERFLOW=0
+        ))
+        self.assertEqual(options, {
+            'poolclass': TimedQueuePool, 'pool_size': 20, 'max_overflow': 0,
+            'pool_timeout': 30, 'pool_recycle': 1800, 'pool_pre_ping': True,
+        })
+
+    def test_sqlite_file(self):
+        options = engine_options(
+            config('sqlite:///users.db', SQLITE_BUSY_TIMEOUT=2.5)
+        )
+        self.assertEqual(options, {
+            'connect_args': {'timeout': 2.5}, 'poolclass': TimedQueuePool,
+            'pool_timeout': 30,
+        })
+
+    def test_sqlite_memory(self):
+        for uri in ('sqlite://', 'sqlite:///:memory:'):
+            self.assertEqual(engine_options(config(uri)),
+                             {'connect_args': {'timeout': 5.0}})
+
+    def test_explicit_options_win(self):
+        options = engine_options(config(
+            'postgresql://tgm@db/tgm', DB_POOL_SIZE=20,
+            SQLALCHEMY_ENGINE_OPTIONS={'pool_size': 3, 'echo': True}
+        ))
+        self.assertEqual(options['pool_size'], 3)
+        self.assertTrue(options['echo'])
+
+    def test_gevent_not_patched(self):
+        self.assertFalse(database.gevent_patched())
+
+
+class DatabaseCase(unittest.TestCase):
+    def create_app(self, **environ):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(folder.name,
+                                                              'test.db')
+        with mock.patch.dict(os.environ, environ):
+            app = create_app()
+        app.config['TESTING'] = True
+        app_context = app.app_context()
+        app_context.push()
+        self.addCleanup(app_context.pop)
+        self.addCleanup(db.engine.dispose)
+        db.create_all()
+        self.addCleanup(db.drop_all)
+        self.addCleanup(db.session.remove)
+        return app
+
+    def test_sqlite_settings(self):
+        self.create_app(SQLITE_BUSY_TIMEOUT='2.5')
+        self.assertIsInstance(db.engine.pool, TimedQueuePool)
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.execute(
+                text('PRAGMA journal_mode')).scalar(), 'wal')
+            self.assertEqual(connection.execute(
+                text('PRAGMA busy_timeout')).scalar(), 2500)
+
+        self.create_app(SQLITE_WAL='0')
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.execute(
+                text('PRAGMA journal_mode')).scalar(), 'delete')
+
+    def test_memory_keeps_static_pool(self):
+        with mock.patch.dict(os.environ, {'DATABASE_URL': 'sqlite://'}):
+            app = create_app()
+        with app.app_context():
+            self.assertIsInstance(db.engine.pool, StaticPool)
+
+    def test_pool_metrics(self):
+        app = self.create_app(METRICS_ENABLED='1', DB_POOL_SIZE='1',
+                              DB_MAX_OVERFLOW='0', DB_POOL_TIMEOUT='0.05')
+        self.addCleanup(setattr, metrics, 'enabled', False)
+        waits = sum(count for _, _, count in metrics.POOL_WAIT.values.values())
+        timeouts = sum(metrics.POOL_TIMEOUTS.values.values())
+
+        engine = db.engine
+        with engine.connect():
+            # The only connection is taken, so another thread times out.
+            errors = []
+
+            def connect():
+                try:
+                    engine.connect().close()
+                except exc.TimeoutError as e:
+                    errors.append(e)
+            thread = threading.Thread(target=connect)
+            thread.start()
+            thread.join()
+            self.assertEqual(len(errors), 1)
+            with app.test_client() as client:
+                text_format = client.get('/metrics').get_data(as_text=True)
+        self.assertGreater(
+            sum(count for _, _, count in metrics.POOL_WAIT.values.values()),
+            waits + 1
+        )
+        self.assertEqual(sum(metrics.POOL_TIMEOUTS.values.values()),
+                         timeouts + 1)
+        self.assertIn('db_pool_checkout_wait_seconds_count', text_format)
+        self.assertIn('db_pool_timeouts_total', text_format)
+        self.assertIn('db_pool_size 1\n', text_format)
+
+
+if __name__ == '__main__':
+    unittest.main()
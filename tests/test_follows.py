@@ -0,0 +1,139 @@
+import unittest
+
+from sqlalchemy import event
+
+from app import create_app, db
+from models import User, followers
+
+
+class FollowGraphCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SUGGESTIONS_EAGER'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.users = [User(username='user{:02d}'.format(i),
+                           password_hash='x') for i in range(30)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.me = self.users[0]
+        self.me.set_password('password')
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_queries(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute',
+                        record)
+        return statements
+
+    def test_counters(self):
+        for other in self.users[1:6]:
+            self.me.follow(other)
+            other.follow(self.me)
+        self.me.follow(self.users[1])
+        db.session.commit()
+        self.assertEqual(self.me.followed_count, 5)
+        self.assertEqual(self.me.followers_count, 5)
+        self.assertEqual(self.users[1].followers_count, 1)
+
+        self.me.unfollow(self.users[1])
+        self.me.unfollow(self.users[1])
+        db.session.commit()
+        self.assertEqual(self.me.followed_count, 4)
+        self.assertEqual(self.users[1].followers_count, 0)
+
+        db.session.execute(db.update(User).values(followers_count=99))
+        User.recount_follows()
+        db.session.commit()
+        self.assertEqual(self.me.followers_count, 5)
+        self.assertEqual(self.users[2].followers_count, 1)
+
+    def test_follow_state_is_one_query(self):
+        for other in self.users[1:30:3]:
+            self.me.follow(other)
+        db.session.commit()
+        user_ids = [user.id for user in self.users]
+        statements = self.count_queries()
+        ids = self.me.following_ids(user_ids)
+        self.assertEqual(ids, set(user_ids[1:30:3]))
+        self.assertEqual(len(statements), 1)
+
+    def test_keyset_pages(self):
+        for other in self.users[1:]:
+            other.follow(self.me)
+        db.session.commit()
+        pages = []
+        after = None
+        while True:
+            page = self.me.list_followers(after, limit=8)
+            if not page:
+                break
+            pages.append(page)
+            after = page[-1].id
+        self.assertEqual([len(page) for page in pages], [8, 8, 8, 5])
+        self.assertEqual([user for page in pages for user in page],
+                         self.users[1:])
+        self.assertEqual(self.users[5].list_followed(), [self.me])
+
+    def test_follow_table_has_composite_key(self):
+        self.assertEqual(
+            [column.name for column in followers.primary_key.columns],
+            ['follower_id', 'followed_id']
+        )
+        self.assertIn(('followed_id', 'follower_id'), [
+            tuple(column.name for column in index.columns)
+            for index in followers.indexes
+        ])
+
+    def test_user_page(self):
+        for other in self.users[1:]:
+            other.follow(self.me)
+        for other in self.users[1:4]:
+            self.me.follow(other)
+        db.session.commit()
+        with self.app.test_client() as client:
+            client.post('/auth/login', data=dict(
+                username='user00', password='password'
+            ))
+            statements = self.count_queries()
+            response = client.get('/user/user00')
+            self.assertEqual(response.status_code, 200)
+            # Loading the user, a page of followers and their follow state,
+            # however long the page.
+            self.assertLessEqual(len(statements), 4)
+            self.assertIn(b'29 followers', response.data)
+            self.assertIn(b'3 following', response.data)
+            self.assertEqual(response.data.count(b'>Unfollow</a>'), 3)
+            self.assertIn(b'after=21', response.data)
+
+            response = client.get('/user/user00?after=21')
+            self.assertIn(b'user29', response.data)
+            self.assertNotIn(b'user20<', response.data)
+
+            response = client.get('/follow/user10?next=/find_friends')
+            self.assertTrue(response.location.endswith('/find_friends'))
+            response = client.get(
+                '/unfollow/user10?next=//evil.example.com'
+            )
+            self.assertTrue(response.location.endswith('/user/user10'))
+            self.assertEqual(client.get('/user/user00?list=x').status_code,
+                             404)
+
+
+if __name__ == '__main__':
+    unittest.main()
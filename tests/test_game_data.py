@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app import create_app, db
+import game_data as game_data_module
+from game_data import get_game_data, game_data_version, validate_game_data
+
+
+class GameDataCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_bundle(self):
+        version = game_data_version()
+        with self.app.test_client() as client:
+            response = client.get('/api/game_data')
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.location.endswith(
+                '/api/game_data/{}.json'.format(version)))
+            self.assertIn('no-cache', response.headers['Cache-Control'])
+
+            response = client.get(response.location)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['version'], version)
+            self.assertEqual(response.json['data'], get_game_data())
+            self.assertEqual(response.headers['ETag'], '"{}"'.format(version))
+            self.assertIn('immutable', response.headers['Cache-Control'])
+
+            response = client.get(
+                '/api/game_data/{}.json'.format(version),
+                headers={'If-None-Match': '"{}"'.format(version)}
+            )
+            self.assertEqual(response.status_code, 304)
+
+            response = client.get('/api/game_data/0123.json')
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.location.endswith(version + '.json'))
+
+            response = client.get('/auth/login')
+            self.assertIn('content="/api/game_data/{}.json"'.format(version)
+                          .encode('utf-8'), response.data)
+
+    def test_validation(self):
+        game_data = json.loads(json.dumps(get_game_data()))
+        validate_game_data(game_data)
+        for key, change in (
+            ('troop_stats', lambda data: data['Biker']['T1'].pop('hp')),
+            ('enforcer_buffs', lambda data: data['Bubba'].pop('buffs')),
+            ('enforcer_tier_multipliers',
+             lambda data: data['Grand'].update(percentage_benefit='big')),
+            ('signature_weapon_buffs',
+             lambda data: data.update(Nobody={})),
+            ('counter_info',
+             lambda data: data['Biker'].update(strong_against='Bruiser')),
+            ('misc_buffs', lambda data: data.clear()),
+        ):
+            broken = json.loads(json.dumps(game_data))
+            change(broken[key])
+            with self.assertRaises(ValueError):
+                validate_game_data(broken)
+
+    def test_invalid_reload_keeps_previous_data(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        for filename in game_data_module.GAME_DATA_FILES.values():
+            shutil.copy(
+                os.path.join(game_data_module.GAME_DATA_FOLDER, filename),
+                folder
+            )
+        with mock.patch.object(game_data_module, 'GAME_DATA_FOLDER',
+                               folder), \
+                mock.patch.object(game_data_module,
+                                  'GAME_DATA_CHECK_INTERVAL', 0), \
+                mock.patch.object(game_data_module, '_game_data', None), \
+                mock.patch.object(game_data_module, '_game_data_signature',
+                                  None):
+            before = get_game_data()
+            path = os.path.join(folder, 'troop_stats.json')
+            with open(path, 'w') as f:
+                f.write('{"Biker": {}}')
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns,
+                               stat.st_mtime_ns + 10 ** 9))
+            with self.assertLogs('game_data', 'ERROR'):
+                self.assertIs(get_game_data(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import time
+import unittest
+
+from app import create_app, db
+from jobs import JobRunner, job_runner, DONE, CANCELLED, FAILED
+from optimizer import prepare_enforcer_search, search_enforcer_teams, \
+    enforcer_search_shards, run_enforcer_shard, score_result
+from simulation import calculate_battalion_stats
+
+
+def wait_for(runner, job_id, timeout=60):
+    """Poll a job until it finishes."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = runner.get(job_id)
+        if job['status'] != 'running':
+            return job
+        time.sleep(0.05)
+    raise AssertionError('Job {} did not finish.'.format(job_id))
+
+
+class JobRunnerCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.troops = [
+            {'type': 'Bruiser', 'tier': 'T3', 'quantity': 8000},
+            {'type': 'Biker', 'tier': 'T4', 'quantity': 3000},
+        ]
+        self.opponent_troops = [
+            {'type': 'Hitman', 'tier': 'T4', 'quantity': 6000},
+        ]
+        self.runner = JobRunner(max_workers=2)
+
+    def tearDown(self):
+        self.runner.shutdown()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_sharded_job_matches_search(self):
+        problem = prepare_enforcer_search(
+            self.troops, {},
+            calculate_battalion_stats(self.opponent_troops)
+        )
+        job_id = self.runner.submit(
+            'enforcers', run_enforcer_shard,
+            enforcer_search_shards(problem, 3), 3
+        )
+        job = wait_for(self.runner, job_id)
+        self.assertEqual(job['status'], DONE)
+        self.assertEqual(job['shards_done'], job['shards_total'])
+
+        expected = list(search_enforcer_teams(problem, 3))[-1]['teams']
+        self.assertEqual(
+            [score_result(team['simulation']) for team in job['results']],
+            [score_result(team['simulation']) for team in expected]
+        )
+
+    def test_failed_shard(self):
+        job_id = self.runner.submit('broken', int, [('x',)], 1)
+        job = wait_for(self.runner, job_id)
+        self.assertEqual(job['status'], FAILED)
+        self.assertIn('error', job)
+
+    def test_cancel(self):
+        job_id = self.runner.submit(
+            'sleep', time.sleep, [(0.2,)] * 6, 1
+        )
+        self.assertEqual(self.runner.cancel(job_id)['status'], CANCELLED)
+        self.assertEqual(self.runner.get(job_id)['status'], CANCELLED)
+        self.assertIsNone(self.runner.cancel('missing'))
+
+    def test_job_api(self):
+        with self.app.test_client() as client:
+            response = client.post('/api/jobs', json={
+                'kind': 'enforcers',
+                'params': {
+                    'user': {'troops': self.troops},
+                    'opponent': {'troops': self.opponent_troops},
+                    'top_k': 2,
+                },
+            })
+            self.assertEqual(response.status_code, 202)
+            location = response.headers['Location']
+            job_id = response.json['id']
+            self.assertTrue(location.endswith('/api/jobs/' + job_id))
+
+            deadline = time.time() + 60
+            while time.time() < deadline:
+                response = client.get(location)
+                self.assertEqual(response.status_code, 200)
+                if response.json['status'] != 'running':
+                    break
+                time.sleep(0.05)
+            self.assertEqual(response.json['status'], DONE)
+            self.assertEqual(len(response.json['results']), 2)
+
+            response = client.delete(location)
+            self.assertEqual(response.json['status'], DONE)
+
+            response = client.post('/api/jobs', json={
+                'kind': 'troop_mix',
+                'params': {
+                    'opponent': {'troops': self.opponent_troops},
+                    'march_size': 5000,
+                },
+            })
+            self.assertEqual(response.status_code, 202)
+            job = wait_for(job_runner, response.json['id'])
+            self.assertEqual(job['status'], DONE)
+            self.assertLessEqual(job['results'][0]['total_troops'], 5000)
+            scores = [result['score'] for result in job['results']]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+            response = client.post('/api/jobs', json={'kind': 'unknown'})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(client.get('/api/jobs/missing').status_code,
+                             404)
+
+
+if __name__ == '__main__':
+    unittest.main()
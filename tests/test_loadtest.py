@@ -0,0 +1,96 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from werkzeug.formparser import parse_form_data
+
+import loadtest
+from loadtest import Stats, encode_multipart, find_saturation
+
+
+def stage(concurrency, requests_per_second):
+    """Build a stage result holding only its throughput."""
+    return {'concurrency': concurrency, 'routes': {
+        'total': {'requests_per_second': requests_per_second}
+    }}
+
+
+class LoadTestCase(unittest.TestCase):
+    def test_stats(self):
+        stats = Stats(measure_from=100)
+        stats.record('GET /', 99, 5.0)
+        for latency in (0.01, 0.02, 0.03, 0.04):
+            stats.record('GET /', 101, latency)
+        stats.record('POST /profile', 101, 0.5, 'HTTP 500')
+        stats.record('POST /profile', 101, 0.1)
+        summary = stats.summary(duration=2)
+
+        route = summary['GET /']
+        self.assertEqual(route['requests'], 4)
+        self.assertEqual(route['requests_per_second'], 2)
+        self.assertEqual(route['error_rate'], 0)
+        self.assertAlmostEqual(route['p50_ms'], 25)
+        self.assertLess(route['p99_ms'], 40.1)
+        self.assertEqual(summary['POST /profile']['error_rate'], 0.5)
+        self.assertEqual(summary['POST /profile']['top_errors'],
+                         {'HTTP 500': 1})
+        self.assertEqual(summary['total']['requests'], 6)
+        self.assertEqual(summary['total']['errors'], 1)
+
+    def test_encode_multipart(self):
+        body, content_type = encode_multipart(
+            {'note': 'hello'},
+            {'screenshot': ('shot.png', 'image/png', b'\x89PNG\r\n--x')}
+        )
+        _, form, files = parse_form_data({
+            'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body),
+        })
+        self.assertEqual(form['note'], 'hello')
+        self.assertEqual(files['screenshot'].filename, 'shot.png')
+        self.assertEqual(files['screenshot'].read(), b'\x89PNG\r\n--x')
+
+    def test_find_saturation(self):
+        self.assertEqual(find_saturation(
+            [stage(1, 10), stage(4, 35), stage(16, 37), stage(64, 20)]
+        ), 16)
+        self.assertIsNone(find_saturation([stage(1, 10), stage(4, 35)]))
+        self.assertIsNone(find_saturation([stage(1, 10)]))
+
+    def test_parse_mix(self):
+        mix = loadtest._parse_mix(['register=0', 'calculators=2.5'])
+        self.assertNotIn('register', mix)
+        self.assertEqual(mix['calculators'], 2.5)
+        self.assertEqual(mix['find_friends'],
+                         loadtest.FLOWS['find_friends'][1])
+        for values in (['nope=1'], ['login=many'],
+                       [name + '=0' for name in loadtest.FLOWS]):
+            with self.assertRaises(ValueError):
+                loadtest._parse_mix(values)
+
+    def test_run(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        output_path = os.path.join(folder, 'results.json')
+        with contextlib.redirect_stdout(io.StringIO()):
+            status = loadtest.main([
+                '--users', '30', '--follows', '3', '--concurrency', '2',
+                '--duration', '1', '--warmup', '0', '--mix', 'login=0',
+                'register=0', 'profile_upload=0', '--output', output_path,
+            ])
+        self.assertEqual(status, 0)
+        with open(output_path) as f:
+            results = json.load(f)
+        routes = results['stages'][0]['routes']
+        self.assertGreater(routes['total']['requests'], 0)
+        self.assertEqual(routes['total']['errors'], 0, routes)
+        self.assertIn('POST /auth/login', routes)
+        self.assertNotIn('POST /auth/register', routes)
+
+
+if __name__ == '__main__':
+    unittest.main()
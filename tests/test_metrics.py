@@ -0,0 +1,90 @@
+import os
+import unittest
+from unittest import mock
+
+from app import create_app, db
+import metrics
+from calculator import calculate_resources
+from metrics import Registry, track
+
+
+class RegistryCase(unittest.TestCase):
+    def test_text_format(self):
+        registry = Registry()
+        counter = registry.counter('jobs', 'Jobs run.', ('kind',))
+        histogram = registry.histogram('wait_seconds', 'Time waited.',
+                                       buckets=(0.1, 1.0))
+        counter.inc(kind='a"b')
+        counter.inc(2, kind='a"b')
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(7)
+        registry.add_collector(lambda: [('ratio', 'gauge', 'A ratio.', 0.25)])
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP jobs Jobs run.',
+            '# TYPE jobs counter',
+            'jobs_total{kind="a\\"b"} 3',
+            '# HELP wait_seconds Time waited.',
+            '# TYPE wait_seconds histogram',
+            'wait_seconds_bucket{le="0.1"} 1',
+            'wait_seconds_bucket{le="1"} 2',
+            'wait_seconds_bucket{le="+Inf"} 3',
+            'wait_seconds_sum 7.55',
+            'wait_seconds_count 3',
+            '# HELP ratio A ratio.',
+            '# TYPE ratio gauge',
+            'ratio 0.25',
+        ]) + '\n')
+
+
+class MetricsEndpointCase(unittest.TestCase):
+    def create_app(self, enabled):
+        with mock.patch.dict(os.environ,
+                             {'METRICS_ENABLED': '1' if enabled else ''}):
+            app = create_app()
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.addCleanup(self.app_context.pop)
+        db.create_all()
+        self.addCleanup(db.drop_all)
+        self.addCleanup(db.session.remove)
+        return app
+
+    def test_disabled(self):
+        app = self.create_app(False)
+        self.assertFalse(metrics.enabled)
+        before = metrics.FUNCTION_DURATION.values.copy()
+        calculate_resources({'cash': 1})
+        with track('anything'):
+            pass
+        self.assertEqual(metrics.FUNCTION_DURATION.values, before)
+        with app.test_client() as client:
+            self.assertEqual(client.get('/metrics').status_code, 404)
+
+    def test_enabled(self):
+        app = self.create_app(True)
+        calculate_resources({'cash': 1})
+        with app.test_client() as client:
+            self.assertEqual(client.get('/auth/login').status_code, 200)
+            client.get('/user/nobody')
+            client.post('/api/simulate', json={})
+            response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",'
+            'endpoint="/auth/login",status="200"}', text
+        )
+        self.assertIn('http_request_db_queries_count{endpoint="/user/'
+                      '<username>"}', text)
+        self.assertIn('db_query_duration_seconds_count', text)
+        self.assertIn('function_duration_seconds_count{function='
+                      '"calculator.calculate_resources"}', text)
+        self.assertIn('simulation_cache_hit_ratio', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+import itertools
+import json
+import time
+import unittest
+
+import numpy as np
+
+from app import create_app, db
+from optimizer import default_available_enforcers, optimize_enforcer_team, \
+    prepare_enforcer_search, search_enforcer_teams, score_result, \
+    prepare_troop_mix_search, search_troop_mix, troop_mix_seeds, \
+    _mix_scores
+from simulation import calculate_battalion_stats, simulate_batch
+
+
+class EnforcerOptimizerCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.troops = [
+            {'type': 'Bruiser', 'tier': 'T3', 'quantity': 8000},
+            {'type': 'Biker', 'tier': 'T4', 'quantity': 3000},
+            {'type': 'Mortar Car', 'tier': 'T2', 'quantity': 1000},
+        ]
+        self.opponent = calculate_battalion_stats(
+            [
+                {'type': 'Hitman', 'tier': 'T4', 'quantity': 6000},
+                {'type': 'Biker', 'tier': 'T3', 'quantity': 4000},
+            ],
+            [{'name': 'Captain', 'tier': 'Grand',
+              'has_signature_weapon': True}],
+            {'training_center_level': 18}
+        )
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_matches_brute_force(self):
+        available = default_available_enforcers()
+        events = list(optimize_enforcer_team(
+            self.troops, {}, self.opponent, available, top_k=3
+        ))
+        self.assertEqual(events[-1]['event'], 'done')
+        found = [
+            score_result(team['simulation']) for team in events[-1]['teams']
+        ]
+
+        teams = list(itertools.combinations(available, 5))
+        results = simulate_batch(
+            [calculate_battalion_stats(self.troops, team) for team in teams],
+            [self.opponent]
+        )
+        expected = sorted((
+            score_result({
+                'winner': results['winner'][i, 0],
+                'attacker_hp_remaining_percentage':
+                    results['attacker_hp_remaining_percentage'][i, 0],
+                'defender_hp_remaining_percentage':
+                    results['defender_hp_remaining_percentage'][i, 0],
+            })
+            for i in range(len(teams))
+        ), reverse=True)[:3]
+
+        self.assertEqual(len(found), 3)
+        for got, want in zip(found, expected):
+            self.assertEqual(got[0], want[0])
+            self.assertAlmostEqual(got[1], want[1])
+            self.assertAlmostEqual(got[2], want[2])
+
+    def test_teams_are_unique_enforcers(self):
+        events = list(optimize_enforcer_team(
+            self.troops, {}, self.opponent, top_k=5
+        ))
+        for team in events[-1]['teams']:
+            names = [e['name'] for e in team['enforcer_team']]
+            self.assertEqual(len(names), 5)
+            self.assertEqual(len(set(names)), 5)
+
+    def test_shards_cover_the_search(self):
+        problem = prepare_enforcer_search(self.troops, {}, self.opponent)
+        best = list(search_enforcer_teams(problem, 1))[-1]['teams'][0]
+        shard_best = max((
+            team
+            for first_class in range(len(problem['members']))
+            for team in list(search_enforcer_teams(
+                problem, 1, first_class=first_class
+            ))[-1]['teams']
+        ), key=lambda team: score_result(team['simulation']))
+        self.assertEqual(
+            score_result(shard_best['simulation']),
+            score_result(best['simulation'])
+        )
+
+    def test_too_few_enforcers(self):
+        with self.assertRaises(ValueError):
+            prepare_enforcer_search(
+                self.troops, {}, self.opponent,
+                [{'name': 'Bubba', 'tier': 'Grand'}]
+            )
+
+    def test_api_optimize_enforcers(self):
+        with self.app.test_client() as client:
+            response = client.post('/api/optimize/enforcers', json={
+                'user': {'troops': self.troops},
+                'opponent': {
+                    'troops': [
+                        {'type': 'Hitman', 'tier': 'T4', 'quantity': 6000}
+                    ],
+                },
+                'top_k': 2,
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            events = [
+                json.loads(line) for line in response.data.splitlines()
+            ]
+            self.assertEqual(events[-1]['event'], 'done')
+            self.assertEqual(len(events[-1]['teams']), 2)
+
+            response = client.post('/api/optimize/enforcers', json={
+                'user': {'troops': self.troops},
+                'opponent': {'troops': self.troops},
+                'top_k': 0,
+            })
+            self.assertEqual(response.status_code, 400)
+
+
+class TroopMixOptimizerCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.opponent_troops = [
+            {'type': 'Bruiser', 'tier': 'T5', 'quantity': 200000},
+            {'type': 'Hitman', 'tier': 'T4', 'quantity': 150000},
+            {'type': 'Biker', 'tier': 'T3', 'quantity': 150000},
+        ]
+        self.opponent = calculate_battalion_stats(self.opponent_troops)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_beats_random_mixes(self):
+        problem = prepare_troop_mix_search(self.opponent, 600000)
+        start = time.time()
+        result = search_troop_mix(problem)
+        self.assertLess(time.time() - start, 1)
+        self.assertLessEqual(result['total_troops'], 600000)
+        self.assertEqual(result['simulation']['winner'], 'attacker')
+
+        weights = np.random.default_rng(0).dirichlet(
+            np.ones(len(problem['cells'])), 2000
+        )
+        mixes = np.floor(weights * 600000).astype(int)
+        self.assertGreaterEqual(
+            tuple(result['score']), max(_mix_scores(problem, mixes))
+        )
+        seeds = troop_mix_seeds(problem)
+        self.assertGreaterEqual(
+            tuple(result['score']), max(_mix_scores(problem, seeds))
+        )
+
+    def test_smallest_winning_mix(self):
+        largest = search_troop_mix(
+            prepare_troop_mix_search(self.opponent, 600000)
+        )
+        smallest = search_troop_mix(prepare_troop_mix_search(
+            self.opponent, 600000, objective='smallest'
+        ))
+        self.assertEqual(smallest['simulation']['winner'], 'attacker')
+        self.assertLessEqual(smallest['total_troops'],
+                             largest['total_troops'])
+
+    def test_inventory_caps(self):
+        inventory = [
+            {'type': 'Bruiser', 'tier': 'T3', 'quantity': 1000},
+            {'type': 'Bikers', 'tier': 'T2', 'quantity': 2000},
+            {'type': 'Tank', 'tier': 'T1', 'quantity': 5000},
+        ]
+        result = search_troop_mix(prepare_troop_mix_search(
+            self.opponent, 2500, inventory
+        ))
+        self.assertLessEqual(result['total_troops'], 2500)
+        caps = {('Bruiser', 'T3'): 1000, ('Biker', 'T2'): 2000}
+        for troop in result['recommended_mix']:
+            self.assertLessEqual(
+                troop['quantity'], caps[(troop['type'], troop['tier'])]
+            )
+
+    def test_invalid_search(self):
+        with self.assertRaises(ValueError):
+            prepare_troop_mix_search(self.opponent, 0)
+        with self.assertRaises(ValueError):
+            prepare_troop_mix_search(self.opponent, 10, objective='fastest')
+        with self.assertRaises(ValueError):
+            prepare_troop_mix_search(
+                self.opponent, 10,
+                [{'type': 'Tank', 'tier': 'T1', 'quantity': 10}]
+            )
+
+    def test_api_optimize_troops(self):
+        with self.app.test_client() as client:
+            response = client.post('/api/optimize/troops', json={
+                'opponent': {'troops': self.opponent_troops},
+                'objective': 'smallest',
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['objective'], 'smallest')
+            self.assertLessEqual(response.json['total_troops'], 500000)
+
+            response = client.post('/api/optimize/troops', json={
+                'opponent': {'troops': self.opponent_troops},
+                'march_size': -5,
+            })
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ import tempfile
 import re
 import os
 from datetime import datetime
+from unittest import mock
 from PIL import Image
 from app import create_app, db
 from models import User
@@ -17,6 +18,8 @@ class ProfilePictureCase(unittest.TestCase):
         self.app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
         self.app.config['AVATAR_FOLDER'] = tempfile.mkdtemp()
         self.app.config['THUMBNAIL_FOLDER'] = tempfile.mkdtemp()
+        self.app.config['OCR_EAGER'] = True
+        self.app.config['THUMBNAIL_EAGER'] = True
         self.app_context = self.app.app_context()
         self.app_context.push()
         db.create_all()
@@ -104,7 +107,12 @@ class ProfilePictureCase(unittest.TestCase):
             self.assertTrue(re.match(r'\d{8}_\d{6}_test.jpg', user.screenshots.first().filename))
 
 
-    def test_analyze_screenshot(self):
+    @mock.patch('analysis.analyze_screenshot', return_value={
+        'type': 'troops',
+        'training_center_level': 25,
+        'troop_levels': {'Bruiser': 10}
+    })
+    def test_analyze_screenshot(self, analyze):
         # Create a user
         u = User(username='testuser')
         u.set_password('password')
@@ -148,6 +156,9 @@ class ProfilePictureCase(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertIn(b'Your profile has been updated.', response.data)
 
+            # The screenshot was read once, on upload
+            self.assertEqual(analyze.call_count, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
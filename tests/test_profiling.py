@@ -0,0 +1,117 @@
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from app import create_app, db
+from models import User
+import profiling
+from profiling import StackSampler, list_profiles, save_profile
+
+
+class ProfilingCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['PROFILE_FOLDER'] = self.folder
+
+        def slow():
+            time.sleep(0.2)
+            return 'done'
+        self.app.add_url_rule('/slow', 'slow', slow)
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        for username, is_admin in (('admin', True), ('member', False)):
+            user = User(username=username, is_admin=is_admin)
+            user.set_password('password')
+            db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, client, username):
+        client.post('/auth/login', data=dict(
+            username=username, password='password'
+        ))
+
+    def test_admin_profiles_request(self):
+        with self.app.test_client() as client:
+            self.login(client, 'admin')
+            response = client.get('/enforcer_calculator?_profile=1')
+            self.assertEqual(response.status_code, 200)
+            profiles = list_profiles(self.folder)
+            self.assertEqual(len(profiles), 1)
+            profile = profiles[0]
+            self.assertEqual(profile['kind'], 'pstats')
+            self.assertEqual(profile['endpoint'], 'main.enforcer_calculator')
+            stats = pstats.Stats(os.path.join(self.folder, profile['file']))
+            self.assertTrue(stats.total_calls)
+
+            response = client.get('/admin/profiles/')
+            self.assertIn(b'/enforcer_calculator?_profile=1', response.data)
+            response = client.get('/admin/profiles/' + profile['file'])
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('attachment',
+                          response.headers['Content-Disposition'])
+            response.close()
+            response = client.get('/admin/profiles/' + profile['id'] +
+                                  '.json')
+            self.assertEqual(response.status_code, 404)
+
+    def test_members_cannot_profile(self):
+        with self.app.test_client() as client:
+            self.login(client, 'member')
+            client.get('/enforcer_calculator?_profile=1')
+            self.assertEqual(list_profiles(self.folder), [])
+            self.assertEqual(client.get('/admin/profiles/').status_code, 403)
+
+    def test_slow_requests_are_sampled(self):
+        self.app.config['PROFILE_SLOW_THRESHOLD'] = 0.1
+        with self.app.test_client() as client:
+            self.assertEqual(client.get('/enforcer_calculator').status_code,
+                             200)
+            self.assertEqual(list_profiles(self.folder), [])
+            client.get('/slow')
+        profiles = list_profiles(self.folder)
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0]['kind'], 'collapsed')
+        self.assertGreater(profiles[0]['samples'], 0)
+        with open(os.path.join(self.folder, profiles[0]['file'])) as f:
+            lines = f.read().splitlines()
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertIn('slow (test_profiling.py:', stack)
+        self.assertGreater(int(count), 0)
+        self.assertEqual(profiling.sampler.stacks, {})
+
+    def test_storage_is_bounded(self):
+        with mock.patch.object(profiling, 'MAX_STORED_PROFILES', 2):
+            for i in range(3):
+                save_profile('collapsed', lambda path: open(path, 'w').close(),
+                             i, folder=self.folder, path=str(i))
+                time.sleep(0.01)
+        profiles = list_profiles(self.folder)
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(len(os.listdir(self.folder)), 4)
+
+    def test_sampler_is_bounded(self):
+        sampler = StackSampler(max_requests=1)
+        self.assertIsNotNone(sampler.start())
+        self.assertIsNone(sampler.start())
+        sampler.stop()
+        self.assertEqual(sampler.stacks, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import io
+import unittest
+from unittest import mock
+
+from app import create_app, db
+from models import User, UserTroop, UserEnforcer
+import roster
+
+TROOPS = (('Bruiser', 'T1'), ('Hitman', 'T3'), ('Biker', 'T5'),
+          ('Mortar Car', 'T2'))
+
+
+class RosterCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(username='leader', is_admin=True)
+        self.admin.set_password('password')
+        db.session.add(self.admin)
+        db.session.add_all(
+            User(username='member{:03d}'.format(i), password_hash='x')
+            for i in range(150)
+        )
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def client(self, username='leader'):
+        client = self.app.test_client()
+        if username != 'leader':
+            user = User.query.filter_by(username=username).first()
+            user.set_password('password')
+            db.session.commit()
+        client.post('/auth/login', data=dict(
+            username=username, password='password'
+        ))
+        return client
+
+    def troop_csv(self):
+        lines = ['username,type,tier,quantity']
+        for i in range(150):
+            for j, (troop_type, tier) in enumerate(TROOPS):
+                lines.append('member{:03d},{},{},{}'.format(
+                    i, troop_type, tier, 1000 * i + j + 1))
+        return '\n'.join(lines) + '\n'
+
+    def test_admins_only(self):
+        client = self.client('member001')
+        self.assertEqual(client.get('/api/roster/troops').status_code, 403)
+        self.assertEqual(client.post('/api/roster/troops').status_code, 403)
+
+    def test_csv_round_trip(self):
+        client = self.client()
+        self.assertEqual(client.get('/api/roster/horses').status_code, 404)
+        response = client.get('/api/roster/troops?format=xml')
+        self.assertEqual(response.status_code, 400)
+        body = self.troop_csv()
+        response = client.post('/api/roster/troops', data=body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'users': 150, 'rows': 600})
+        self.assertEqual(UserTroop.query.count(), 600)
+
+        response = client.get('/api/roster/troops')
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(response.get_data(as_text=True), body)
+
+        # Importing again replaces rather than adds.
+        client.post('/api/roster/troops', data=body)
+        self.assertEqual(UserTroop.query.count(), 600)
+
+    def test_packed_round_trip(self):
+        client = self.client()
+        client.post('/api/roster/troops', data=self.troop_csv())
+        with mock.patch.object(roster, 'ROW_GROUP_SIZE', 64):
+            packed = client.get('/api/roster/troops?format=packed')
+        self.assertEqual(packed.mimetype, 'application/octet-stream')
+        self.assertTrue(packed.data.startswith(roster.PACKED_MAGIC))
+        self.assertLess(len(packed.data), len(self.troop_csv()))
+
+        db.session.execute(db.delete(UserTroop))
+        db.session.commit()
+        response = client.post('/api/roster/troops?format=packed',
+                               data=packed.data)
+        self.assertEqual(response.json, {'users': 150, 'rows': 600})
+        self.assertEqual(client.get('/api/roster/troops').get_data(
+            as_text=True), self.troop_csv())
+
+    def test_enforcers(self):
+        client = self.client()
+        body = ('username,name,tier,has_signature_weapon\n'
+                'member001,Bubba,Grand,true\n'
+                'member001,red thorn,elite,0\n'
+                'member002,Captain,Rare,false\n')
+        response = client.post('/api/roster/enforcers', data=body)
+        self.assertEqual(response.json, {'users': 2, 'rows': 3})
+        rows = list(roster.read_packed(io.BytesIO(client.get(
+            '/api/roster/enforcers?format=packed').data), 'enforcers'))
+        self.assertEqual(rows, [
+            ('member001', 'Bubba', 'Grand', True),
+            ('member001', 'Red Thorn', 'Elite', False),
+            ('member002', 'Captain', 'Rare', False),
+        ])
+        with self.assertRaises(ValueError):
+            list(roster.read_packed(io.BytesIO(client.get(
+                '/api/roster/enforcers?format=packed').data), 'troops'))
+
+    def test_errors_import_nothing(self):
+        client = self.client()
+        client.post('/api/roster/enforcers', data=(
+            'username,name,tier,has_signature_weapon\n'
+            'member001,Bubba,Grand,true\n'
+        ))
+        for body, error in (
+            ('username,name\nmember001,Bubba\n', 'header'),
+            ('username,name,tier,has_signature_weapon\n'
+             'member002,Captain,Rare,false\n'
+             'member001,Captain,Rare,false\n'
+             'nobody,Captain,Rare,false\n', 'Row 3: Unknown user'),
+            ('username,name,tier,has_signature_weapon\n'
+             'member001,Captain,Rare,false\n'
+             'member001,Captain,Grand,false\n', 'listed twice'),
+            ('username,name,tier,has_signature_weapon\n'
+             'member001,Captain,Rare,perhaps\n', 'Line 2'),
+        ):
+            response = client.post('/api/roster/enforcers', data=body)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, response.json['error'])
+        member = User.query.filter_by(username='member001').first()
+        self.assertEqual(
+            [(enforcer.user_id, enforcer.name)
+             for enforcer in UserEnforcer.query],
+            [(member.id, 'Bubba')]
+        )
+
+        response = client.post('/api/roster/troops?format=packed',
+                               data=b'TGMR\x01\x00\x05\x00')
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from PIL import Image, ImageDraw, ImageStat
+
+from calculator import analyze_screenshot, OCR_CONFIG, OCR_NUMBER_CONFIG
+from screen_layouts import get_screen_layouts, validate_layouts, pixel_box, \
+    classify_screen
+
+
+class FakeReader:
+    """Reads the text painted into a region as its grey level."""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, image, config):
+        shade = round(ImageStat.Stat(image).mean[0])
+        with self.lock:
+            self.calls.append((shade, config))
+        return self.texts.get(shade, '')
+
+
+class ScreenLayoutCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.layouts = get_screen_layouts()
+
+    def paint_screen(self, screen_type, shades):
+        """Save a screenshot with each of a layout's boxes filled in."""
+        image = Image.new('L', (540, 1080), color=20)
+        draw = ImageDraw.Draw(image)
+        layout = self.layouts[screen_type]
+        boxes = [('title', layout['title']['box'])] + [
+            (name, region['box'])
+            for name, region in layout['regions'].items()
+        ]
+        for name, box in boxes:
+            left, top, right, bottom = pixel_box(tuple(box), image.size)
+            draw.rectangle((left, top, right - 1, bottom - 1),
+                           fill=shades[name])
+        path = os.path.join(self.folder, screen_type + '.png')
+        image.save(path)
+        return path
+
+    def test_bundled_layouts_are_valid(self):
+        self.assertEqual(set(self.layouts),
+                         {'troops', 'training_center', 'enforcers'})
+        validate_layouts(self.layouts)
+        with self.assertRaises(ValueError):
+            validate_layouts({'troops': {
+                'version': 1,
+                'title': {'box': [0.5, 0, 0.4, 1], 'keywords': ['TROOPS']},
+            }})
+
+    def test_classify_screen(self):
+        box = tuple(self.layouts['troops']['title']['box'])
+        self.assertEqual(
+            classify_screen({box: 'Training  Center'}, self.layouts),
+            'training_center'
+        )
+        self.assertEqual(classify_screen({box: 'ARMY'}, self.layouts),
+                         'troops')
+        self.assertIsNone(classify_screen({box: 'Shop'}, self.layouts))
+
+    def test_troop_screen_regions(self):
+        path = self.paint_screen('troops', {
+            'title': 130, 'Bruiser': 140, 'Hitman': 150, 'Biker': 160,
+            'Mortar Car': 170,
+        })
+        reader = FakeReader({130: 'TROOPS', 140: '12', 150: '9\n',
+                             160: 'Lv 7', 170: ''})
+        self.assertEqual(analyze_screenshot(path, reader), {
+            'type': 'troops',
+            'troop_levels': {'Bruiser': 12, 'Hitman': 9, 'Biker': 7},
+        })
+        # One title read, then one read per region; no full-page OCR.
+        self.assertEqual(len(reader.calls), 5)
+        self.assertEqual(
+            [config for shade, config in reader.calls if shade != 130],
+            [OCR_NUMBER_CONFIG] * 4
+        )
+
+    def test_training_center_screen(self):
+        path = self.paint_screen('training_center',
+                                 {'title': 130, 'level': 200})
+        reader = FakeReader({130: 'Training Center', 200: '25'})
+        self.assertEqual(analyze_screenshot(path, reader), {
+            'type': 'training_center',
+            'training_center_level': 25,
+        })
+
+    def test_unknown_screen_reads_whole_page(self):
+        path = self.paint_screen('troops', {
+            'title': 130, 'Bruiser': 140, 'Hitman': 150, 'Biker': 160,
+            'Mortar Car': 170,
+        })
+        reader = FakeReader({130: 'Alliance'})
+        self.assertEqual(analyze_screenshot(path, reader),
+                         {'type': 'unknown'})
+        self.assertEqual(reader.calls[-1][1], OCR_CONFIG)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+from sqlalchemy import text
+
+from app import create_app, db
+from models import User
+import search as search_module
+from search import search_users
+
+
+class UserSearchCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        for username in ('Bubba', 'bubbagump', 'big_bubba', 'BubbaJr',
+                         'Sal', 'salvatore', 'vito', '100%boss'):
+            user = User(username=username)
+            user.set_password('password')
+            db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def names(self, *args, **kwargs):
+        users, _ = search_users(*args, **kwargs)
+        return [user.username for user in users]
+
+    def test_ranking(self):
+        # Exact match, then prefixes, then other matches, shortest first.
+        self.assertEqual(self.names('bubba'),
+                         ['Bubba', 'BubbaJr', 'bubbagump', 'big_bubba'])
+        self.assertEqual(self.names('vator'), ['salvatore'])
+        self.assertEqual(self.names('0%b'), ['100%boss'])
+        self.assertEqual(self.names('zzz'), [])
+        self.assertEqual(self.names('  '), [])
+
+    def test_short_queries_match_prefixes(self):
+        self.assertEqual(self.names('Sa'), ['Sal', 'salvatore'])
+        self.assertEqual(self.names('v'), ['vito'])
+
+    def test_keyset_pagination(self):
+        seen = []
+        cursor = None
+        while True:
+            users, cursor = search_users('bubba', limit=1, after=cursor)
+            seen.extend(user.username for user in users)
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.names('bubba'))
+        with self.assertRaises(ValueError):
+            search_users('bubba', after='not-a-cursor')
+
+    def test_index_follows_updates(self):
+        user = User.query.filter_by(username='vito').first()
+        user.username = 'corleone'
+        db.session.commit()
+        self.assertEqual(self.names('vito'), [])
+        self.assertEqual(self.names('leon'), ['corleone'])
+        db.session.delete(user)
+        db.session.commit()
+        self.assertEqual(self.names('leon'), [])
+
+    def test_existing_database_is_indexed(self):
+        db.session.execute(text('DROP TABLE user_search'))
+        db.session.commit()
+        search_module._indexed_engines.clear()
+        self.assertEqual(self.names('gump'), ['bubbagump'])
+
+    def test_typeahead_endpoint(self):
+        with self.app.test_client() as client:
+            client.post('/auth/login', data=dict(
+                username='Bubba', password='password'
+            ))
+            response = client.get('/api/users/search?q=bubba&limit=2')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [user['username'] for user in response.json['users']],
+                ['BubbaJr', 'bubbagump']
+            )
+            response = client.get('/api/users/search', query_string={
+                'q': 'bubba', 'limit': 2, 'after': response.json['next'],
+            })
+            self.assertEqual(
+                [user['username'] for user in response.json['users']],
+                ['big_bubba']
+            )
+            self.assertIsNone(response.json['next'])
+            self.assertEqual(
+                client.get('/api/users/search?q=bubba&after=x').status_code,
+                400
+            )
+
+            response = client.get('/find_friends?q=bubba')
+            self.assertIn(b'/user/bubbagump', response.data)
+            self.assertNotIn(b'<li><a href="/user/Bubba">', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
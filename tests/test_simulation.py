@@ -0,0 +1,223 @@
+import unittest
+
+import numpy as np
+
+from app import create_app, db
+from simulation import calculate_battalion_stats, simulate_battle, \
+    simulate_batch, step_batch, resolve_batch, get_counter_modifier, \
+    COUNTER_STRONG_MOD, COUNTER_WEAK_MOD, MAX_BATCH_BATTALIONS
+from game_data import get_game_data
+
+
+class SimulationCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_counter_modifier(self):
+        counter_info = get_game_data()['counter_info']
+        self.assertEqual(
+            get_counter_modifier('Bikers', 'Bruiser', counter_info),
+            COUNTER_STRONG_MOD
+        )
+        self.assertEqual(
+            get_counter_modifier('Biker', 'Hitman', counter_info),
+            COUNTER_WEAK_MOD
+        )
+        self.assertEqual(
+            get_counter_modifier('Biker', 'Biker', counter_info), 0
+        )
+
+    def test_battalion_stats(self):
+        troops = [{'type': 'Bruiser', 'tier': 'T1', 'quantity': 1000}]
+        enforcers = [
+            {'name': 'Bubba', 'tier': 'Grand', 'has_signature_weapon': True}
+        ]
+        stats = calculate_battalion_stats(
+            troops, enforcers, {'training_center_level': 12}
+        )
+        # Bubba: Bruiser ATK +20%, Crew HP +10%; weapon: Bruiser HP +10%,
+        # Crew HP +5%; Training Center 12: DEF +12%.
+        self.assertAlmostEqual(stats['total_atk'], 10000 * 1.2)
+        self.assertAlmostEqual(stats['total_def'], 15000 * 1.12)
+        self.assertAlmostEqual(stats['total_hp'], 20000 * 1.25)
+
+    def test_unknown_troops_are_skipped(self):
+        stats = calculate_battalion_stats(
+            [{'type': 'Tank', 'tier': 'T1', 'quantity': 10}]
+        )
+        self.assertEqual(stats['total_hp'], 0)
+        self.assertEqual(len(stats['types']), 0)
+
+    def test_simulate_battle(self):
+        attacker = calculate_battalion_stats(
+            [{'type': 'Biker', 'tier': 'T1', 'quantity': 1000}]
+        )
+        defender = calculate_battalion_stats(
+            [{'type': 'Bruiser', 'tier': 'T1', 'quantity': 1000}]
+        )
+        # Bikers deal 20000 * 1.5 per round to 20000 Bruiser HP, Bruisers
+        # deal 10000 * 0.67 to 10000 Biker HP.
+        result = simulate_battle(attacker, defender)
+        self.assertEqual(result['winner'], 'attacker')
+        self.assertEqual(result['rounds_fought'], 1)
+        self.assertAlmostEqual(
+            result['attacker_hp_remaining_percentage'],
+            (10000 - 6700) / 10000 * 100
+        )
+        self.assertEqual(result['defender_hp_remaining_percentage'], 0)
+
+    def test_simulate_max_rounds(self):
+        troops = [{'type': 'Hitman', 'tier': 'T1', 'quantity': 1000}]
+        attacker = calculate_battalion_stats(troops)
+        defender = calculate_battalion_stats(troops)
+        result = simulate_battle(attacker, defender, max_rounds=0)
+        self.assertEqual(result['winner'], 'draw')
+        self.assertEqual(result['rounds_fought'], 0)
+
+    def test_simulate_batch_matches_single_battles(self):
+        attackers = [
+            calculate_battalion_stats([
+                {'type': 'Biker', 'tier': 'T3', 'quantity': 1000},
+                {'type': 'Hitman', 'tier': 'T1', 'quantity': 200},
+            ]),
+            calculate_battalion_stats(
+                [{'type': 'Hitman', 'tier': 'T2', 'quantity': 500}]
+            ),
+        ]
+        defenders = [
+            calculate_battalion_stats(
+                [{'type': 'Bruiser', 'tier': 'T2', 'quantity': 1500}]
+            ),
+            calculate_battalion_stats([
+                {'type': 'Biker', 'tier': 'T1', 'quantity': 300},
+                {'type': 'Mortar Car', 'tier': 'T4', 'quantity': 300},
+                {'type': 'Hitman', 'tier': 'T5', 'quantity': 10},
+            ]),
+            calculate_battalion_stats([]),
+        ]
+        results = simulate_batch(attackers, defenders)
+        self.assertEqual(results['winner'].shape, (2, 3))
+        for i, attacker in enumerate(attackers):
+            for j, defender in enumerate(defenders):
+                single = simulate_battle(attacker, defender)
+                self.assertEqual(results['winner'][i, j], single['winner'])
+                self.assertEqual(
+                    results['rounds_fought'][i, j], single['rounds_fought']
+                )
+                self.assertAlmostEqual(
+                    results['attacker_hp_remaining_percentage'][i, j],
+                    single['attacker_hp_remaining_percentage']
+                )
+        self.assertEqual(results['rounds_fought'][0, 2], 0)
+
+    def assertResultsClose(self, fast, stepped):
+        np.testing.assert_array_equal(fast['winner'], stepped['winner'])
+        np.testing.assert_array_equal(
+            fast['rounds_fought'], stepped['rounds_fought']
+        )
+        for key in ('attacker_hp_remaining_percentage',
+                    'defender_hp_remaining_percentage'):
+            np.testing.assert_allclose(fast[key], stepped[key], atol=1e-6)
+
+    def test_closed_form_matches_stepping(self):
+        rng = np.random.default_rng(7)
+        troop_types = list(get_game_data()['troop_stats'])
+
+        def random_battalion():
+            return calculate_battalion_stats([
+                {'type': troop_type,
+                 'tier': 'T{}'.format(rng.integers(1, 6)),
+                 'quantity': int(rng.integers(0, 50000))}
+                for troop_type in troop_types if rng.random() < 0.6
+            ], [{'name': 'Bubba', 'tier': 'Grand'}] if rng.random() < 0.5
+                else [])
+
+        attackers = [random_battalion() for _ in range(40)]
+        defenders = [random_battalion() for _ in range(40)]
+        for max_rounds in (100, 2, 1, 0):
+            stepped = step_batch(attackers, defenders, max_rounds)
+            fast, _ = resolve_batch(attackers, defenders, max_rounds)
+            self.assertResultsClose(fast, stepped)
+            self.assertResultsClose(
+                simulate_batch(attackers, defenders, max_rounds), stepped
+            )
+
+    def test_closed_form_falls_back_on_round_boundaries(self):
+        # 2000 Bruiser T1 HP against 1000 Bruiser ATK per round: the
+        # closed form says exactly 2 rounds, which is left to stepping.
+        bruisers = calculate_battalion_stats(
+            [{'type': 'Bruiser', 'tier': 'T1', 'quantity': 100}]
+        )
+        _, inexact = resolve_batch([bruisers], [bruisers])
+        self.assertTrue(inexact[0, 0])
+        result = simulate_battle(bruisers, bruisers)
+        self.assertEqual(result['winner'], 'draw')
+        self.assertEqual(result['rounds_fought'], 2)
+
+    def test_api_simulate_batch(self):
+        bikers = {'troops': [{'type': 'Biker', 'tier': 'T1', 'quantity': 10}]}
+        bruisers = {
+            'troops': [{'type': 'Bruiser', 'tier': 'T1', 'quantity': 10}]
+        }
+        with self.app.test_client() as client:
+            response = client.post('/api/simulate/batch', json={
+                'attackers': [bikers, bruisers],
+                'defenders': [bruisers],
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.json['winner'], [['attacker'], ['draw']]
+            )
+            self.assertEqual(len(response.json['rounds_fought']), 2)
+
+            response = client.post('/api/simulate/batch', json={
+                'attackers': [bikers],
+                'defenders': [bikers] * (MAX_BATCH_BATTALIONS + 1),
+            })
+            self.assertEqual(response.status_code, 400)
+
+    def test_api_simulate(self):
+        with self.app.test_client() as client:
+            response = client.post('/api/simulate', json={
+                'attacker': {
+                    'troops': [
+                        {'type': 'Biker', 'tier': 'T1', 'quantity': 1000}
+                    ],
+                },
+                'defender': {
+                    'troops': [
+                        {'type': 'Bruiser', 'tier': 'T1', 'quantity': 1000}
+                    ],
+                    'enforcers': [{
+                        'name': 'Bubba', 'tier': 'Grand',
+                        'has_signature_weapon': False
+                    }],
+                    'misc_buffs': {'training_center_level': 6},
+                },
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['winner'], 'attacker')
+            self.assertEqual(
+                response.json['attacker_stats']['total_hp'], 10000
+            )
+
+            response = client.post('/api/simulate', json={
+                'attacker': {'troops': []},
+                'defender': {'troops': []},
+            })
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json)
+
+
+if __name__ == '__main__':
+    unittest.main()
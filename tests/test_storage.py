@@ -0,0 +1,238 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from app import create_app, db
+from models import User, Screenshot, StoredFile
+from storage import LocalStorage, S3Storage, create_storage, get_storage, \
+    store_file, release_file, import_legacy_screenshots
+import storage as storage_module
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    """Serves the object requests the S3 storage makes."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def check(self):
+        server = self.server
+        server.requests.append((self.command, self.path))
+        if not self.headers.get('Authorization', '').startswith(
+                'AWS4-HMAC-SHA256 Credential=key/'):
+            self.send_response(403)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return False
+        return True
+
+    def reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        if self.check():
+            self.reply(200 if self.path in self.server.objects else 404)
+
+    def do_GET(self):
+        if self.check():
+            body = self.server.objects.get(self.path)
+            self.reply(404) if body is None else self.reply(200, body)
+
+    def do_PUT(self):
+        if self.check():
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            if hashlib.sha256(body).hexdigest() != \
+                    self.headers['x-amz-content-sha256']:
+                self.reply(400)
+                return
+            self.server.objects[self.path] = body
+            self.reply(200)
+
+    def do_DELETE(self):
+        if self.check():
+            self.server.objects.pop(self.path, None)
+            self.reply(204)
+
+
+class FakeS3Server(ThreadingHTTPServer):
+    """An in-process stand-in for an S3-compatible server."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeS3Handler)
+        self.objects = {}
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 's3://key:secret@127.0.0.1:{}/bucket/uploads?secure=0'.format(
+            self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StorageCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_local_storage_deduplicates(self):
+        storage = LocalStorage(self.folder)
+        data = os.urandom(3 * storage_module.CHUNK_SIZE + 17)
+        digest, size = storage.save(io.BytesIO(data))
+        self.assertEqual(digest, hashlib.sha256(data).hexdigest())
+        self.assertEqual(size, len(data))
+        self.assertEqual(storage.save(io.BytesIO(data)), (digest, size))
+        with open(storage.local_path(digest), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        # No temporary files are left behind.
+        self.assertEqual(os.listdir(os.path.join(self.folder, '.tmp')), [])
+        storage.delete(digest)
+        self.assertFalse(storage.exists(digest))
+
+    def test_s3_storage(self):
+        server = FakeS3Server()
+        self.addCleanup(server.stop)
+        storage = create_storage(server.url, self.folder)
+        self.assertIsInstance(storage, S3Storage)
+        self.assertEqual((storage.bucket, storage.prefix),
+                         ('bucket', 'uploads/'))
+
+        data = b'screenshot' * 1000
+        digest, size = storage.save(io.BytesIO(data))
+        path = '/bucket/uploads/' + digest
+        self.assertEqual(server.objects[path], data)
+        storage.save(io.BytesIO(data))
+        self.assertEqual(
+            [method for method, _ in server.requests],
+            ['HEAD', 'PUT', 'HEAD']
+        )
+
+        # Local copies are downloaded and checked against the digest.
+        storage.cache.delete(digest)
+        with open(storage.local_path(digest), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        storage.delete(digest)
+        self.assertNotIn(path, server.objects)
+        self.assertFalse(storage.exists(digest))
+        with self.assertRaises(FileNotFoundError):
+            storage.local_path(digest)
+
+
+class UploadStorageCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        self.app.config['THUMBNAIL_FOLDER'] = tempfile.mkdtemp()
+        self.app.config['OCR_EAGER'] = True
+        self.app.config['THUMBNAIL_EAGER'] = True
+        for key in ('UPLOAD_FOLDER', 'THUMBNAIL_FOLDER'):
+            self.addCleanup(shutil.rmtree, self.app.config[key])
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(username='uploader')
+        self.user.set_password('password')
+        db.session.add(self.user)
+        db.session.commit()
+
+        image = io.BytesIO()
+        Image.new('RGB', (40, 30), color='red').save(image, 'PNG')
+        self.image = image.getvalue()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def upload(self, client, field):
+        return client.post('/profile', data={
+            field: (io.BytesIO(self.image), 'shot.png'),
+        }, content_type='multipart/form-data')
+
+    def test_duplicate_screenshots_are_stored_once(self):
+        with self.app.test_client() as client:
+            client.post('/auth/login', data=dict(
+                username='uploader', password='password'
+            ))
+            self.upload(client, 'screenshot')
+            self.upload(client, 'screenshot')
+
+            screenshots = self.user.screenshots.all()
+            self.assertEqual(len(screenshots), 2)
+            digest = screenshots[0].content_hash
+            self.assertEqual(screenshots[1].content_hash, digest)
+            stored = db.session.get(StoredFile, digest)
+            self.assertEqual(stored.ref_count, 2)
+            self.assertEqual(stored.content_type, 'image/png')
+
+            response = client.get('/media/{}/{}'.format(
+                digest, screenshots[0].filename
+            ))
+            self.assertEqual(response.data, self.image)
+            self.assertEqual(response.mimetype, 'image/png')
+            self.assertIn('immutable', response.headers['Cache-Control'])
+
+    def test_avatar_reference_is_released(self):
+        with self.app.test_client() as client:
+            client.post('/auth/login', data=dict(
+                username='uploader', password='password'
+            ))
+            self.upload(client, 'avatar')
+            first = self.user.avatar_hash
+            self.assertTrue(get_storage().exists(first))
+
+            self.image = self.image + b'\0'
+            self.upload(client, 'avatar')
+            self.assertNotEqual(self.user.avatar_hash, first)
+            self.assertIsNone(db.session.get(StoredFile, first))
+            self.assertFalse(get_storage().exists(first))
+
+    def test_release_keeps_shared_files(self):
+        stored = store_file(io.BytesIO(b'data'), 'a.png')
+        store_file(io.BytesIO(b'data'), 'b.png')
+        db.session.commit()
+        release_file(stored.digest)
+        db.session.commit()
+        self.assertEqual(db.session.get(StoredFile, stored.digest).ref_count,
+                         1)
+        self.assertTrue(get_storage().exists(stored.digest))
+
+    def test_import_legacy_screenshots(self):
+        with open(os.path.join(self.app.config['UPLOAD_FOLDER'],
+                               'old.png'), 'wb') as f:
+            f.write(self.image)
+        screenshot = Screenshot(filename='old.png', user=self.user)
+        db.session.add(screenshot)
+        db.session.commit()
+        self.assertTrue(import_legacy_screenshots([screenshot]))
+        db.session.commit()
+        self.assertEqual(screenshot.content_hash,
+                         hashlib.sha256(self.image).hexdigest())
+        self.assertFalse(import_legacy_screenshots([screenshot]))
+
+
+if __name__ == '__main__':
+    unittest.main()
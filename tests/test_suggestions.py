@@ -0,0 +1,153 @@
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from app import create_app, db
+from models import User, MutualConnection, FollowSuggestion
+from suggestions import get_suggestions, rank_suggestions, \
+    rebuild_mutual_connections, refresh_stale_suggestions, \
+    suggestion_refresher
+
+
+class SuggestionsCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SUGGESTIONS_EAGER'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.users = {name: User(username=name, password_hash='x')
+                      for name in ('ann', 'bob', 'cat', 'dan', 'eve')}
+        db.session.add_all(self.users.values())
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def follow(self, follower, followed):
+        self.users[follower].follow(self.users[followed])
+        db.session.commit()
+
+    def mutual_counts(self):
+        return {(row.user_id, row.candidate_id): row.mutual_count
+                for row in MutualConnection.query}
+
+    def test_incremental_counts_match_rebuild(self):
+        users = list(self.users.values())
+        rng = random.Random(7)
+        for _ in range(200):
+            follower, followed = rng.sample(users, 2)
+            if rng.random() < 0.6:
+                follower.follow(followed)
+            else:
+                follower.unfollow(followed)
+            db.session.commit()
+        counts = self.mutual_counts()
+        self.assertTrue(counts)
+        self.assertTrue(all(count > 0 for count in counts.values()))
+        rebuild_mutual_connections()
+        db.session.commit()
+        self.assertEqual(self.mutual_counts(), counts)
+
+    def test_rankings(self):
+        self.follow('ann', 'bob')
+        self.follow('ann', 'cat')
+        self.follow('bob', 'dan')
+        self.follow('cat', 'dan')
+        self.follow('cat', 'eve')
+        self.follow('bob', 'ann')
+        self.follow('eve', 'bob')
+        ann = self.users['ann']
+        self.assertTrue(ann.suggestions_stale)
+        refresh_stale_suggestions()
+
+        suggestions = get_suggestions(ann)
+        self.assertEqual(
+            [(user.username, count) for user, count in suggestions],
+            [('dan', 2), ('eve', 1)]
+        )
+        db.session.refresh(ann)
+        self.assertFalse(ann.suggestions_stale)
+
+        # Following a suggestion removes it; unfollowing brings it back.
+        self.follow('ann', 'dan')
+        refresh_stale_suggestions()
+        self.assertEqual([user.username for user, _ in get_suggestions(ann)],
+                         ['eve'])
+        # Through bob, ann now only reaches herself and dan, whom she
+        # follows.
+        ann.unfollow(self.users['cat'])
+        db.session.commit()
+        rank_suggestions(ann.id)
+        db.session.commit()
+        self.assertEqual(get_suggestions(ann), [])
+        self.assertEqual(FollowSuggestion.query.filter_by(
+            user_id=ann.id, suggested_id=ann.id).count(), 0)
+
+    def test_find_friends_page(self):
+        ann = self.users['ann']
+        ann.set_password('password')
+        db.session.commit()
+        self.follow('bob', 'dan')
+        with self.app.test_client() as client:
+            client.post('/auth/login', data=dict(
+                username='ann', password='password'
+            ))
+            response = client.get('/find_friends')
+            self.assertNotIn(b'People You May Know', response.data)
+            client.get('/follow/bob')
+            response = client.get('/find_friends')
+            self.assertIn(b'People You May Know', response.data)
+            self.assertIn(b'1 mutual connection<', response.data)
+            self.assertIn(b'/follow/dan', response.data)
+
+
+class SuggestionRefresherCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(self.folder.name, 'test.db')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        suggestion_refresher.shutdown()
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.folder.cleanup()
+
+    def test_refreshes_in_background(self):
+        ann, bob, cat = (User(username=name, password_hash='x')
+                         for name in ('ann', 'bob', 'cat'))
+        db.session.add_all([ann, bob, cat])
+        db.session.commit()
+        ann.follow(bob)
+        bob.follow(cat)
+        db.session.commit()
+        suggestion_refresher.notify()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            db.session.expire_all()
+            if not User.query.filter_by(suggestions_stale=True).count():
+                break
+            time.sleep(0.05)
+        self.assertEqual([(user.username, count)
+                          for user, count in get_suggestions(ann)],
+                         [('cat', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from app import create_app, db
+from models import User, Screenshot
+from thumbnails import ThumbnailGenerator, render_derivatives, \
+    derivative_path, file_digest, THUMBNAIL_SIZES, THUMBNAIL_FORMATS
+
+
+class ThumbnailCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+        self.app.config['THUMBNAIL_FOLDER'] = tempfile.mkdtemp()
+        self.app.config['THUMBNAIL_EAGER'] = True
+        for key in ('UPLOAD_FOLDER', 'THUMBNAIL_FOLDER'):
+            self.addCleanup(shutil.rmtree, self.app.config[key])
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.source = os.path.join(self.app.config['UPLOAD_FOLDER'],
+                                   'screen.jpg')
+        Image.new('RGB', (1080, 2340), color='navy').save(self.source)
+        self.digest = file_digest(self.source)
+        user = User(username='viewer')
+        user.set_password('password')
+        db.session.add(Screenshot(filename='screen.jpg',
+                                  content_hash=self.digest, user=user))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_render_derivatives(self):
+        folder = self.app.config['THUMBNAIL_FOLDER']
+        paths = render_derivatives(self.source, folder, self.digest)
+        self.assertEqual(len(paths),
+                         len(THUMBNAIL_SIZES) * len(THUMBNAIL_FORMATS))
+        for size, pixels in THUMBNAIL_SIZES.items():
+            for fmt in THUMBNAIL_FORMATS:
+                path = derivative_path(folder, self.digest, size, fmt)
+                with Image.open(path) as image:
+                    self.assertEqual(image.format.lower(), fmt)
+                    self.assertEqual(max(image.size), pixels)
+        self.assertEqual(
+            [name for name in os.listdir(os.path.dirname(paths[0]))
+             if name.endswith('.tmp')],
+            []
+        )
+
+    def test_thumbnail_route(self):
+        url = '/thumbnails/{}/small.webp'.format(self.digest)
+        with self.app.test_client() as client:
+            # Missing derivatives are generated on demand.
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'image/webp')
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            etag = response.headers['ETag']
+            self.assertFalse(etag.startswith('W/'))
+
+            response = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+            self.assertEqual(client.get(
+                '/thumbnails/{}/huge.webp'.format(self.digest)
+            ).status_code, 404)
+            self.assertEqual(client.get(
+                '/thumbnails/{}/small.webp'.format('0' * 64)
+            ).status_code, 404)
+
+    def test_background_generation(self):
+        self.app.config['THUMBNAIL_EAGER'] = False
+        generator = ThumbnailGenerator()
+        self.addCleanup(generator.shutdown)
+        path = generator.ensure(self.source, self.digest, 'large', 'jpeg',
+                                timeout=60)
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (295, 640))
+        self.assertEqual(generator.pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
 import unittest
 from app import create_app, db
-from models import User
+from models import User, UserTroop
+from sqlalchemy import text
+from user_details import parse_troop_text, parse_enforcer_text, \
+    validate_details, migrate_legacy_details
 
 
 class UserDetailsCase(unittest.TestCase):
@@ -41,8 +44,15 @@ class UserDetailsCase(unittest.TestCase):
 
             # Check that the details were saved
             user = User.query.filter_by(username='testuser').first()
-            self.assertEqual(user.user_troops, 'Bruiser,T1,1000')
-            self.assertEqual(user.user_enforcers, 'Bubba,Grand,true')
+            self.assertEqual(user.battalion(), {
+                'troops': [
+                    {'type': 'Bruiser', 'tier': 'T1', 'quantity': 1000}
+                ],
+                'enforcers': [
+                    {'name': 'Bubba', 'tier': 'Grand',
+                     'has_signature_weapon': True}
+                ],
+            })
 
             # Check that the details are loaded on the index page
             response = client.get('/')
@@ -50,6 +60,133 @@ class UserDetailsCase(unittest.TestCase):
             self.assertIn(b'Bruiser,T1,1000', response.data)
             self.assertIn(b'Bubba,Grand,true', response.data)
 
+    def login(self, client):
+        u = User(username='testuser')
+        u.set_password('password')
+        db.session.add(u)
+        db.session.commit()
+        client.post('/auth/login', data=dict(
+            username='testuser',
+            password='password'
+        ))
+        return u
+
+    def test_invalid_details_are_rejected(self):
+        with self.app.test_client() as client:
+            user = self.login(client)
+            for troops, enforcers, error in (
+                ('Bruiser,T1', '', 'Line 1'),
+                ('Bruiser,T9,10', '', 'Unknown tier'),
+                ('Ninja,T1,10', '', 'Unknown troop type'),
+                ('Bruiser,T1,0', '', 'quantity'),
+                ('Bruiser,T1,5\nbruiser,t1,6', '', 'listed twice'),
+                ('', 'Bubba,Grand,maybe', 'Invalid enforcer'),
+                ('', 'Don Ali,Grand,true', 'no signature weapon'),
+            ):
+                response = client.post('/save_user_details', data=dict(
+                    user_troops=troops, user_enforcers=enforcers
+                ))
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(error, response.json['error'])
+            self.assertEqual(user.battalion(),
+                             {'troops': [], 'enforcers': []})
+
+    def test_battalion_api(self):
+        with self.app.test_client() as client:
+            self.assertNotEqual(client.get('/api/battalion').status_code,
+                                200)
+            self.login(client)
+            self.assertEqual(client.get('/api/battalion').json,
+                             {'troops': [], 'enforcers': []})
+            battalion = {
+                'troops': [
+                    {'type': 'hitman', 'tier': 't2', 'quantity': 500},
+                    {'type': 'Bruiser', 'tier': 'T1', 'quantity': 1000},
+                ],
+                'enforcers': [
+                    {'name': 'Red Thorn', 'tier': 'Elite'},
+                ],
+            }
+            response = client.put('/api/battalion', json=battalion)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json, {
+                'troops': [
+                    {'type': 'Hitman', 'tier': 'T2', 'quantity': 500},
+                    {'type': 'Bruiser', 'tier': 'T1', 'quantity': 1000},
+                ],
+                'enforcers': [
+                    {'name': 'Red Thorn', 'tier': 'Elite',
+                     'has_signature_weapon': False},
+                ],
+            })
+            # Saving over existing rows with the same keys.
+            battalion['troops'][0]['quantity'] = 700
+            response = client.put('/api/battalion', json=battalion)
+            self.assertEqual(response.json['troops'][0]['quantity'], 700)
+            self.assertEqual(UserTroop.query.count(), 2)
+
+            response = client.put('/api/battalion', json={'troops': 'x'})
+            self.assertEqual(response.status_code, 400)
+
+            response = client.post('/api/optimize/troops', json={
+                'user': 'saved',
+                'opponent': {'troops': [
+                    {'type': 'Biker', 'tier': 'T2', 'quantity': 800}
+                ]},
+            })
+            self.assertEqual(response.status_code, 200)
+            # The march size defaults to the saved troop count.
+            self.assertLessEqual(response.json['total_troops'], 1700)
+
+    def test_saved_battalion_needs_login(self):
+        with self.app.test_client() as client:
+            response = client.post('/api/optimize/troops', json={
+                'user': 'saved',
+                'opponent': {'troops': [
+                    {'type': 'Biker', 'tier': 'T2', 'quantity': 800}
+                ]},
+            })
+            self.assertEqual(response.status_code, 400)
+
+    def test_lenient_parsing(self):
+        troops = parse_troop_text('Bruiser,T1,10\nnonsense\nNinja,T1,5',
+                                  strict=False)
+        enforcers = parse_enforcer_text('Bubba,Grand,true;;Captain,Rare',
+                                        strict=False)
+        self.assertEqual(validate_details(troops, enforcers, strict=False), (
+            [{'type': 'Bruiser', 'tier': 'T1', 'quantity': 10}],
+            [{'name': 'Bubba', 'tier': 'Grand',
+              'has_signature_weapon': True}],
+        ))
+
+    def test_migrate_legacy_details(self):
+        self.assertEqual(migrate_legacy_details(), 0)
+        db.session.execute(
+            text('ALTER TABLE user ADD COLUMN user_troops TEXT')
+        )
+        db.session.execute(
+            text('ALTER TABLE user ADD COLUMN user_enforcers TEXT')
+        )
+        u = User(username='legacy', password_hash='x')
+        db.session.add(u)
+        db.session.commit()
+        db.session.execute(text(
+            "UPDATE user SET user_troops = 'Bruiser,T1,1000\nbad line', "
+            "user_enforcers = 'Bubba,Grand,true;Red Thorn,Elite,false'"
+        ))
+        self.assertEqual(migrate_legacy_details(), 1)
+        db.session.commit()
+        self.assertEqual(u.battalion(), {
+            'troops': [{'type': 'Bruiser', 'tier': 'T1', 'quantity': 1000}],
+            'enforcers': [
+                {'name': 'Bubba', 'tier': 'Grand',
+                 'has_signature_weapon': True},
+                {'name': 'Red Thorn', 'tier': 'Elite',
+                 'has_signature_weapon': False},
+            ],
+        })
+        self.assertEqual(migrate_legacy_details(), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
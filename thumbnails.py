@@ -0,0 +1,217 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from PIL import Image, ImageOps
+
+from metrics import timed
+
+# Longest side of each derivative, in pixels. 'medium' doubles 'small' for
+# high-density screens.
+THUMBNAIL_SIZES = {'small': 128, 'medium': 256, 'large': 640}
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+THUMBNAIL_QUALITY = 80
+# How long a request waits for a missing derivative to be generated.
+THUMBNAIL_TIMEOUT = 10
+HASH_CHUNK_SIZE = 64 * 1024
+DEFAULT_THUMBNAIL_WORKERS = 1
+
+
+def file_digest(path):
+    """
+    Hashes a file without reading it into memory at once.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        str: The hex SHA-256 digest of the file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derivative_path(folder, digest, size, fmt):
+    """
+    Returns where a derivative is cached.
+
+    Derivatives are addressed by the digest of their source image, so
+    identical uploads share them and a cached file never goes stale.
+
+    Args:
+        folder (str): The derivative cache folder.
+        digest (str): The source image's content digest.
+        size (str): A key of THUMBNAIL_SIZES.
+        fmt (str): A key of THUMBNAIL_FORMATS.
+
+    Returns:
+        str: The path of the derivative.
+    """
+    return os.path.join(
+        folder, digest[:2], '{}-{}.{}'.format(digest, size, fmt)
+    )
+
+
+def _save_atomic(image, path, image_format):
+    """Write an image under a temporary name, then move it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                     suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, image_format, quality=THUMBNAIL_QUALITY)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+@timed('thumbnails.render_derivatives')
+def render_derivatives(source, folder, digest):
+    """
+    Generates every size and format of a source image.
+
+    The source is decoded once, at reduced resolution where the decoder
+    supports it (JPEG can scale by 1/2 to 1/8 while decoding), and each
+    size is downscaled from the next larger one.
+
+    Args:
+        source (str): The path to the source image.
+        folder (str): The derivative cache folder.
+        digest (str): The source image's content digest.
+
+    Returns:
+        list: The paths of the written derivatives.
+    """
+    largest = max(THUMBNAIL_SIZES.values())
+    with Image.open(source) as image:
+        image.draft('RGB', (largest * 2, largest * 2))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    paths = []
+    for size, pixels in sorted(THUMBNAIL_SIZES.items(),
+                               key=lambda item: -item[1]):
+        image.thumbnail((pixels, pixels), Image.LANCZOS, reducing_gap=2.0)
+        for fmt, (image_format, _) in THUMBNAIL_FORMATS.items():
+            path = derivative_path(folder, digest, size, fmt)
+            _save_atomic(image, path, image_format)
+            paths.append(path)
+    return paths
+
+
+class ThumbnailGenerator:
+    """
+    Generates image derivatives in a pool of worker processes.
+
+    Uploads queue their derivatives and return straight away; a request
+    for a derivative that is missing (e.g. after the cache folder was
+    cleared) regenerates it on demand. Concurrent requests for the same
+    image share one generation.
+    """
+
+    def __init__(self, max_workers=DEFAULT_THUMBNAIL_WORKERS):
+        self.max_workers = max_workers
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def init_app(self, app):
+        """Read the pool size from the app config."""
+        self.max_workers = app.config.get('THUMBNAIL_WORKERS') or \
+            self.max_workers
+        app.extensions['thumbnail_generator'] = self
+
+    def _get_executor(self):
+        """Start the worker pool on first use."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self.executor
+
+    @staticmethod
+    def folder():
+        """Return the derivative cache folder of the current app."""
+        return os.path.abspath(current_app.config['THUMBNAIL_FOLDER'])
+
+    def submit(self, source, digest):
+        """
+        Queues the derivatives of an image.
+
+        Generates them inline instead when THUMBNAIL_EAGER is set.
+
+        Args:
+            source (str): The path to the source image.
+            digest (str): The source image's content digest.
+
+        Returns:
+            concurrent.futures.Future: The generation, or None if it ran
+                                       inline.
+        """
+        folder = self.folder()
+        source = os.path.abspath(source)
+        if current_app.config.get('THUMBNAIL_EAGER'):
+            render_derivatives(source, folder, digest)
+            return None
+        with self.lock:
+            future = self.pending.get(digest)
+            if future is None:
+                future = self._get_executor().submit(
+                    render_derivatives, source, folder, digest
+                )
+                self.pending[digest] = future
+                future.add_done_callback(
+                    lambda future: self._generation_done(digest, future)
+                )
+        return future
+
+    def _generation_done(self, digest, future):
+        """Forget a finished generation."""
+        with self.lock:
+            if self.pending.get(digest) is future:
+                del self.pending[digest]
+
+    def ensure(self, source, digest, size, fmt, timeout=THUMBNAIL_TIMEOUT):
+        """
+        Returns the path of a derivative, generating it if it is missing.
+
+        Args:
+            source (str): The path to the source image.
+            digest (str): The source image's content digest.
+            size (str): A key of THUMBNAIL_SIZES.
+            fmt (str): A key of THUMBNAIL_FORMATS.
+            timeout (float): How long to wait for the generation.
+
+        Returns:
+            str: The path of the derivative.
+
+        Raises:
+            concurrent.futures.TimeoutError: If the generation takes longer
+                                             than the timeout.
+            OSError: If the source image cannot be read.
+        """
+        path = derivative_path(self.folder(), digest, size, fmt)
+        if not os.path.exists(path):
+            future = self.submit(source, digest)
+            if future is not None:
+                future.result(timeout)
+        return path
+
+    def shutdown(self):
+        """Stop the worker pool, dropping generations that have not started."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+thumbnail_generator = ThumbnailGenerator()
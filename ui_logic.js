@@ -154,7 +154,10 @@ async function handleRecommendTroopMix() {
     console.log("Parsed Opponent Data for Troop Mix Rec:", { opponentTroops, opponentEnforcers, opponentTcLevel });
 
     if (typeof recommendTroopMix === 'function') {
-        const recommendation = await recommendTroopMix(opponentTroops, opponentEnforcers, { training_center_level: opponentTcLevel });
+        const recommendation = await recommendTroopMix(opponentTroops, opponentEnforcers, { training_center_level: opponentTcLevel }, {
+            userTroops: parseTroopInputs('user-troops-text'),
+            userMiscBuffs: { training_center_level: getTcLevel('user-tc-level') }
+        });
         displayTroopRecommendation(recommendation);
         if (recommendation && recommendation.simulation_result) {
             displayBattleLog(recommendation.simulation_result.log);
@@ -192,7 +195,9 @@ function handleSaveUserDetails() {
         if (response.ok) {
             showToast('Your details have been saved.', 'success');
         } else {
-            showToast('There was an error saving your details.', 'danger');
+            response.json()
+                .then(data => showToast(data.error || 'There was an error saving your details.', 'danger'))
+                .catch(() => showToast('There was an error saving your details.', 'danger'));
         }
     });
 }
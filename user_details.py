@@ -0,0 +1,277 @@
+from sqlalchemy import inspect, text
+
+from app import db
+from game_data import get_game_data
+from models import User, UserTroop, UserEnforcer
+
+# Limits on what one user can save.
+MAX_TROOP_ENTRIES = 100
+MAX_ENFORCER_ENTRIES = 100
+MAX_TROOP_QUANTITY = 10 ** 9
+# Columns the details were stored in as free text before they had tables.
+LEGACY_COLUMNS = ('user_troops', 'user_enforcers')
+
+
+def parse_troop_text(value, strict=True):
+    """
+    Parses troops in the text form of the index page.
+
+    One troop per line, as 'Type,Tier,Quantity', e.g. 'Bruiser,T1,1000'.
+
+    Args:
+        value (str): The text.
+        strict (bool): Whether to raise on malformed lines rather than skip
+                       them.
+
+    Returns:
+        list: Troop dicts with 'type', 'tier' and 'quantity'.
+
+    Raises:
+        ValueError: If strict and a line is malformed.
+    """
+    troops = []
+    for number, line in enumerate((value or '').splitlines(), 1):
+        if not line.strip():
+            continue
+        parts = [part.strip() for part in line.split(',')]
+        try:
+            if len(parts) != 3:
+                raise ValueError
+            troops.append({'type': parts[0], 'tier': parts[1],
+                           'quantity': int(parts[2])})
+        except ValueError:
+            if strict:
+                raise ValueError(
+                    'Line {}: expected Type,Tier,Quantity.'.format(number)
+                ) from None
+    return troops
+
+
+def parse_enforcer_text(value, strict=True):
+    """
+    Parses enforcers in the text form of the index page.
+
+    Entries are separated by semicolons, as 'Name,Tier,true|false' where
+    the flag says whether the enforcer has its signature weapon, e.g.
+    'Bubba,Grand,true;Red Thorn,Elite,false'.
+
+    Args:
+        value (str): The text.
+        strict (bool): Whether to raise on malformed entries rather than
+                       skip them.
+
+    Returns:
+        list: Enforcer dicts with 'name', 'tier' and
+              'has_signature_weapon'.
+
+    Raises:
+        ValueError: If strict and an entry is malformed.
+    """
+    enforcers = []
+    for entry in (value or '').split(';'):
+        if not entry.strip():
+            continue
+        parts = [part.strip() for part in entry.split(',')]
+        if len(parts) == 3 and parts[2].lower() in ('true', 'false'):
+            enforcers.append({'name': parts[0], 'tier': parts[1],
+                              'has_signature_weapon':
+                                  parts[2].lower() == 'true'})
+        elif strict:
+            raise ValueError(
+                'Invalid enforcer "{}": expected Name,Tier,true or '
+                'false.'.format(entry.strip())
+            )
+    return enforcers
+
+
+def _canonical(name, names):
+    """Find a name in the game data, ignoring case."""
+    if name in names:
+        return name
+    lowered = name.lower()
+    for candidate in names:
+        if candidate.lower() == lowered:
+            return candidate
+    return None
+
+
+def validate_troop(troop, troop_stats):
+    """Check one troop entry and return it with canonical names."""
+    if not isinstance(troop, dict) or \
+            not isinstance(troop.get('type'), str) or \
+            not isinstance(troop.get('tier'), str):
+        raise ValueError('Troops need a type and a tier.')
+    troop_type = _canonical(troop['type'], troop_stats)
+    if troop_type is None:
+        raise ValueError('Unknown troop type: {}'.format(troop['type']))
+    tier = _canonical(troop['tier'], troop_stats[troop_type])
+    if tier is None:
+        raise ValueError('Unknown tier for {}: {}'.format(
+            troop_type, troop['tier']))
+    quantity = troop.get('quantity')
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or \
+            not 0 < quantity <= MAX_TROOP_QUANTITY:
+        raise ValueError('{} {} quantity must be between 1 and {}.'.format(
+            troop_type, tier, MAX_TROOP_QUANTITY))
+    return {'type': troop_type, 'tier': tier, 'quantity': quantity}
+
+
+def validate_enforcer(enforcer, game_data):
+    """Check one enforcer entry and return it with canonical names."""
+    if not isinstance(enforcer, dict) or \
+            not isinstance(enforcer.get('name'), str) or \
+            not isinstance(enforcer.get('tier'), str):
+        raise ValueError('Enforcers need a name and a tier.')
+    name = _canonical(enforcer['name'], game_data['enforcer_buffs'])
+    if name is None:
+        raise ValueError('Unknown enforcer: {}'.format(enforcer['name']))
+    tier = _canonical(enforcer['tier'],
+                      game_data['enforcer_tier_multipliers'])
+    if tier is None:
+        raise ValueError('Unknown tier for {}: {}'.format(
+            name, enforcer['tier']))
+    has_weapon = enforcer.get('has_signature_weapon', False)
+    if not isinstance(has_weapon, bool):
+        raise ValueError('has_signature_weapon must be true or false.')
+    if has_weapon and name not in game_data['signature_weapon_buffs']:
+        raise ValueError('{} has no signature weapon.'.format(name))
+    return {'name': name, 'tier': tier, 'has_signature_weapon': has_weapon}
+
+
+def validate_details(troops, enforcers, strict=True, game_data=None):
+    """
+    Checks troops and enforcers against the game data.
+
+    Names are matched case-insensitively and returned as the game data
+    spells them. Each troop type and tier, and each enforcer, may appear
+    once.
+
+    Args:
+        troops (list): Troop dicts with 'type', 'tier' and 'quantity'.
+        enforcers (list): Enforcer dicts with 'name', 'tier' and
+                          'has_signature_weapon'.
+        strict (bool): Whether to raise on invalid entries rather than
+                       drop them.
+        game_data (dict): The loaded game data. Defaults to get_game_data().
+
+    Returns:
+        tuple: (troops, enforcers), validated.
+
+    Raises:
+        ValueError: If strict and an entry is invalid.
+    """
+    game_data = game_data or get_game_data()
+    if not isinstance(troops, list) or not isinstance(enforcers, list):
+        raise ValueError('Troops and enforcers must be lists.')
+    if strict and len(troops) > MAX_TROOP_ENTRIES:
+        raise ValueError('At most {} troops are allowed.'.format(
+            MAX_TROOP_ENTRIES))
+    if strict and len(enforcers) > MAX_ENFORCER_ENTRIES:
+        raise ValueError('At most {} enforcers are allowed.'.format(
+            MAX_ENFORCER_ENTRIES))
+
+    def check(entries, validate, key, describe):
+        valid, seen = [], set()
+        for entry in entries:
+            try:
+                entry = validate(entry)
+                if key(entry) in seen:
+                    raise ValueError(
+                        '{} is listed twice.'.format(describe(entry))
+                    )
+            except ValueError:
+                if strict:
+                    raise
+                continue
+            seen.add(key(entry))
+            valid.append(entry)
+        return valid
+
+    return (
+        check(troops[:MAX_TROOP_ENTRIES],
+              lambda troop: validate_troop(troop, game_data['troop_stats']),
+              lambda troop: (troop['type'], troop['tier']),
+              lambda troop: '{} {}'.format(troop['type'], troop['tier'])),
+        check(enforcers[:MAX_ENFORCER_ENTRIES],
+              lambda enforcer: validate_enforcer(enforcer, game_data),
+              lambda enforcer: enforcer['name'],
+              lambda enforcer: enforcer['name']),
+    )
+
+
+def save_details(user, troops, enforcers):
+    """
+    Replaces a user's saved troops and enforcers.
+
+    Args:
+        user (User): The user.
+        troops (list): Validated troop dicts.
+        enforcers (list): Validated enforcer dicts.
+    """
+    user.troops = [
+        UserTroop(troop_type=troop['type'], tier=troop['tier'],
+                  quantity=troop['quantity'], position=position)
+        for position, troop in enumerate(troops)
+    ]
+    user.enforcers = [
+        UserEnforcer(name=enforcer['name'], tier=enforcer['tier'],
+                     has_signature_weapon=enforcer['has_signature_weapon'],
+                     position=position)
+        for position, enforcer in enumerate(enforcers)
+    ]
+
+
+def details_text(user):
+    """
+    Formats a user's saved troops and enforcers for the index page.
+
+    Returns:
+        tuple: (troops text, enforcers text), as parse_troop_text and
+               parse_enforcer_text read them.
+    """
+    troops = '\n'.join(
+        '{},{},{}'.format(troop.troop_type, troop.tier, troop.quantity)
+        for troop in user.troops
+    )
+    enforcers = ';'.join(
+        '{},{},{}'.format(enforcer.name, enforcer.tier,
+                          'true' if enforcer.has_signature_weapon
+                          else 'false')
+        for enforcer in user.enforcers
+    )
+    return troops, enforcers
+
+
+def migrate_legacy_details():
+    """
+    Moves details saved as free text into the troop and enforcer tables.
+
+    Entries that do not parse or validate are dropped. The text columns
+    are cleared once a user is migrated, so this is safe to run again. The
+    caller commits.
+
+    Returns:
+        int: The number of users migrated.
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns(
+        User.__tablename__
+    )}
+    if not set(LEGACY_COLUMNS) <= columns:
+        return 0
+    rows = db.session.execute(text(
+        'SELECT id, user_troops, user_enforcers FROM "user" '
+        'WHERE user_troops IS NOT NULL OR user_enforcers IS NOT NULL'
+    )).all()
+    for user_id, troops_text, enforcers_text in rows:
+        user = db.session.get(User, user_id)
+        if not user.troops and not user.enforcers:
+            save_details(user, *validate_details(
+                parse_troop_text(troops_text, strict=False),
+                parse_enforcer_text(enforcers_text, strict=False),
+                strict=False
+            ))
+        db.session.execute(text(
+            'UPDATE "user" SET user_troops = NULL, user_enforcers = NULL '
+            'WHERE id = :id'
+        ), {'id': user_id})
+    return len(rows)